@@ -16,7 +16,7 @@ from flask_jwt_extended import JWTManager
 from datetime import timedelta
 
 from config import config
-from database import init_database
+from database import init_database, get_pool_stats
 from routes import auth_bp, bots_bp, products_bp, transactions_bp, broadcast_bp, sheerid_bp, commands_bp, categories_bp
 
 
@@ -45,7 +45,7 @@ def create_app():
     # Health check endpoint
     @app.route('/health')
     def health():
-        return jsonify({'status': 'ok', 'service': 'botstore-api'})
+        return jsonify({'status': 'ok', 'service': 'botstore-api', 'db_pool': get_pool_stats()})
     
     # Root endpoint
     @app.route('/')
@@ -3,18 +3,56 @@ Database connection and models for multi-tenant SaaS platform.
 Uses Neon PostgreSQL.
 """
 
+import json
+import os
+import sys
+import threading
 import psycopg2
 from psycopg2.extras import RealDictCursor
 from contextlib import contextmanager
 from datetime import datetime
-from typing import Optional
+from typing import Iterable, Optional
 from config import config
 
+# The managed pool lives in the repository root's utils package, shared with the bot runner
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.db_pool import ManagedConnectionPool, call_site
+from utils.stock_import import import_stock_sync
+
+# NOTIFY channel the bot runner listens on for bot changes
+BOT_CHANGES_CHANNEL = "bot_changes"
+
+# NOTIFY channel the bot runner listens on for catalog (category/product/stock) changes
+CATALOG_CHANGES_CHANNEL = "catalog_changes"
+
+# Frames skipped when naming the call site of a checkout
+_POOL_WRAPPERS = ("get_connection", "get_cursor")
+
+# One pool per API worker process, created on first use (after gunicorn forks)
+_pool: Optional[ManagedConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ManagedConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ManagedConnectionPool(config.DATABASE_URL, name="api")
+    return _pool
+
+
+def get_pool_stats() -> dict:
+    """Occupancy and per call site wait/hold stats of this worker's pool."""
+    return _pool.stats() if _pool else {}
+
 
 @contextmanager
 def get_connection():
-    """Get database connection with context manager."""
-    conn = psycopg2.connect(config.DATABASE_URL)
+    """Get database connection from the pool with context manager."""
+    pool = _get_pool()
+    conn = pool.getconn(call_site(_POOL_WRAPPERS))
     try:
         yield conn
         conn.commit()
@@ -22,7 +60,7 @@ def get_connection():
         conn.rollback()
         raise
     finally:
-        conn.close()
+        pool.putconn(conn)
 
 
 @contextmanager
@@ -214,6 +252,24 @@ def get_user_by_id(user_id: int) -> Optional[dict]:
 
 # ==================== BOT OPERATIONS ====================
 
+def notify_bot_change(cursor, bot_id: int, action: str):
+    """
+    Tell the bot runner a bot was created, updated or deleted.
+    Delivered when the surrounding transaction commits.
+    """
+    payload = json.dumps({'bot_id': bot_id, 'action': action})
+    cursor.execute("SELECT pg_notify(%s, %s)", (BOT_CHANGES_CHANNEL, payload))
+
+
+def notify_catalog_change(cursor, bot_id: int):
+    """
+    Tell the bot runner a bot's categories, products or stock changed so
+    it drops its cached catalog. Delivered when the surrounding transaction commits.
+    """
+    payload = json.dumps({'bot_id': bot_id})
+    cursor.execute("SELECT pg_notify(%s, %s)", (CATALOG_CHANGES_CHANNEL, payload))
+
+
 def create_bot(user_id: int, telegram_token: str, bot_username: str = None, bot_name: str = None, 
                bot_type: str = 'store', pakasir_slug: str = None, pakasir_api_key: str = None) -> Optional[dict]:
     """Create a new bot."""
@@ -223,7 +279,9 @@ def create_bot(user_id: int, telegram_token: str, bot_username: str = None, bot_
             VALUES (%s, %s, %s, %s, %s, %s, %s)
             RETURNING id, user_id, telegram_token, bot_username, bot_name, bot_type, is_active, created_at
         """, (user_id, telegram_token, bot_username, bot_name, bot_type, pakasir_slug, pakasir_api_key))
-        return dict(cursor.fetchone())
+        bot = dict(cursor.fetchone())
+        notify_bot_change(cursor, bot['id'], 'create')
+        return bot
 
 
 def get_bots_by_user(user_id: int) -> list[dict]:
@@ -256,7 +314,7 @@ def get_bot_by_id(bot_id: int, user_id: int = None) -> Optional[dict]:
 
 def update_bot(bot_id: int, **kwargs) -> Optional[dict]:
     """Update a bot."""
-    allowed_fields = ['bot_name', 'bot_type', 'pakasir_slug', 'pakasir_api_key', 'is_active']
+    allowed_fields = ['bot_name', 'bot_type', 'pakasir_slug', 'pakasir_api_key', 'update_mode', 'is_active']
     updates = {k: v for k, v in kwargs.items() if k in allowed_fields and v is not None}
     
     if not updates:
@@ -273,6 +331,8 @@ def update_bot(bot_id: int, **kwargs) -> Optional[dict]:
             RETURNING *
         """, values)
         row = cursor.fetchone()
+        if row:
+            notify_bot_change(cursor, bot_id, 'update')
         return dict(row) if row else None
 
 
@@ -280,7 +340,10 @@ def delete_bot(bot_id: int) -> bool:
     """Delete a bot."""
     with get_cursor() as cursor:
         cursor.execute("DELETE FROM bots WHERE id = %s", (bot_id,))
-        return cursor.rowcount > 0
+        deleted = cursor.rowcount > 0
+        if deleted:
+            notify_bot_change(cursor, bot_id, 'delete')
+        return deleted
 
 
 # ==================== PRODUCT OPERATIONS ====================
@@ -293,7 +356,9 @@ def create_product(bot_id: int, name: str, price: int, category_id: int = None,
             VALUES (%s, %s, %s, %s, %s)
             RETURNING *
         """, (bot_id, category_id, name, price, description))
-        return dict(cursor.fetchone())
+        product = dict(cursor.fetchone())
+        notify_catalog_change(cursor, bot_id)
+        return product
 
 
 def get_products_by_bot(bot_id: int) -> list[dict]:
@@ -302,25 +367,46 @@ def get_products_by_bot(bot_id: int) -> list[dict]:
         cursor.execute("""
             SELECT p.*, 
                    c.name as category_name,
-                   (SELECT COUNT(*) FROM product_stock WHERE product_id = p.id AND is_sold = false) as stock,
-                   (SELECT COUNT(*) FROM product_stock WHERE product_id = p.id AND is_sold = true) as sold
+                   COALESCE(sc.available - sc.reserved, 0) as stock,
+                   COALESCE(sc.sold, 0) as sold
             FROM products p
             LEFT JOIN categories c ON p.category_id = c.id
+            LEFT JOIN LATERAL (
+                SELECT SUM(available) as available, SUM(sold) as sold, SUM(reserved) as reserved
+                FROM product_stock_counts WHERE product_id = p.id
+            ) sc ON true
             WHERE p.bot_id = %s
             ORDER BY p.created_at DESC
         """, (bot_id,))
         return [dict(row) for row in cursor.fetchall()]
 
 
+def import_product_stock(product_id: int, lines: Iterable[str], progress=None) -> dict:
+    """
+    Bulk-import stock lines into a product (COPY in batches), skipping blank
+    lines and lines the product already has.
+
+    Args:
+        product_id: Product the lines are added to
+        lines: Stock lines, e.g. iter_lines(read_chunks(upload)) for a streamed upload
+        progress: Called after every batch with the counts so far
+
+    Returns:
+        {'received', 'added', 'duplicates'}
+    """
+    with get_cursor() as cursor:
+        result = import_stock_sync(cursor, product_id, lines, progress)
+        if result['added']:
+            cursor.execute("SELECT bot_id FROM products WHERE id = %s", (product_id,))
+            row = cursor.fetchone()
+            if row:
+                notify_catalog_change(cursor, row['bot_id'])
+        return result
+
+
 def add_product_stock(product_id: int, contents: list[str]) -> int:
     """Add stock items to a product. Returns count of items added."""
-    with get_cursor() as cursor:
-        for content in contents:
-            cursor.execute("""
-                INSERT INTO product_stock (product_id, content)
-                VALUES (%s, %s)
-            """, (product_id, content.strip()))
-        return len(contents)
+    return import_product_stock(product_id, contents)['added']
 
 
 # ==================== TRANSACTION OPERATIONS ====================
@@ -344,15 +430,15 @@ def get_transactions_by_bot(bot_id: int, limit: int = 50) -> list[dict]:
 
 
 def get_bot_stats(bot_id: int) -> dict:
-    """Get statistics for a bot."""
+    """Get statistics for a bot (from bot_stats counters)."""
     with get_cursor() as cursor:
         cursor.execute("""
-            SELECT 
-                (SELECT COUNT(*) FROM products WHERE bot_id = %s) as total_products,
-                (SELECT COUNT(*) FROM bot_users WHERE bot_id = %s) as total_users,
-                (SELECT COUNT(*) FROM orders WHERE bot_id = %s AND status = 'completed') as total_transactions,
-                (SELECT COALESCE(SUM(amount), 0) FROM orders WHERE bot_id = %s AND status = 'completed') as total_revenue
-        """, (bot_id, bot_id, bot_id, bot_id))
+            SELECT COALESCE(SUM(total_products), 0) as total_products,
+                   COALESCE(SUM(total_users), 0) as total_users,
+                   COALESCE(SUM(total_transactions), 0) as total_transactions,
+                   COALESCE(SUM(total_revenue), 0)::bigint as total_revenue
+            FROM bot_stats WHERE bot_id = %s
+        """, (bot_id,))
         return dict(cursor.fetchone())
 
 
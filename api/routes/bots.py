@@ -166,6 +166,7 @@ def get_single_bot(bot_id: int):
             'bot_type': bot.get('bot_type', 'store'),
             'pakasir_slug': bot.get('pakasir_slug'),
             'pakasir_api_key': '••••••••' if bot.get('pakasir_api_key') else None,
+            'update_mode': bot.get('update_mode'),
             'is_active': bot['is_active'],
             'created_at': bot['created_at'].isoformat() if bot['created_at'] else None,
         },
@@ -185,12 +186,17 @@ def update_single_bot(bot_id: int):
     
     data = request.get_json()
     
+    update_mode = data.get('update_mode')
+    if update_mode is not None and update_mode not in ['polling', 'webhook']:
+        return jsonify({'error': 'Mode update tidak valid'}), 400
+    
     updated_bot = update_bot(
         bot_id,
         bot_name=data.get('bot_name'),
         bot_type=data.get('bot_type'),
         pakasir_slug=data.get('pakasir_slug'),
         pakasir_api_key=data.get('pakasir_api_key'),
+        update_mode=update_mode,
         is_active=data.get('is_active'),
     )
     
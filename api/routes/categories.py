@@ -5,7 +5,7 @@ Category management routes.
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
-from database import get_bot_by_id
+from database import get_bot_by_id, notify_catalog_change
 
 categories_bp = Blueprint('categories', __name__, url_prefix='/api')
 
@@ -33,7 +33,9 @@ def create_category(bot_id: int, name: str, description: str = None):
             VALUES (%s, %s, %s)
             RETURNING *
         """, (bot_id, name, description))
-        return dict(cursor.fetchone())
+        category = dict(cursor.fetchone())
+        notify_catalog_change(cursor, bot_id)
+        return category
 
 
 def update_category(category_id: int, **kwargs):
@@ -53,6 +55,8 @@ def update_category(category_id: int, **kwargs):
             WHERE id = %s RETURNING *
         """, values)
         row = cursor.fetchone()
+        if row:
+            notify_catalog_change(cursor, row['bot_id'])
         return dict(row) if row else None
 
 
@@ -60,8 +64,11 @@ def delete_category(category_id: int):
     """Delete a category."""
     from database import get_cursor
     with get_cursor() as cursor:
-        cursor.execute("DELETE FROM categories WHERE id = %s", (category_id,))
-        return cursor.rowcount > 0
+        cursor.execute("DELETE FROM categories WHERE id = %s RETURNING bot_id", (category_id,))
+        row = cursor.fetchone()
+        if row:
+            notify_catalog_change(cursor, row['bot_id'])
+        return row is not None
 
 
 @categories_bp.route('/bots/<int:bot_id>/categories', methods=['GET'])
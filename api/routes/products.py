@@ -2,13 +2,21 @@
 Product management routes.
 """
 
+import logging
+
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
 from database import (
     get_bot_by_id, create_product, get_products_by_bot,
-    add_product_stock
+    add_product_stock, import_product_stock
 )
+from utils.stock_import import iter_lines, read_chunks
+
+logger = logging.getLogger(__name__)
+
+# Stock files accepted as a multipart upload
+STOCK_FILE_EXTENSIONS = ('.txt', '.csv')
 
 products_bp = Blueprint('products', __name__, url_prefix='/api')
 
@@ -91,22 +99,48 @@ def create_new_product(bot_id: int):
 @products_bp.route('/products/<int:product_id>/stock', methods=['POST'])
 @jwt_required()
 def add_stock(product_id: int):
-    """Add stock to a product."""
-    user_id = int(get_jwt_identity())
-    data = request.get_json()
+    """
+    Add stock to a product.
     
-    stock_items = data.get('stock_items', [])
+    Accepts JSON {"stock_items": [...]}, a multipart .txt/.csv upload in the
+    'file' field, or a text/plain or text/csv body with one item per line.
+    Uploads are read as they stream in and imported in batches; lines the
+    product already has are skipped.
+    """
+    user_id = int(get_jwt_identity())
     
-    if not stock_items:
-        return jsonify({'error': 'Stock items wajib diisi'}), 400
+    if request.is_json:
+        stock_items = (request.get_json() or {}).get('stock_items', [])
+        if not stock_items:
+            return jsonify({'error': 'Stock items wajib diisi'}), 400
+        lines = stock_items
+    elif request.mimetype == 'multipart/form-data':
+        upload = request.files.get('file')
+        if not upload or not upload.filename.lower().endswith(STOCK_FILE_EXTENSIONS):
+            return jsonify({'error': 'Kirim file .txt atau .csv di field "file"'}), 400
+        lines = iter_lines(read_chunks(upload.stream))
+    else:
+        lines = iter_lines(read_chunks(request.stream))
     
     # TODO: Verify product ownership through bot
     
+    def progress(counts: dict):
+        logger.info(
+            f"Stock import product {product_id} (user {user_id}): "
+            f"{counts['received']} received, {counts['added']} added"
+        )
+    
     try:
-        count = add_product_stock(product_id, stock_items)
-        return jsonify({
-            'message': f'{count} item berhasil ditambahkan',
-            'added_count': count
-        })
+        result = import_product_stock(product_id, lines, progress)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+    
+    if not result['received']:
+        return jsonify({'error': 'Stock items wajib diisi'}), 400
+    
+    return jsonify({
+        'message': f"{result['added']} item berhasil ditambahkan",
+        'added_count': result['added'],
+        'received_count': result['received'],
+        'duplicate_count': result['duplicates']
+    })
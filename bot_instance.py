@@ -3,12 +3,63 @@ Bot Instance Module.
 Wraps a single Telegram bot with its configuration and handlers.
 """
 
+import asyncio
 import logging
-from telegram.ext import Application
+import time
+from typing import Optional
+
+from telegram import Update, User
+from telegram.ext import Application, ExtBot, TypeHandler
+
+from bot_persistence import build_persistence
+from database_pg import update_bot_identity
+from utils.metrics import BOT_UPDATES
+from utils.telegram_http import get_shared_requests
+from utils.update_processor import build_update_processor
 
 logger = logging.getLogger(__name__)
 
 
+class CachedIdentityBot(ExtBot):
+    """
+    ExtBot that answers its first getMe (issued by Application.initialize)
+    from the identity cached in the bots table instead of the network.
+    """
+    
+    __slots__ = ("_cached_identity",)
+    
+    def __init__(self, *args, identity: Optional[User] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cached_identity = identity
+    
+    async def get_me(self, *args, **kwargs) -> User:
+        if self._cached_identity is not None:
+            identity, self._cached_identity = self._cached_identity, None
+            self._bot_user = identity
+            return identity
+        return await super().get_me(*args, **kwargs)
+
+
+def cached_identity(bot_config: dict) -> Optional[User]:
+    """
+    Build the bot's Telegram user from its bots row, if enough is known.
+    Needs the getMe identity the runner cached, never the tenant's bot_name.
+    """
+    token = bot_config.get('telegram_token') or ''
+    username = (bot_config.get('bot_username') or '').lstrip('@')
+    first_name = bot_config.get('telegram_first_name')
+    telegram_id = token.split(':', 1)[0]
+    if not username or not first_name or not telegram_id.isdigit():
+        return None
+    
+    return User(
+        id=int(telegram_id),
+        is_bot=True,
+        first_name=first_name,
+        username=username
+    )
+
+
 class BotInstance:
     """Represents a single bot instance with its configuration."""
     
@@ -21,20 +72,46 @@ class BotInstance:
                 - id: Bot ID
                 - telegram_token: Telegram bot token
                 - bot_username: Bot username
-                - bot_name: Bot display name
+                - bot_name: Bot display name (the tenant's label)
+                - telegram_first_name: first_name from getMe, cached by the runner
                 - bot_type: 'store', 'verification', or 'custom'
                 - pakasir_slug: Pakasir project slug (for store bots)
                 - pakasir_api_key: Pakasir API key (for store bots)
+                - update_mode: 'polling', 'webhook' or None (use runner default)
         """
+        self.config = dict(bot_config)
         self.bot_id = bot_config['id']
         self.bot_type = bot_config.get('bot_type', 'store')
         self.bot_username = bot_config.get('bot_username', 'Unknown')
         self.bot_name = bot_config.get('bot_name', 'Unnamed Bot')
         self.pakasir_slug = bot_config.get('pakasir_slug')
         self.pakasir_api_key = bot_config.get('pakasir_api_key')
+        self.update_mode = bot_config.get('update_mode')
+        self.webhook = None
+        self.startup_timings: dict = {}
         
-        # Build application
-        self.app = Application.builder().token(bot_config['telegram_token']).build()
+        # Build application; getMe during initialize() is served from the
+        # bots table when possible to keep cold starts off the network
+        identity = cached_identity(bot_config)
+        self._identity_cached = identity is not None
+        # All bots in the process share one connection pool to Telegram
+        request, get_updates_request = get_shared_requests()
+        bot = CachedIdentityBot(
+            token=bot_config['telegram_token'],
+            request=request,
+            get_updates_request=get_updates_request,
+            identity=identity
+        )
+        builder = Application.builder().bot(bot)
+        # user_data/chat_data and conversation states survive restarts
+        persistence = build_persistence(self.bot_id)
+        if persistence:
+            builder = builder.persistence(persistence)
+        # Different users are served concurrently, one user's updates in order
+        self.update_processor = build_update_processor(self.bot_type)
+        if self.update_processor:
+            builder = builder.concurrent_updates(self.update_processor)
+        self.app = builder.build()
         
         # Store bot_id in bot_data for handlers to access
         self.app.bot_data['bot_id'] = self.bot_id
@@ -47,6 +124,9 @@ class BotInstance:
     
     def _register_handlers(self):
         """Register handlers based on bot type."""
+        # Counts every update before the regular handler groups
+        self.app.add_handler(TypeHandler(Update, self._count_update), group=-1)
+        
         if self.bot_type == 'store':
             self._register_store_handlers()
         elif self.bot_type == 'verification':
@@ -58,11 +138,15 @@ class BotInstance:
         else:
             self._register_custom_handlers()
     
+    async def _count_update(self, update: Update, context):
+        BOT_UPDATES.inc(self.bot_id)
+    
     def _register_store_handlers(self):
         """Register store bot handlers."""
         from handlers.store import get_all_store_handlers
         
-        for handler in get_all_store_handlers(self.bot_id):
+        persistent = self.app.persistence is not None
+        for handler in get_all_store_handlers(self.bot_id, persistent=persistent):
             self.app.add_handler(handler)
         
         logger.info(f"[{self.bot_username}] Store handlers registered")
@@ -105,17 +189,64 @@ class BotInstance:
         
         logger.info(f"[{self.bot_username}] Custom handlers registered")
     
-    async def start(self):
-        """Initialize and start the bot (without blocking)."""
+    async def start(self, webhook=None):
+        """
+        Initialize and start the bot (without blocking).
+        
+        Args:
+            webhook: WebhookIngress to receive updates through. If None,
+                the bot long-polls getUpdates itself.
+        """
+        timings = {}
+        began = time.perf_counter()
+        
         await self.app.initialize()
-        await self.app.start()
-        await self.app.updater.start_polling(drop_pending_updates=True)
-        logger.info(f"✅ Bot started: @{self.bot_username} (ID: {self.bot_id}, Type: {self.bot_type})")
+        timings['initialize'] = time.perf_counter() - began
+        
+        if not self._identity_cached:
+            await self._remember_identity()
+        
+        mark = time.perf_counter()
+        if not self.app.running:
+            await self.app.start()
+        timings['start'] = time.perf_counter() - mark
+        
+        mark = time.perf_counter()
+        if webhook:
+            await webhook.register(self)
+            self.webhook = webhook
+        else:
+            await self.app.updater.start_polling(drop_pending_updates=True)
+        timings['updates'] = time.perf_counter() - mark
+        timings['total'] = time.perf_counter() - began
+        self.startup_timings = {k: round(v, 3) for k, v in timings.items()}
+        
+        mode = "webhook" if self.webhook else "polling"
+        logger.info(f"✅ Bot started: @{self.bot_username} (ID: {self.bot_id}, Type: {self.bot_type}, Mode: {mode})")
+    
+    async def _remember_identity(self):
+        """Store the identity fetched by getMe so the next start can skip it."""
+        me = self.app.bot.bot
+        username = f"@{me.username}"
+        if username == self.bot_username and me.first_name == self.config.get('telegram_first_name'):
+            return
+        
+        self.bot_username = self.config['bot_username'] = username
+        self.config['telegram_first_name'] = me.first_name
+        try:
+            await asyncio.to_thread(update_bot_identity, self.bot_id, username, me.first_name)
+        except Exception as e:
+            logger.warning(f"[{username}] Could not cache bot identity: {e}")
     
     async def stop(self):
         """Stop the bot."""
-        await self.app.updater.stop()
-        await self.app.stop()
+        if self.webhook:
+            self.webhook.unregister(self.bot_id)
+            self.webhook = None
+        elif self.app.updater.running:
+            await self.app.updater.stop()
+        if self.app.running:
+            await self.app.stop()
         await self.app.shutdown()
         logger.info(f"⏹️ Bot stopped: @{self.bot_username}")
     
@@ -4,24 +4,100 @@ Orchestrates multiple bot instances from the database.
 """
 
 import asyncio
+import json
 import logging
+import os
 import signal
 import sys
-from typing import Dict, Optional
+import time
+from typing import Dict, List, Optional
 
-from database_pg import get_active_bots, get_bot_by_id
+from telegram.error import RetryAfter
+
+from database_pg import (
+    get_active_bots,
+    get_bot_by_id,
+    get_pending_order_counts,
+    get_pool_stats,
+    BOT_CHANGES_CHANNEL,
+    CATALOG_CHANGES_CHANNEL
+)
+from database_async import (
+    init_async_pool,
+    close_async_pool,
+    open_listen_connection,
+    release_expired_reservations
+)
 from bot_instance import BotInstance
+from bot_supervisor import BotSupervisor
+from payment_reconciler import PAYMENT_SCAN_INTERVAL, PaymentReconciler
+from catalog_cache import clear_catalog_cache, get_catalog_stats, invalidate_catalog
+from known_users import flush_profiles, forget_bot, get_known_users_stats
+from services.pakasir import close_pakasir_session, get_pakasir_stats
+from webhook.telegram import WebhookIngress, WEBHOOK_BASE_URL, WEBHOOK_PORT
+from utils.metrics import BOTS_RUNNING, METRICS_PORT, MetricsServer, monitor_event_loop
+from utils.telegram_http import get_transport_stats
 
 logger = logging.getLogger(__name__)
 
+# Default update delivery for bots without their own update_mode:
+# 'polling' (each bot long-polls getUpdates) or 'webhook' (shared ingress)
+BOT_UPDATE_MODE = os.getenv("BOT_UPDATE_MODE", "polling").lower()
+
+# How often registered webhooks are checked against Telegram (seconds)
+WEBHOOK_REFRESH_INTERVAL = int(os.getenv("WEBHOOK_REFRESH_INTERVAL", "900"))
+
+# Fallback sweep comparing running bots with the database (seconds)
+BOT_RECONCILE_INTERVAL = int(os.getenv("BOT_RECONCILE_INTERVAL", "300"))
+
+# How often stock held by unpaid, expired orders is released (seconds)
+STOCK_SWEEP_INTERVAL = int(os.getenv("STOCK_SWEEP_INTERVAL", "60"))
+
+# Stock holds released per statement during a sweep
+STOCK_SWEEP_BATCH = 1000
+
+# Seconds between liveness probes of the LISTEN connection, and how long one may take
+LISTEN_PROBE_INTERVAL = 60
+LISTEN_PROBE_TIMEOUT = 10
+
+# How many bots may be starting at the same time during a cold start
+BOT_START_CONCURRENCY = int(os.getenv("BOT_START_CONCURRENCY", "8"))
+
+# Attempts per bot when Telegram answers a start with 429 Too Many Requests
+BOT_START_RETRIES = 3
+
+# Bot settings that only take effect after a restart
+RESTART_FIELDS = (
+    'telegram_token', 'bot_type',
+    'pakasir_slug', 'pakasir_api_key', 'update_mode'
+)
+
 
 class BotManager:
     """Manages multiple Telegram bot instances."""
     
-    def __init__(self):
+    def __init__(self, update_mode: str = None, shard=None):
+        """
+        Initialize bot manager.
+        
+        Args:
+            update_mode: Default update delivery, 'polling' or 'webhook'
+                (default: BOT_UPDATE_MODE). Bots with their own
+                update_mode override it.
+            shard: Optional shard_runner.Shard; only bots it owns are run
+        """
         self.bots: Dict[int, BotInstance] = {}
+        self.update_mode = (update_mode or BOT_UPDATE_MODE).lower()
+        self.shard = shard
+        self.webhook = self._create_webhook_ingress()
+        self.metrics = self._create_metrics_server()
+        self.supervisor = BotSupervisor(self)
+        self.payments = PaymentReconciler(self)
         self._running = False
         self._shutdown_event = asyncio.Event()
+        self._reconcile_now = asyncio.Event()
+        self._bot_locks: Dict[int, asyncio.Lock] = {}
+        self._change_tasks: set = set()
     
     def load_bots(self) -> int:
         """
@@ -30,7 +106,7 @@ class BotManager:
         Returns:
             Number of bots loaded
         """
-        active_bots = get_active_bots()
+        active_bots = [b for b in get_active_bots() if self.owns(b['id'])]
         
         for bot_config in active_bots:
             try:
@@ -42,12 +118,37 @@ class BotManager:
         
         return len(self.bots)
     
-    def add_bot(self, bot_id: int) -> Optional[BotInstance]:
+    def owns(self, bot_id: int) -> bool:
+        """Whether this manager (or its shard) is responsible for a bot."""
+        return self.shard is None or self.shard.owns(bot_id)
+    
+    def _create_webhook_ingress(self) -> WebhookIngress:
+        """
+        Create the webhook ingress. Shard workers each listen on
+        WEBHOOK_PORT + shard index; a '{shard}' placeholder in
+        WEBHOOK_BASE_URL is replaced by the shard index.
+        """
+        if self.shard is None:
+            return WebhookIngress()
+        
+        base_url = WEBHOOK_BASE_URL.replace("{shard}", str(self.shard.index))
+        return WebhookIngress(base_url=base_url, port=WEBHOOK_PORT + self.shard.index)
+    
+    def _create_metrics_server(self) -> MetricsServer:
+        """Create the /metrics endpoint (METRICS_PORT + shard index when sharded)."""
+        port = METRICS_PORT
+        if self.shard is not None and port > 0:
+            port += self.shard.index
+        BOTS_RUNNING.set_callback(lambda: {(): len(self.bots)})
+        return MetricsServer(port=port)
+    
+    def add_bot(self, bot_id: int, bot_config: dict = None) -> Optional[BotInstance]:
         """
         Add and start a single bot by ID.
         
         Args:
             bot_id: Database ID of the bot
+            bot_config: Bot row if already fetched (default: load from database)
             
         Returns:
             BotInstance if successful, None otherwise
@@ -56,11 +157,16 @@ class BotManager:
             logger.warning(f"Bot {bot_id} already running")
             return self.bots[bot_id]
         
-        bot_config = get_bot_by_id(bot_id)
+        if bot_config is None:
+            bot_config = get_bot_by_id(bot_id)
         if not bot_config:
             logger.error(f"Bot {bot_id} not found in database")
             return None
         
+        if not self.owns(bot_id):
+            logger.info(f"Bot {bot_id} belongs to another shard, skipping")
+            return None
+        
         try:
             instance = BotInstance(bot_config)
             self.bots[bot_id] = instance
@@ -69,18 +175,22 @@ class BotManager:
             logger.error(f"Failed to create bot {bot_id}: {e}")
             return None
     
-    async def start_bot(self, bot_id: int) -> bool:
+    async def start_bot(self, bot_id: int, bot_config: dict = None) -> bool:
         """Start a specific bot."""
         if bot_id not in self.bots:
-            instance = self.add_bot(bot_id)
+            instance = self.add_bot(bot_id, bot_config)
             if not instance:
                 return False
         
+        instance = self.bots[bot_id]
         try:
-            await self.bots[bot_id].start()
+            await instance.start(webhook=await self._webhook_for(instance))
+            self.supervisor.started(bot_id)
             return True
         except Exception as e:
             logger.error(f"Failed to start bot {bot_id}: {e}")
+            await self._discard(instance)
+            self.supervisor.failed(bot_id, e, instance.config)
             return False
     
     async def stop_bot(self, bot_id: int) -> bool:
@@ -92,6 +202,7 @@ class BotManager:
         try:
             await self.bots[bot_id].stop()
             del self.bots[bot_id]
+            forget_bot(bot_id)
             return True
         except Exception as e:
             logger.error(f"Failed to stop bot {bot_id}: {e}")
@@ -103,23 +214,260 @@ class BotManager:
         return await self.start_bot(bot_id)
     
     async def start_all(self):
-        """Start all loaded bots concurrently."""
+        """
+        Start all loaded bots, at most BOT_START_CONCURRENCY at a time.
+        Store bots with pending orders start first.
+        """
         if not self.bots:
             logger.warning("No bots to start")
             return
         
-        tasks = [bot.start() for bot in self.bots.values()]
+        bots = await self._startup_order(list(self.bots.values()))
+        semaphore = asyncio.Semaphore(BOT_START_CONCURRENCY)
+        began = time.perf_counter()
+        
+        tasks = [self._start_scheduled(bot, semaphore, began) for bot in bots]
         results = await asyncio.gather(*tasks, return_exceptions=True)
         
-        for bot_id, result in zip(self.bots.keys(), results):
+        for bot, result in zip(bots, results):
             if isinstance(result, Exception):
-                logger.error(f"Bot {bot_id} failed to start: {result}")
+                logger.error(f"Bot {bot.bot_id} failed to start: {result}")
+                await self._discard(bot)
+                self.supervisor.failed(bot.bot_id, result, bot.config)
+            else:
+                self.supervisor.started(bot.bot_id)
+        
+        self._log_startup_report(bots, time.perf_counter() - began)
+    
+    async def _startup_order(self, bots: List[BotInstance]) -> List[BotInstance]:
+        """Order bots for cold start: store bots with most pending orders first."""
+        try:
+            pending = await asyncio.to_thread(get_pending_order_counts)
+        except Exception as e:
+            logger.warning(f"Could not load pending orders for startup priority: {e}")
+            pending = {}
+        
+        return sorted(bots, key=lambda b: (
+            -pending.get(b.bot_id, 0),
+            b.bot_type != 'store',
+            b.bot_id
+        ))
+    
+    async def _start_scheduled(self, bot: BotInstance, semaphore: asyncio.Semaphore, began: float):
+        """Start one bot inside the startup window, backing off on 429s."""
+        async with semaphore:
+            queued = time.perf_counter() - began
+            for attempt in range(1, BOT_START_RETRIES + 1):
+                try:
+                    await bot.start(webhook=await self._webhook_for(bot))
+                    break
+                except RetryAfter as e:
+                    if attempt == BOT_START_RETRIES:
+                        raise
+                    delay = e.retry_after
+                    if hasattr(delay, 'total_seconds'):
+                        delay = delay.total_seconds()
+                    logger.warning(f"[{bot.bot_username}] Rate limited on start, retrying in {delay}s")
+                    await asyncio.sleep(delay)
+            bot.startup_timings['queued'] = round(queued, 3)
+    
+    def _log_startup_report(self, bots: List[BotInstance], elapsed: float):
+        """Log a startup summary with the slowest bots' timing breakdown."""
+        started = [b for b in bots if b.bot_id in self.bots and b.startup_timings]
+        logger.info(f"Started {len(started)}/{len(bots)} bot(s) in {elapsed:.2f}s")
+        
+        slowest = sorted(started, key=lambda b: b.startup_timings.get('total', 0), reverse=True)
+        for bot in slowest[:5]:
+            t = bot.startup_timings
+            logger.info(
+                f"  @{bot.bot_username}: total={t.get('total')}s "
+                f"(queued={t.get('queued')}s, initialize={t.get('initialize')}s, "
+                f"start={t.get('start')}s, updates={t.get('updates')}s)"
+            )
+    
+    async def _discard(self, instance: BotInstance):
+        """Drop a failed bot; the supervisor schedules its restart."""
+        self.bots.pop(instance.bot_id, None)
+        try:
+            await instance.stop()
+        except Exception as e:
+            logger.debug(f"Cleanup of bot {instance.bot_id} failed: {e}")
     
     async def stop_all(self):
         """Stop all running bots."""
         tasks = [bot.stop() for bot in self.bots.values()]
         await asyncio.gather(*tasks, return_exceptions=True)
         self.bots.clear()
+        await self.webhook.stop()
+    
+    async def _webhook_for(self, instance: BotInstance) -> Optional[WebhookIngress]:
+        """Return the ingress a bot receives updates through, or None for polling."""
+        mode = (instance.update_mode or self.update_mode).lower()
+        if mode != 'webhook':
+            return None
+        
+        if not self.webhook.configured:
+            logger.warning(f"[{instance.bot_username}] WEBHOOK_BASE_URL not set, falling back to polling")
+            return None
+        
+        await self.webhook.start()
+        return self.webhook
+    
+    async def _refresh_webhooks(self):
+        """Periodically make sure Telegram still points every webhook bot here."""
+        while True:
+            await asyncio.sleep(WEBHOOK_REFRESH_INTERVAL)
+            for bot in list(self.bots.values()):
+                if not bot.webhook:
+                    continue
+                try:
+                    await bot.webhook.refresh(bot)
+                except Exception as e:
+                    logger.error(f"Webhook refresh failed for bot {bot.bot_id}: {e}")
+    
+    async def _sweep_reservations(self):
+        """Periodically release stock holds whose payment window has passed."""
+        while True:
+            await asyncio.sleep(STOCK_SWEEP_INTERVAL)
+            try:
+                total = 0
+                while True:
+                    released = await release_expired_reservations(STOCK_SWEEP_BATCH)
+                    for bot_id in released:
+                        invalidate_catalog(bot_id)
+                    count = sum(released.values())
+                    total += count
+                    if count < STOCK_SWEEP_BATCH:
+                        break
+                if total:
+                    logger.info(f"Released {total} expired stock reservation(s)")
+            except Exception as e:
+                logger.error(f"Stock reservation sweep failed: {e}")
+    
+    # ==================== HOT RELOAD ====================
+    
+    def _lock_for(self, bot_id: int) -> asyncio.Lock:
+        """Serialize start/stop/restart of one bot."""
+        if bot_id not in self._bot_locks:
+            self._bot_locks[bot_id] = asyncio.Lock()
+        return self._bot_locks[bot_id]
+    
+    @staticmethod
+    def settings_changed(old: dict, new: dict) -> bool:
+        """Whether a bot row changed in a way that needs a restart."""
+        return any(old.get(f) != new.get(f) for f in RESTART_FIELDS)
+    
+    async def _sync_bot(self, bot_id: int, bot_config: Optional[dict]):
+        """
+        Bring one bot in line with its database row.
+        
+        Args:
+            bot_id: Database ID of the bot
+            bot_config: Current bot row, or None if deleted
+        """
+        wanted = bool(bot_config and bot_config.get('is_active') and self.owns(bot_id))
+        running = self.bots.get(bot_id)
+        
+        if not wanted:
+            self.supervisor.forget(bot_id)
+        
+        if running and not wanted:
+            logger.info(f"Stopping bot {bot_id} (deactivated, deleted or moved)")
+            await self.stop_bot(bot_id)
+        elif wanted and not running:
+            if self.supervisor.blocked(bot_id, bot_config):
+                return
+            logger.info(f"Starting bot {bot_id}")
+            await self.start_bot(bot_id, bot_config)
+        elif wanted and self.settings_changed(running.config, bot_config):
+            logger.info(f"Restarting bot {bot_id} (settings changed)")
+            await self.stop_bot(bot_id)
+            await self.start_bot(bot_id, bot_config)
+        elif wanted:
+            # Labels such as bot_name apply without a restart
+            running.config.update(bot_config)
+            running.bot_name = bot_config.get('bot_name') or running.bot_name
+    
+    async def _apply_bot_change(self, bot_id: int, action: str):
+        """Handle one bot change announced by the API."""
+        async with self._lock_for(bot_id):
+            try:
+                bot_config = None
+                if action != 'delete':
+                    bot_config = await asyncio.to_thread(get_bot_by_id, bot_id)
+                await self._sync_bot(bot_id, bot_config)
+            except Exception as e:
+                logger.error(f"Failed to apply {action} of bot {bot_id}: {e}")
+    
+    def _on_notify(self, notify):
+        """Dispatch a NOTIFY received on the listen connection."""
+        if notify.channel not in (BOT_CHANGES_CHANNEL, CATALOG_CHANGES_CHANNEL):
+            return
+        try:
+            payload = json.loads(notify.payload)
+            bot_id = int(payload['bot_id'])
+            action = payload.get('action', 'update')
+        except (ValueError, KeyError, TypeError):
+            logger.warning(f"Ignoring malformed {notify.channel} payload: {notify.payload!r}")
+            return
+        
+        if notify.channel == CATALOG_CHANGES_CHANNEL:
+            invalidate_catalog(bot_id)
+            return
+        
+        task = asyncio.create_task(self._apply_bot_change(bot_id, action))
+        self._change_tasks.add(task)
+        task.add_done_callback(self._change_tasks.discard)
+    
+    async def _listen_bot_changes(self):
+        """Listen for bot and catalog changes on a dedicated connection, reconnecting on failure."""
+        while True:
+            conn = None
+            try:
+                conn = await open_listen_connection(BOT_CHANGES_CHANNEL, CATALOG_CHANGES_CHANNEL)
+                # Changes may have been missed while disconnected
+                self._reconcile_now.set()
+                clear_catalog_cache()
+                
+                while True:
+                    async for notify in conn.notifies(timeout=LISTEN_PROBE_INTERVAL):
+                        self._on_notify(notify)
+                    # Make sure the connection is still alive; a half-open one
+                    # fails here instead of silently missing notifications
+                    await asyncio.wait_for(conn.execute("SELECT 1"), LISTEN_PROBE_TIMEOUT)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Bot change listener failed: {e!r}, reconnecting in 5s")
+                await asyncio.sleep(5)
+            finally:
+                if conn is not None:
+                    await conn.close()
+    
+    async def reconcile(self):
+        """Start, stop or restart bots so the running set matches get_active_bots()."""
+        active = {b['id']: b for b in await asyncio.to_thread(get_active_bots)}
+        
+        for bot_id in set(self.bots) | set(active):
+            async with self._lock_for(bot_id):
+                try:
+                    await self._sync_bot(bot_id, active.get(bot_id))
+                except Exception as e:
+                    logger.error(f"Reconcile of bot {bot_id} failed: {e}")
+    
+    async def _reconcile_loop(self):
+        """Periodic reconcile; also runs right after the listener (re)connects."""
+        while True:
+            try:
+                await asyncio.wait_for(self._reconcile_now.wait(), BOT_RECONCILE_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._reconcile_now.clear()
+            
+            try:
+                await self.reconcile()
+            except Exception as e:
+                logger.error(f"Reconcile failed: {e}")
     
     async def run(self):
         """
@@ -137,21 +485,41 @@ class BotManager:
                 pass
         
         print("=" * 50)
-        print("🤖 Multi-Bot Platform")
+        print("🤖 Multi-Bot Platform" + (f" - {self.shard}" if self.shard else ""))
         print("=" * 50)
         
+        try:
+            await self.metrics.start()
+        except OSError as e:
+            logger.error(f"Metrics endpoint unavailable: {e}")
+        
+        # Handlers query the database through the async pool on this loop
+        await init_async_pool()
+        
         # Load bots
         count = self.load_bots()
         print(f"\n📦 Loaded {count} bot(s) from database")
         
         if count == 0:
             print("⚠️ No active bots found. Add bots via the web dashboard.")
-            return
         
         # Start all bots
         print("\n🚀 Starting all bots...")
         await self.start_all()
         
+        # Background tasks: webhook upkeep, hot add/remove/reload of bots,
+        # metrics, bot supervision, expired stock holds and payment polling
+        background = [
+            asyncio.create_task(self._refresh_webhooks()),
+            asyncio.create_task(self._sweep_reservations()),
+            asyncio.create_task(self._listen_bot_changes()),
+            asyncio.create_task(self._reconcile_loop()),
+            asyncio.create_task(monitor_event_loop()),
+            asyncio.create_task(self.supervisor.run()),
+        ]
+        if PAYMENT_SCAN_INTERVAL > 0:
+            background.append(asyncio.create_task(self.payments.run()))
+        
         print("\n" + "=" * 50)
         print("All bots running! Press Ctrl+C to stop.")
         print("=" * 50)
@@ -163,7 +531,14 @@ class BotManager:
             pass
         
         print("\n🛑 Shutting down...")
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
         await self.stop_all()
+        await flush_profiles()
+        await close_pakasir_session()
+        await close_async_pool()
+        await self.metrics.stop()
         print("👋 All bots stopped. Goodbye!")
     
     async def _shutdown(self):
@@ -175,13 +550,24 @@ class BotManager:
         """Get status of all bots."""
         return {
             "running": self._running,
+            "shard": self.shard.name if self.shard else None,
             "bot_count": len(self.bots),
+            "http": get_transport_stats(),
+            "db_pool": get_pool_stats(),
+            "catalog": get_catalog_stats(),
+            "known_users": get_known_users_stats(),
+            "pakasir": get_pakasir_stats(),
+            "supervisor": self.supervisor.get_status(),
+            "payments": self.payments.get_status(),
             "bots": [
                 {
                     "id": b.bot_id,
                     "username": b.bot_username,
                     "name": b.bot_name,
-                    "type": b.bot_type
+                    "type": b.bot_type,
+                    "mode": "webhook" if b.webhook else "polling",
+                    "startup": b.startup_timings,
+                    "updates": b.update_processor.stats() if b.update_processor else None
                 }
                 for b in self.bots.values()
             ]
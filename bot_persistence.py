@@ -0,0 +1,228 @@
+"""
+Bot Persistence Module.
+Keeps user_data, chat_data and ConversationHandler states across runner
+restarts, either in Postgres (bot_persistence table) or in a local file.
+
+Writes are batched: python-telegram-bot hands over changed data every
+BOT_PERSISTENCE_INTERVAL seconds, unchanged entries are skipped and the
+rest is written in one transaction. user_data/chat_data are loaded lazily
+the first time a user or chat is seen, so startup does not read them all.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput, PicklePersistence
+
+from database_pg import (
+    get_persisted_entry,
+    get_persisted_entries,
+    save_persisted_entries
+)
+
+logger = logging.getLogger(__name__)
+
+# 'postgres', 'file' or 'none'
+BOT_PERSISTENCE = os.getenv("BOT_PERSISTENCE", "postgres").lower()
+
+# Seconds between persistence flushes
+BOT_PERSISTENCE_INTERVAL = float(os.getenv("BOT_PERSISTENCE_INTERVAL", "30"))
+
+# Directory for BOT_PERSISTENCE=file
+BOT_PERSISTENCE_DIR = os.getenv("BOT_PERSISTENCE_DIR", "data/persistence")
+
+# Users/chats per bot whose load and last write are remembered (LRU); a
+# forgotten entry is read again on its next update and written once more
+BOT_PERSISTENCE_CACHE = int(os.getenv("BOT_PERSISTENCE_CACHE", "10000"))
+
+# bot_data is rebuilt from the bots table on every start
+STORE_DATA = PersistenceInput(bot_data=False, chat_data=True, user_data=True, callback_data=False)
+
+
+def _encode(data) -> str:
+    """JSON of data; raises TypeError for values JSON cannot round-trip."""
+    return json.dumps(data, sort_keys=True)
+
+
+def _digest(encoded: Optional[str]) -> bytes:
+    """Short fingerprint of stored JSON; b"" for an entry without a row."""
+    return hashlib.md5(encoded.encode()).digest() if encoded is not None else b""
+
+
+class PostgresPersistence(BasePersistence):
+    """Persistence backend storing one bot's data in the bot_persistence table."""
+
+    def __init__(self, bot_id: int, update_interval: float = BOT_PERSISTENCE_INTERVAL):
+        super().__init__(store_data=STORE_DATA, update_interval=update_interval)
+        self.bot_id = bot_id
+
+        # Users/chats whose row has been read already (LRU)
+        self._loaded: "OrderedDict[Tuple[str, str], None]" = OrderedDict()
+        # (kind, key) -> digest of the JSON last written, used to skip
+        # unchanged data (LRU)
+        self._written: "OrderedDict[Tuple[str, str], bytes]" = OrderedDict()
+        # (kind, key) -> JSON to write, or None to delete
+        self._pending: Dict[Tuple[str, str], Optional[str]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+    # ---------- bounded bookkeeping ----------
+
+    @staticmethod
+    def _touch(cache: OrderedDict, entry: Tuple[str, str], value=None):
+        cache[entry] = value
+        cache.move_to_end(entry)
+        if len(cache) > BOT_PERSISTENCE_CACHE:
+            cache.popitem(last=False)
+
+    def _remember_written(self, entry: Tuple[str, str], encoded: Optional[str]):
+        """Remember what is stored for an entry; None means no row."""
+        self._touch(self._written, entry, _digest(encoded))
+
+    # ---------- batching ----------
+
+    def _queue(self, kind: str, key: str, data):
+        """Queue a write (None deletes) unless it matches what is stored."""
+        entry = (kind, key)
+        try:
+            encoded = None if data is None or data == {} else _encode(data)
+        except TypeError as e:
+            # Stored as a string it would come back changed after a restart
+            logger.error(f"[bot {self.bot_id}] Not persisting {kind} {key}, value is not JSON: {e}")
+            return
+        if entry not in self._pending and self._written.get(entry) == _digest(encoded):
+            return
+
+        self._pending[entry] = encoded
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._write_pending())
+
+    async def _write_pending(self):
+        # Let the rest of the current persistence cycle queue its entries
+        await asyncio.sleep(0)
+
+        while self._pending:
+            batch, self._pending = self._pending, {}
+            try:
+                await asyncio.to_thread(save_persisted_entries, self.bot_id, batch)
+            except Exception as e:
+                logger.error(f"[bot {self.bot_id}] Persistence write failed ({len(batch)} entries): {e}")
+                for entry, encoded in batch.items():
+                    self._pending.setdefault(entry, encoded)
+                return
+
+            for entry, encoded in batch.items():
+                self._remember_written(entry, encoded)
+
+    async def flush(self) -> None:
+        """Write everything still pending (called on application shutdown)."""
+        if self._flush_task and not self._flush_task.done():
+            await self._flush_task
+        if self._pending:
+            await self._write_pending()
+
+    # ---------- lazy loading ----------
+
+    async def _load(self, kind: str, key: int, target: dict):
+        entry = (kind, str(key))
+        if entry in self._loaded:
+            self._loaded.move_to_end(entry)
+            return
+        self._touch(self._loaded, entry)
+
+        try:
+            data = await asyncio.to_thread(get_persisted_entry, self.bot_id, kind, str(key))
+        except Exception as e:
+            logger.error(f"[bot {self.bot_id}] Could not load {kind} {key}: {e}")
+            self._loaded.pop(entry, None)
+            return
+
+        self._remember_written(entry, _encode(data) if data else None)
+        for name, value in (data or {}).items():
+            target.setdefault(name, value)
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        await self._load("user", user_id, user_data)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        await self._load("chat", chat_id, chat_data)
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    # ---------- user / chat data ----------
+
+    async def get_user_data(self) -> dict:
+        return {}
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        self._queue("user", str(user_id), data)
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        self._queue("chat", str(chat_id), data)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._queue("user", str(user_id), None)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._queue("chat", str(chat_id), None)
+
+    # ---------- conversations ----------
+
+    async def get_conversations(self, name: str) -> dict:
+        kind = f"conv:{name}"
+        rows = await asyncio.to_thread(get_persisted_entries, self.bot_id, kind)
+
+        conversations = {}
+        for key, state in rows.items():
+            self._remember_written((kind, key), _encode(state))
+            conversations[tuple(json.loads(key))] = state
+        return conversations
+
+    async def update_conversation(self, name: str, key: tuple, new_state: Optional[object]) -> None:
+        self._queue(f"conv:{name}", json.dumps(list(key)), new_state)
+
+    # ---------- not stored ----------
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+
+def build_persistence(bot_id: int) -> Optional[BasePersistence]:
+    """
+    Create the persistence backend for a bot according to BOT_PERSISTENCE.
+
+    Args:
+        bot_id: Database ID of the bot
+
+    Returns:
+        Persistence instance, or None when persistence is disabled
+    """
+    if BOT_PERSISTENCE == "postgres":
+        return PostgresPersistence(bot_id)
+
+    if BOT_PERSISTENCE == "file":
+        os.makedirs(BOT_PERSISTENCE_DIR, exist_ok=True)
+        return PicklePersistence(
+            filepath=os.path.join(BOT_PERSISTENCE_DIR, f"bot_{bot_id}.pickle"),
+            store_data=STORE_DATA,
+            update_interval=BOT_PERSISTENCE_INTERVAL
+        )
+
+    return None
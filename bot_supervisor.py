@@ -0,0 +1,265 @@
+"""
+Bot Supervisor Module.
+Watches every BotInstance of a BotManager: probes running bots, restarts
+failed ones with exponential backoff and quarantines bots that keep
+failing so a revoked token or broken bot cannot spin forever.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+from telegram.error import Forbidden, InvalidToken, NetworkError, RetryAfter
+
+from database_pg import deactivate_bot, get_bot_by_id
+from utils.metrics import BOT_RESTARTS, BOTS_QUARANTINED
+
+logger = logging.getLogger(__name__)
+
+# How often running bots are probed (seconds)
+BOT_HEALTH_INTERVAL = int(os.getenv("BOT_HEALTH_INTERVAL", "60"))
+
+# Timeout of one probe's getMe call (seconds)
+BOT_PROBE_TIMEOUT = 10
+
+# Probes running at the same time
+BOT_PROBE_CONCURRENCY = 20
+
+# Restart backoff: BOT_RESTART_BACKOFF * 2^(failures-1), capped (seconds)
+BOT_RESTART_BACKOFF = int(os.getenv("BOT_RESTART_BACKOFF", "10"))
+BOT_RESTART_BACKOFF_MAX = 600
+
+# Consecutive failures before a bot is quarantined
+BOT_MAX_FAILURES = int(os.getenv("BOT_MAX_FAILURES", "5"))
+
+# A bot running this long without failing has its failure count reset (seconds)
+BOT_HEALTHY_RESET = 300
+
+# Also set is_active=false in the database when quarantining
+BOT_QUARANTINE_DEACTIVATE = os.getenv("BOT_QUARANTINE_DEACTIVATE", "0") == "1"
+
+# Supervisor loop tick (seconds)
+TICK = 5
+
+
+class BotHealth:
+    """Supervision state of one bot."""
+
+    def __init__(self, bot_id: int):
+        self.bot_id = bot_id
+        self.state = "running"  # running | backoff | quarantined
+        self.restarts = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        self.started_at = 0.0
+        self.next_attempt = 0.0
+        # Bot row at the last failure; a changed row releases the bot
+        self.config: Optional[dict] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "state": self.state,
+            "restarts": self.restarts,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+
+class BotSupervisor:
+    """Health probes, backoff restarts and quarantine for a BotManager's bots."""
+
+    def __init__(self, manager):
+        """
+        Initialize supervisor.
+
+        Args:
+            manager: BotManager whose bots are supervised
+        """
+        self.manager = manager
+        self.health: Dict[int, BotHealth] = {}
+        self._last_probe = 0.0
+        BOTS_QUARANTINED.set_callback(
+            lambda: {(): sum(1 for h in self.health.values() if h.state == "quarantined")}
+        )
+
+    def _health(self, bot_id: int) -> BotHealth:
+        if bot_id not in self.health:
+            self.health[bot_id] = BotHealth(bot_id)
+        return self.health[bot_id]
+
+    # ---------- events from BotManager ----------
+
+    def started(self, bot_id: int):
+        """A bot started successfully."""
+        health = self._health(bot_id)
+        health.state = "running"
+        health.started_at = time.monotonic()
+        health.config = None
+
+    def failed(self, bot_id: int, error, bot_config: Optional[dict] = None):
+        """
+        A bot failed to start or was found unhealthy; schedule a restart
+        or quarantine it.
+        """
+        health = self._health(bot_id)
+        now = time.monotonic()
+        if health.started_at and now - health.started_at > BOT_HEALTHY_RESET:
+            health.failures = 0
+
+        health.failures += 1
+        health.last_error = str(error)[:200]
+        health.started_at = 0.0
+        if bot_config:
+            health.config = dict(bot_config)
+
+        if health.failures >= BOT_MAX_FAILURES:
+            self._quarantine(health)
+            return
+
+        delay = min(BOT_RESTART_BACKOFF_MAX, BOT_RESTART_BACKOFF * 2 ** (health.failures - 1))
+        health.state = "backoff"
+        health.next_attempt = now + delay
+        logger.warning(
+            f"Bot {bot_id} failed ({health.last_error}), "
+            f"restart in {delay}s (failure {health.failures}/{BOT_MAX_FAILURES})"
+        )
+
+    def forget(self, bot_id: int):
+        """Stop supervising a bot (deactivated, deleted or moved)."""
+        self.health.pop(bot_id, None)
+
+    def blocked(self, bot_id: int, bot_config: dict) -> bool:
+        """
+        Whether reconcile/hot reload must leave a stopped bot to the supervisor.
+
+        A bot waiting for its backoff or quarantined stays blocked until its
+        settings change (e.g. a new token), which releases it.
+        """
+        health = self.health.get(bot_id)
+        if not health or health.state == "running":
+            return False
+
+        if health.config and self.manager.settings_changed(health.config, bot_config):
+            logger.info(f"Bot {bot_id} settings changed, releasing from {health.state}")
+            self.forget(bot_id)
+            return False
+        return True
+
+    def _quarantine(self, health: BotHealth):
+        health.state = "quarantined"
+        logger.error(
+            f"🚫 Bot {health.bot_id} quarantined after {health.failures} failures: {health.last_error}"
+        )
+
+        if BOT_QUARANTINE_DEACTIVATE:
+            asyncio.create_task(self._deactivate(health.bot_id))
+
+    async def _deactivate(self, bot_id: int):
+        try:
+            await asyncio.to_thread(deactivate_bot, bot_id)
+            logger.warning(f"Bot {bot_id} deactivated in database")
+        except Exception as e:
+            logger.error(f"Could not deactivate bot {bot_id}: {e}")
+
+    # ---------- probing ----------
+
+    async def _probe(self, instance) -> Optional[str]:
+        """
+        Check one running bot.
+
+        Returns:
+            Reason it is unhealthy, or None if healthy
+        """
+        app = instance.app
+        if not app.running:
+            return "application stopped"
+        if not instance.webhook and not (app.updater and app.updater.running):
+            return "polling stopped"
+
+        try:
+            await asyncio.wait_for(app.bot.get_me(), BOT_PROBE_TIMEOUT)
+        except (InvalidToken, Forbidden) as e:
+            return f"token rejected: {e}"
+        except (RetryAfter, NetworkError, asyncio.TimeoutError) as e:
+            # Telegram or network trouble, not this bot's fault
+            logger.debug(f"Probe of bot {instance.bot_id} inconclusive: {e}")
+        return None
+
+    async def _probe_all(self):
+        bots = list(self.manager.bots.values())
+        semaphore = asyncio.Semaphore(BOT_PROBE_CONCURRENCY)
+
+        async def probe(instance):
+            async with semaphore:
+                return await self._probe(instance)
+
+        results = await asyncio.gather(*(probe(b) for b in bots), return_exceptions=True)
+
+        now = time.monotonic()
+        for instance, result in zip(bots, results):
+            problem = result if isinstance(result, str) else None
+            if isinstance(result, Exception):
+                problem = f"probe error: {result}"
+
+            if problem is None:
+                health = self._health(instance.bot_id)
+                if health.failures and now - health.started_at > BOT_HEALTHY_RESET:
+                    health.failures = 0
+                continue
+
+            async with self.manager._lock_for(instance.bot_id):
+                if self.manager.bots.get(instance.bot_id) is not instance:
+                    continue
+                logger.error(f"Bot {instance.bot_id} unhealthy: {problem}")
+                config = dict(instance.config)
+                await self.manager._discard(instance)
+                self.failed(instance.bot_id, problem, config)
+
+    # ---------- restarts ----------
+
+    async def _restart_due(self):
+        now = time.monotonic()
+        due = [
+            h.bot_id for h in self.health.values()
+            if h.state == "backoff" and now >= h.next_attempt
+        ]
+        for bot_id in due:
+            async with self.manager._lock_for(bot_id):
+                if bot_id in self.manager.bots:
+                    continue
+                try:
+                    bot_config = await asyncio.to_thread(get_bot_by_id, bot_id)
+                except Exception as e:
+                    logger.error(f"Could not load bot {bot_id} for restart: {e}")
+                    self._health(bot_id).next_attempt = now + TICK
+                    continue
+
+                if not (bot_config and bot_config.get('is_active') and self.manager.owns(bot_id)):
+                    self.forget(bot_id)
+                    continue
+
+                health = self._health(bot_id)
+                health.restarts += 1
+                BOT_RESTARTS.inc(bot_id)
+                logger.info(f"🔁 Restarting bot {bot_id} (restart #{health.restarts})")
+                await self.manager.start_bot(bot_id, bot_config)
+
+    async def run(self):
+        """Supervision loop: restarts every TICK, probes every BOT_HEALTH_INTERVAL."""
+        while True:
+            await asyncio.sleep(TICK)
+            try:
+                await self._restart_due()
+                if time.monotonic() - self._last_probe >= BOT_HEALTH_INTERVAL:
+                    self._last_probe = time.monotonic()
+                    await self._probe_all()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Bot supervisor iteration failed: {e}")
+
+    def get_status(self) -> dict:
+        """Supervision state per bot id."""
+        return {bot_id: health.to_dict() for bot_id, health in self.health.items()}
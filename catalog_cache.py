@@ -0,0 +1,184 @@
+"""
+Catalog Cache Module.
+In-process cache of each store bot's categories and products (with stock),
+so browsing the catalog does not touch Postgres.
+
+A bot's catalog is loaded whole on first use and kept until it is
+invalidated: by the admin handlers after they write, by stock changes
+(sales, restocks) and by the API through NOTIFY on CATALOG_CHANGES_CHANNEL.
+CATALOG_CACHE_TTL is only a safety net for changes that bypass all three.
+
+Read functions keep the names and signatures of database_async so handlers
+only change their import.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+import database_async as db
+from utils.metrics import CATALOG_CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+# Seconds a cached catalog is trusted without any invalidation
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", "300"))
+
+
+class _BotCatalog:
+    """One bot's catalog snapshot."""
+
+    __slots__ = ("version", "loaded_at", "categories", "products", "products_by_id")
+
+    def __init__(self, version: int, categories: list, products: list):
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.categories = categories
+        self.products = products
+        self.products_by_id = {p['id']: p for p in products}
+
+
+class CatalogCache:
+    """Versioned per-bot catalog cache with coalesced loads."""
+
+    def __init__(self, ttl: float = CATALOG_CACHE_TTL):
+        self.ttl = ttl
+        self._catalogs: Dict[int, _BotCatalog] = {}
+        # Bumped on every invalidation; a load started at an older version is not stored
+        self._versions: Dict[int, int] = {}
+        self._loading: Dict[int, asyncio.Future] = {}
+        # product id -> bot id, for lookups by product id only
+        self._product_bots: Dict[int, int] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.invalidations = 0
+
+    def _fresh(self, bot_id: int) -> Optional[_BotCatalog]:
+        catalog = self._catalogs.get(bot_id)
+        if catalog and time.monotonic() - catalog.loaded_at < self.ttl:
+            return catalog
+        return None
+
+    async def get(self, bot_id: int) -> _BotCatalog:
+        """Get a bot's catalog, loading it if missing, invalidated or expired."""
+        catalog = self._fresh(bot_id)
+        if catalog:
+            self.hits += 1
+            CATALOG_CACHE_REQUESTS.inc("hit")
+            return catalog
+
+        self.misses += 1
+        CATALOG_CACHE_REQUESTS.inc("miss")
+
+        # Concurrent misses of one bot share a single load
+        future = self._loading.get(bot_id)
+        if future is None:
+            future = asyncio.ensure_future(self._load(bot_id))
+            self._loading[bot_id] = future
+            future.add_done_callback(lambda _: self._loading.pop(bot_id, None))
+        return await asyncio.shield(future)
+
+    async def _load(self, bot_id: int) -> _BotCatalog:
+        version = self._versions.get(bot_id, 0)
+        categories, products = await db.get_catalog(bot_id)
+        self.loads += 1
+
+        catalog = _BotCatalog(version, categories, products)
+        if self._versions.get(bot_id, 0) == version:
+            self._catalogs[bot_id] = catalog
+            for product_id in catalog.products_by_id:
+                self._product_bots[product_id] = bot_id
+        # Otherwise invalidated while loading: serve it once, load again next time
+        return catalog
+
+    def invalidate(self, bot_id: int):
+        """Drop a bot's catalog after its categories, products or stock changed."""
+        self._versions[bot_id] = self._versions.get(bot_id, 0) + 1
+        if self._catalogs.pop(bot_id, None) is not None:
+            self.invalidations += 1
+            logger.debug(f"Catalog of bot {bot_id} invalidated")
+
+    def clear(self):
+        """Drop every catalog (e.g. when change notifications may have been missed)."""
+        for bot_id in set(self._catalogs) | set(self._loading):
+            self.invalidate(bot_id)
+
+    def bot_of_product(self, product_id: int) -> Optional[int]:
+        return self._product_bots.get(product_id)
+
+    def note_product(self, product_id: int, bot_id: int):
+        """Remember which bot a product read outside the cache belongs to."""
+        self._product_bots[product_id] = bot_id
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "bots": len(self._catalogs),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+            "loads": self.loads,
+            "invalidations": self.invalidations,
+            "ttl": self.ttl,
+        }
+
+
+_cache = CatalogCache()
+
+
+def invalidate_catalog(bot_id: int):
+    """Drop a bot's cached catalog; call after writing its categories, products or stock."""
+    if bot_id is not None:
+        _cache.invalidate(bot_id)
+
+
+def clear_catalog_cache():
+    """Drop every cached catalog."""
+    _cache.clear()
+
+
+def get_catalog_stats() -> dict:
+    """Hit/miss counters of the catalog cache."""
+    return _cache.stats()
+
+
+# ==================== CACHED READS ====================
+
+async def get_categories_by_bot(bot_id: int, active_only: bool = True) -> list[dict]:
+    """Get categories for a bot."""
+    catalog = await _cache.get(bot_id)
+    return [dict(c) for c in catalog.categories if c['is_active'] or not active_only]
+
+
+async def get_products_by_bot(bot_id: int, active_only: bool = True) -> list[dict]:
+    """Get all products for a bot (with category_name and stock)."""
+    catalog = await _cache.get(bot_id)
+    return [dict(p) for p in catalog.products if p['is_active'] or not active_only]
+
+
+async def get_products_by_category(category_id: int, bot_id: int, active_only: bool = True) -> list[dict]:
+    """Get products in a category."""
+    catalog = await _cache.get(bot_id)
+    return [
+        dict(p) for p in catalog.products
+        if p['category_id'] == category_id and (p['is_active'] or not active_only)
+    ]
+
+
+async def get_product_by_id(product_id: int) -> Optional[dict]:
+    """Get product by ID (with stock)."""
+    bot_id = _cache.bot_of_product(product_id)
+    if bot_id is None:
+        # Not in any catalog loaded so far
+        product = await db.get_product_by_id(product_id)
+        if product:
+            _cache.note_product(product_id, product['bot_id'])
+        return product
+
+    catalog = await _cache.get(bot_id)
+    product = catalog.products_by_id.get(product_id)
+    return dict(product) if product else None
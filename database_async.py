@@ -0,0 +1,1046 @@
+"""
+Async database layer for Bot Runner handlers.
+Same function names as database_pg, awaited instead of blocking the event
+loop, on a psycopg 3 AsyncConnectionPool.
+"""
+
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Iterable, Optional
+
+from psycopg import AsyncConnection
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+from database_pg import CATALOG_CHANGES_CHANNEL, DATABASE_DIRECT_URL, DATABASE_URL
+from utils.db_pool import call_site
+from utils.metrics import DB_CHECKOUT_WAIT, DB_CONNECTION_HOLD
+from utils.stock_import import import_stock_async
+
+logger = logging.getLogger("db_pool_async")
+
+# Pool size per process (each shard worker has its own pool)
+ASYNC_DB_POOL_MIN = int(os.getenv("ASYNC_DB_POOL_MIN", "2"))
+ASYNC_DB_POOL_MAX = int(os.getenv("ASYNC_DB_POOL_MAX", "20"))
+
+# Seconds to wait for a free connection before failing
+ASYNC_DB_POOL_TIMEOUT = float(os.getenv("ASYNC_DB_POOL_TIMEOUT", "10"))
+
+# Statement timeout of the LISTEN connection (ms); bounds its liveness probe
+LISTEN_STATEMENT_TIMEOUT_MS = 10000
+
+# TCP keepalives of the LISTEN connection, so a silently dropped connection
+# (e.g. Neon suspending the compute) errors within about a minute
+LISTEN_KEEPALIVES = {"keepalives": 1, "keepalives_idle": 30, "keepalives_interval": 10, "keepalives_count": 3}
+
+# Frames skipped when naming the call site of a checkout
+_POOL_WRAPPERS = ("get_connection", "get_cursor")
+
+_pool: Optional[AsyncConnectionPool] = None
+
+
+async def init_async_pool(min_size: int = None, max_size: int = None):
+    """
+    Open the async connection pool. Must run on the event loop that uses it.
+
+    Args:
+        min_size: Connections kept open (default: ASYNC_DB_POOL_MIN)
+        max_size: Maximum connections (default: ASYNC_DB_POOL_MAX)
+    """
+    global _pool
+    if _pool is not None:
+        return
+
+    min_size = min_size or ASYNC_DB_POOL_MIN
+    max_size = max(min_size, max_size or ASYNC_DB_POOL_MAX)
+    pool = AsyncConnectionPool(
+        DATABASE_URL,
+        min_size=min_size,
+        max_size=max_size,
+        timeout=ASYNC_DB_POOL_TIMEOUT,
+        # Server-side prepared statements break behind transaction poolers (Neon "-pooler")
+        kwargs={"row_factory": dict_row, "prepare_threshold": None},
+        open=False
+    )
+    await pool.open()
+    _pool = pool
+    logger.info(f"Async connection pool initialized (min={min_size}, max={max_size})")
+
+
+async def close_async_pool():
+    """Close the async connection pool. Call on runner shutdown."""
+    global _pool
+    if _pool is not None:
+        pool, _pool = _pool, None
+        await pool.close()
+        logger.info("Async connection pool closed")
+
+
+async def open_listen_connection(*channels: str) -> AsyncConnection:
+    """
+    Open a dedicated (non-pooled) autocommit connection listening on NOTIFY
+    channels. Read it with conn.notifies(); the caller must close it.
+    """
+    conn = await AsyncConnection.connect(
+        DATABASE_DIRECT_URL,
+        autocommit=True,
+        connect_timeout=10,
+        options=f"-c statement_timeout={LISTEN_STATEMENT_TIMEOUT_MS}",
+        **LISTEN_KEEPALIVES
+    )
+    try:
+        for channel in channels:
+            await conn.execute(f"LISTEN {channel}")
+    except Exception:
+        await conn.close()
+        raise
+    return conn
+
+
+@asynccontextmanager
+async def get_connection():
+    """Get an async connection from the pool; commits on success, rolls back on error."""
+    if _pool is None:
+        await init_async_pool()
+
+    site = call_site(_POOL_WRAPPERS)
+    start = time.perf_counter()
+    async with _pool.connection() as conn:
+        checked_out = time.perf_counter()
+        DB_CHECKOUT_WAIT.observe(checked_out - start, "async", site)
+        try:
+            yield conn
+        finally:
+            DB_CONNECTION_HOLD.observe(time.perf_counter() - checked_out, "async", site)
+
+
+@asynccontextmanager
+async def get_cursor():
+    """Get an async cursor returning rows as dicts."""
+    async with get_connection() as conn:
+        async with conn.cursor() as cursor:
+            yield cursor
+
+
+# ==================== BOT USER OPERATIONS ====================
+
+async def get_or_create_bot_user(bot_id: int, telegram_id: int, username: str = None, first_name: str = None) -> dict:
+    """Get or create a bot user, refreshing its username and first name, in one statement."""
+    async with get_cursor() as cursor:
+        await cursor.execute("""
+            INSERT INTO bot_users (bot_id, telegram_id, username, first_name)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (bot_id, telegram_id) DO UPDATE SET
+                username = EXCLUDED.username,
+                first_name = EXCLUDED.first_name
+            RETURNING *
+        """, (bot_id, telegram_id, username, first_name))
+        return await cursor.fetchone()
+
+
+async def update_bot_user_profiles(profiles: list[tuple]) -> int:
+    """
+    Write changed usernames/first names in one batch.
+
+    Args:
+        profiles: (bot_user_id, username, first_name) tuples
+    """
+    async with get_cursor() as cursor:
+        await cursor.executemany("""
+            UPDATE bot_users SET username = %s, first_name = %s
+            WHERE id = %s
+        """, [(username, first_name, bot_user_id) for bot_user_id, username, first_name in profiles])
+        return len(profiles)
+
+
+async def get_bot_user(bot_id: int, telegram_id: int) -> Optional[dict]:
+    """Get bot user by telegram ID."""
+    async with get_cursor() as cursor:
+        await cursor.execute("""
+            SELECT * FROM bot_users
+            WHERE bot_id = %s AND telegram_id = %s
+        """, (bot_id, telegram_id))
+        return await cursor.fetchone()
+
+
+async def get_store_stats(bot_id: int) -> dict:
+    """Get store statistics: total users and completed transactions (from bot_stats counters)."""
+    async with get_cursor() as cursor:
+        await cursor.execute("""
+            SELECT COALESCE(SUM(total_users), 0) as total_users,
+                   COALESCE(SUM(total_transactions), 0) as total_transactions,
+                   COALESCE(SUM(total_revenue), 0)::bigint as total_revenue
+            FROM bot_stats WHERE bot_id = %s
+        """, (bot_id,))
+        return await cursor.fetchone()
+
+
+async def get_leaderboard(bot_id: int, limit: int = 10, period: str = None) -> list[dict]:
+    """
+    Get top buyers leaderboard from the buyer totals (all time) or the
+    weekly/monthly rollups.
+
+    Args:
+        bot_id: Database ID of the bot
+        limit: Number of buyers
+        period: None for all time, 'week' or 'month' for the current one
+    """
+    async with get_cursor() as cursor:
+        if period is None:
+            await cursor.execute("""
+                SELECT username, first_name, telegram_id, total_orders, total_spent
+                FROM bot_users
+                WHERE bot_id = %s AND total_orders > 0
+                ORDER BY total_spent DESC, total_orders DESC
+                LIMIT %s
+            """, (bot_id, limit))
+        else:
+            await cursor.execute("""
+                SELECT bu.username, bu.first_name, bu.telegram_id, r.total_orders, r.total_spent
+                FROM bot_user_spend_rollups r
+                JOIN bot_users bu ON bu.id = r.bot_user_id
+                WHERE r.bot_id = %s AND r.period = %s
+                  AND r.period_start = date_trunc(%s, NOW())::date
+                  AND r.total_orders > 0
+                ORDER BY r.total_spent DESC, r.total_orders DESC
+                LIMIT %s
+            """, (bot_id, period, period, limit))
+        return await cursor.fetchall()
+
+
+async def get_menu_snapshot(bot_id: int, telegram_id: int, username: str = None, first_name: str = None) -> dict:
+    """
+    Everything the main menu needs except the catalog, in one statement:
+    the bot user (created if new), its balance and the store counters.
+
+    Returns:
+        {'user': bot_users row, 'balance': int, 'stats': {'total_users', 'total_transactions', 'total_revenue'}}
+    """
+    # The main query does not see rows or counter updates made by the
+    # INSERT in the same statement, hence the UNION and the "+ inserted".
+    sql = """
+        WITH ins AS (
+            INSERT INTO bot_users (bot_id, telegram_id, username, first_name)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (bot_id, telegram_id) DO NOTHING
+            RETURNING *
+        ), u AS (
+            SELECT * FROM ins
+            UNION ALL
+            SELECT * FROM bot_users WHERE bot_id = %s AND telegram_id = %s
+        )
+        SELECT u.*,
+               COALESCE(s.total_users, 0) + (SELECT COUNT(*) FROM ins) as stats_total_users,
+               COALESCE(s.total_transactions, 0) as stats_total_transactions,
+               COALESCE(s.total_revenue, 0) as stats_total_revenue
+        FROM u
+        LEFT JOIN LATERAL (
+            SELECT SUM(total_users) as total_users,
+                   SUM(total_transactions) as total_transactions,
+                   SUM(total_revenue)::bigint as total_revenue
+            FROM bot_stats WHERE bot_id = %s
+        ) s ON true
+        LIMIT 1
+    """
+    params = (bot_id, telegram_id, username, first_name, bot_id, telegram_id, bot_id)
+    async with get_cursor() as cursor:
+        await cursor.execute(sql, params)
+        row = await cursor.fetchone()
+        if row is None:
+            # Another transaction inserted the same user concurrently: our
+            # INSERT waited for it and did nothing, and the SELECT still used
+            # the snapshot from before it committed. A new statement sees it.
+            await cursor.execute(sql, params)
+            row = await cursor.fetchone()
+
+    stats = {
+        key[len('stats_'):]: row.pop(key)
+        for key in ('stats_total_users', 'stats_total_transactions', 'stats_total_revenue')
+    }
+    return {'user': row, 'balance': row.get('balance') or 0, 'stats': stats}
+
+
+async def get_user_balance(bot_id: int, telegram_id: int) -> int:
+    """Get user's deposit balance."""
+    async with get_cursor() as cursor:
+        await cursor.execute("""
+            SELECT COALESCE(balance, 0) as balance FROM bot_users
+            WHERE bot_id = %s AND telegram_id = %s
+        """, (bot_id, telegram_id))
+        row = await cursor.fetchone()
+        return row['balance'] if row else 0
+
+
+async def add_user_balance(bot_id: int, telegram_id: int, amount: int) -> bool:
+    """Add balance to user's account."""
+    async with get_cursor() as cursor:
+        await cursor.execute("""
+            UPDATE bot_users SET balance = COALESCE(balance, 0) + %s
+            WHERE bot_id = %s AND telegram_id = %s
+        """, (amount, bot_id, telegram_id))
+        return cursor.rowcount > 0
+
+
+async def deduct_user_balance(bot_id: int, telegram_id: int, amount: int) -> bool:
+    """Deduct balance from user's account. Returns False if insufficient."""
+    async with get_cursor() as cursor:
+        await cursor.execute("""
+            UPDATE bot_users SET balance = balance - %s
+            WHERE bot_id = %s AND telegram_id = %s AND balance >= %s
+        """, (amount, bot_id, telegram_id, amount))
+        return cursor.rowcount > 0
+
+
+async def create_deposit(bot_id: int, telegram_id: int, order_id: str, amount: int,
+                         fee: int, total: int, qris_string: str, expired_at=None) -> dict:
+    """Create a deposit transaction record."""
+    async with get_cursor() as cursor:
+        await cursor.execute("""
+            INSERT INTO deposits (bot_id, telegram_id, order_id, amount, fee, total, qris_string, expired_at, status)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, 'pending')
+            RETURNING *
+        """, (bot_id, telegram_id, order_id, amount, fee, total, qris_string, expired_at))
+        return await cursor.fetchone()
+
+
+async def get_deposit_by_order_id(order_id: str) -> Optional[dict]:
+    """Get deposit by order ID."""
+    async with get_cursor() as cursor:
+        await cursor.execute("""
+            SELECT * FROM deposits WHERE order_id = %s
+        """, (order_id,))
+        return await cursor.fetchone()
+
+
+async def update_deposit_status(order_id: str, status: str, paid_at=None, from_status: str = None) -> bool:
+    """
+    Update deposit status.
+
+    With from_status the update only applies while the deposit is still in
+    that status (e.g. cancel only a pending deposit, never a paid one).
+    """
+    async with get_cursor() as cursor:
+        await cursor.execute("""
+            UPDATE deposits SET status = %s, paid_at = COALESCE(%s, paid_at)
+            WHERE order_id = %s AND (%s::text IS NULL OR status = %s)
+        """, (status, paid_at, order_id, from_status, from_status))
+        return cursor.rowcount > 0
+
+
+async def settle_deposit(order_id: str, paid_at: datetime = None) -> Optional[dict]:
+    """
+    Settle a paid deposit in one transaction and one round-trip: move it
+    from pending to paid, credit the user's balance and return the final
+    state. Only a pending deposit is credited, so repeated settles credit once.
+
+    Args:
+        order_id: Pakasir order ID (deposits.order_id)
+        paid_at: Payment time (default: now)
+
+    Returns:
+        None if the deposit does not exist, else {'deposit', 'settled', 'balance'}
+    """
+    async with get_cursor() as cursor:
+        await cursor.execute("""
+            WITH settled AS (
+                UPDATE deposits SET status = 'paid', paid_at = COALESCE(%s, NOW())
+                WHERE order_id = %s AND status = 'pending'
+                RETURNING bot_id, telegram_id, amount
+            ), credited AS (
+                INSERT INTO bot_users (bot_id, telegram_id, balance)
+                SELECT bot_id, telegram_id, amount FROM settled
+                ON CONFLICT (bot_id, telegram_id) DO UPDATE
+                SET balance = COALESCE(bot_users.balance, 0) + EXCLUDED.balance
+                RETURNING balance
+            )
+            SELECT d.*,
+                   settled.amount IS NOT NULL as settled_now,
+                   COALESCE(credited.balance, bu.balance, 0) as balance_after
+            FROM deposits d
+            LEFT JOIN settled ON true
+            LEFT JOIN credited ON true
+            LEFT JOIN bot_users bu ON bu.bot_id = d.bot_id AND bu.telegram_id = d.telegram_id
+            WHERE d.order_id = %s
+        """, (paid_at, order_id, order_id))
+        row = await cursor.fetchone()
+
+        # Lost a race with another settle: read the credited balance again
+        if row and not row['settled_now']:
+            await cursor.execute("""
+                SELECT d.*, false as settled_now, COALESCE(bu.balance, 0) as balance_after
+                FROM deposits d
+                LEFT JOIN bot_users bu ON bu.bot_id = d.bot_id AND bu.telegram_id = d.telegram_id
+                WHERE d.order_id = %s
+            """, (order_id,))
+            row = await cursor.fetchone()
+
+    if not row:
+        return None
+
+    deposit = dict(row)
+    settled = deposit.pop('settled_now')
+    balance = deposit.pop('balance_after')
+    if settled:
+        deposit['status'] = 'paid'
+    return {'deposit': deposit, 'settled': settled, 'balance': balance}
+
+
+# ==================== CATEGORY OPERATIONS ====================
+
+async def get_categories_by_bot(bot_id: int, active_only: bool = True) -> list[dict]:
+    """Get categories for a bot."""
+    async with get_cursor() as cursor:
+        query = "SELECT * FROM categories WHERE bot_id = %s"
+        if active_only:
+            query += " AND is_active = true"
+        query += " ORDER BY sort_order, name"
+        await cursor.execute(query, (bot_id,))
+        return await cursor.fetchall()
+
+
+async def get_category_by_id(category_id: int) -> Optional[dict]:
+    """Get category by ID."""
+    async with get_cursor() as cursor:
+        await cursor.execute("SELECT * FROM categories WHERE id = %s", (category_id,))
+        return await cursor.fetchone()
+
+
+async def create_category(bot_id: int, name: str, description: str = None) -> dict:
+    """Create a new category."""
+    async with get_cursor() as cursor:
+        await cursor.execute("""
+            INSERT INTO categories (bot_id, name, description)
+            VALUES (%s, %s, %s)
+            RETURNING *
+        """, (bot_id, name, description))
+        return await cursor.fetchone()
+
+
+async def update_category(category_id: int, **kwargs) -> Optional[dict]:
+    """Update a category."""
+    allowed = ['name', 'description', 'is_active', 'sort_order']
+    updates = {k: v for k, v in kwargs.items() if k in allowed and v is not None}
+
+    if not updates:
+        return await get_category_by_id(category_id)
+
+    async with get_cursor() as cursor:
+        set_clause = ", ".join([f"{k} = %s" for k in updates.keys()])
+        values = list(updates.values()) + [category_id]
+        await cursor.execute(f"""
+            UPDATE categories SET {set_clause}
+            WHERE id = %s RETURNING *
+        """, values)
+        return await cursor.fetchone()
+
+
+async def delete_category(category_id: int) -> bool:
+    """Delete a category."""
+    async with get_cursor() as cursor:
+        await cursor.execute("DELETE FROM categories WHERE id = %s", (category_id,))
+        return cursor.rowcount > 0
+
+
+# ==================== PRODUCT OPERATIONS ====================
+
+async def get_products_by_bot(bot_id: int, active_only: bool = True) -> list[dict]:
+    """Get all products for a bot."""
+    async with get_cursor() as cursor:
+        query = """
+            SELECT p.*, c.name as category_name,
+                   COALESCE(sc.available - sc.reserved, 0) as stock
+            FROM products p
+            LEFT JOIN categories c ON p.category_id = c.id
+            LEFT JOIN LATERAL (
+                SELECT SUM(available) as available, SUM(sold) as sold, SUM(reserved) as reserved
+                FROM product_stock_counts WHERE product_id = p.id
+            ) sc ON true
+            WHERE p.bot_id = %s
+        """
+        if active_only:
+            query += " AND p.is_active = true"
+        query += " ORDER BY p.name"
+        await cursor.execute(query, (bot_id,))
+        return await cursor.fetchall()
+
+
+async def get_products_by_category(category_id: int, bot_id: int, active_only: bool = True) -> list[dict]:
+    """Get products in a category."""
+    async with get_cursor() as cursor:
+        query = """
+            SELECT p.*,
+                   COALESCE(sc.available - sc.reserved, 0) as stock
+            FROM products p
+            LEFT JOIN LATERAL (
+                SELECT SUM(available) as available, SUM(sold) as sold, SUM(reserved) as reserved
+                FROM product_stock_counts WHERE product_id = p.id
+            ) sc ON true
+            WHERE p.category_id = %s AND p.bot_id = %s
+        """
+        if active_only:
+            query += " AND p.is_active = true"
+        query += " ORDER BY p.name"
+        await cursor.execute(query, (category_id, bot_id))
+        return await cursor.fetchall()
+
+
+async def get_product_by_id(product_id: int) -> Optional[dict]:
+    """Get product by ID."""
+    async with get_cursor() as cursor:
+        await cursor.execute("""
+            SELECT p.*,
+                   COALESCE(sc.available - sc.reserved, 0) as stock
+            FROM products p
+            LEFT JOIN LATERAL (
+                SELECT SUM(available) as available, SUM(sold) as sold, SUM(reserved) as reserved
+                FROM product_stock_counts WHERE product_id = p.id
+            ) sc ON true
+            WHERE p.id = %s
+        """, (product_id,))
+        return await cursor.fetchone()
+
+
+async def create_product(bot_id: int, category_id: int, name: str, price: int, description: str = None) -> dict:
+    """Create a new product."""
+    async with get_cursor() as cursor:
+        await cursor.execute("""
+            INSERT INTO products (bot_id, category_id, name, price, description)
+            VALUES (%s, %s, %s, %s, %s)
+            RETURNING *
+        """, (bot_id, category_id, name, price, description))
+        return await cursor.fetchone()
+
+
+async def update_product(product_id: int, **kwargs) -> Optional[dict]:
+    """Update a product."""
+    allowed = ['name', 'description', 'price', 'category_id', 'is_active']
+    updates = {k: v for k, v in kwargs.items() if k in allowed and v is not None}
+
+    if not updates:
+        return await get_product_by_id(product_id)
+
+    async with get_cursor() as cursor:
+        set_clause = ", ".join([f"{k} = %s" for k in updates.keys()])
+        set_clause += ", updated_at = NOW()"
+        values = list(updates.values()) + [product_id]
+        await cursor.execute(f"""
+            UPDATE products SET {set_clause}
+            WHERE id = %s RETURNING *
+        """, values)
+        return await cursor.fetchone()
+
+
+async def delete_product(product_id: int) -> bool:
+    """Delete a product."""
+    async with get_cursor() as cursor:
+        await cursor.execute("DELETE FROM products WHERE id = %s", (product_id,))
+        return cursor.rowcount > 0
+
+
+async def get_catalog(bot_id: int) -> tuple[list[dict], list[dict]]:
+    """
+    Load a bot's whole catalog (active and inactive) on one connection.
+
+    Returns:
+        (categories, products); products carry category_name and stock
+    """
+    async with get_cursor() as cursor:
+        await cursor.execute("""
+            SELECT * FROM categories
+            WHERE bot_id = %s
+            ORDER BY sort_order, name
+        """, (bot_id,))
+        categories = await cursor.fetchall()
+
+        await cursor.execute("""
+            SELECT p.*, c.name as category_name,
+                   COALESCE(sc.available - sc.reserved, 0) as stock
+            FROM products p
+            LEFT JOIN categories c ON p.category_id = c.id
+            LEFT JOIN LATERAL (
+                SELECT SUM(available) as available, SUM(sold) as sold, SUM(reserved) as reserved
+                FROM product_stock_counts WHERE product_id = p.id
+            ) sc ON true
+            WHERE p.bot_id = %s
+            ORDER BY p.name
+        """, (bot_id,))
+        products = await cursor.fetchall()
+        return categories, products
+
+
+# ==================== STOCK OPERATIONS ====================
+
+async def reserve_stock(product_id: int, order_code: str, hold_seconds: int, quantity: int = 1) -> int:
+    """
+    Hold up to quantity unsold, unheld stock items of a product for a pending order.
+
+    Items whose hold has lapsed count as free even before the sweeper
+    releases them. create_order later moves the hold to the payment's expiry.
+
+    Args:
+        product_id: Product to take stock from
+        order_code: orders.order_id the items are held for
+        hold_seconds: Provisional hold until the order row exists
+        quantity: Number of items wanted
+
+    Returns:
+        Number of items held, fewer than quantity when stock ran out
+    """
+    async with get_cursor() as cursor:
+        await cursor.execute("""
+            WITH picked AS (
+                SELECT id FROM product_stock
+                WHERE product_id = %s AND is_sold = false
+                  AND (reserved_until IS NULL OR reserved_until < NOW())
+                ORDER BY id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            UPDATE product_stock s
+            SET reserved_order = %s, reserved_until = NOW() + %s * INTERVAL '1 second'
+            FROM picked
+            WHERE s.id = picked.id
+        """, (product_id, quantity, order_code, hold_seconds))
+        return cursor.rowcount
+
+
+async def release_reservation(order_code: str) -> int:
+    """Release the stock held for an order (cancelled or never created)."""
+    async with get_cursor() as cursor:
+        await cursor.execute("""
+            UPDATE product_stock SET reserved_order = NULL, reserved_until = NULL
+            WHERE reserved_order = %s AND is_sold = false
+        """, (order_code,))
+        return cursor.rowcount
+
+
+async def release_expired_reservations(limit: int = 1000) -> dict[int, int]:
+    """
+    Release up to limit stock holds whose payment window has passed and
+    announce the affected catalogs on CATALOG_CHANGES_CHANNEL.
+
+    Returns:
+        bot_id -> number of items released
+    """
+    async with get_cursor() as cursor:
+        await cursor.execute("""
+            WITH expired AS (
+                SELECT id FROM product_stock
+                WHERE reserved_until < NOW() AND is_sold = false
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            ), released AS (
+                UPDATE product_stock s SET reserved_order = NULL, reserved_until = NULL
+                FROM expired
+                WHERE s.id = expired.id
+                RETURNING s.product_id
+            )
+            SELECT p.bot_id, COUNT(*) as released
+            FROM released r
+            JOIN products p ON p.id = r.product_id
+            GROUP BY p.bot_id
+        """, (limit,))
+        released = {row['bot_id']: row['released'] for row in await cursor.fetchall()}
+
+        if released:
+            # Delivered on commit, so other runners drop these catalogs too
+            await cursor.execute("""
+                SELECT pg_notify(%s, json_build_object('bot_id', bot_id)::text)
+                FROM unnest(%s::int[]) AS bot_id
+            """, (CATALOG_CHANGES_CHANNEL, list(released)))
+        return released
+
+
+async def claim_stock(product_id: int, order_id: int, quantity: int = 1, order_code: str = None) -> list[dict]:
+    """
+    Atomically claim up to quantity unsold stock items of a product for an order.
+
+    Items held for order_code are taken first; the rest come from items
+    nobody holds. Rows locked by concurrent claims are skipped instead of
+    waited for, so simultaneous buyers each get different items without
+    queueing.
+
+    Args:
+        product_id: Product to take stock from
+        order_id: orders.id the items are sold to
+        quantity: Number of items wanted
+        order_code: orders.order_id whose held items should be used
+
+    Returns:
+        Claimed items ({'id', 'content'}), fewer than quantity when stock ran out
+    """
+    async with get_cursor() as cursor:
+        await cursor.execute("""
+            WITH held AS (
+                SELECT id FROM product_stock
+                WHERE product_id = %s AND is_sold = false AND reserved_order = %s
+                ORDER BY id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            ), free AS (
+                SELECT id FROM product_stock
+                WHERE product_id = %s AND is_sold = false
+                  AND (reserved_until IS NULL OR reserved_until < NOW())
+                  AND COALESCE(reserved_order <> %s, true)
+                ORDER BY id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            ), picked AS (
+                SELECT id FROM held
+                UNION ALL
+                SELECT id FROM free
+                LIMIT %s
+            )
+            UPDATE product_stock s
+            SET is_sold = true, sold_at = NOW(), order_id = %s,
+                reserved_order = NULL, reserved_until = NULL
+            FROM picked
+            WHERE s.id = picked.id
+            RETURNING s.id, s.content
+        """, (
+            product_id, order_code, quantity,
+            product_id, order_code, quantity,
+            quantity, order_id
+        ))
+        return await cursor.fetchall()
+
+
+async def add_stock_items(product_id: int, contents: Iterable[str], progress=None) -> dict:
+    """
+    Bulk-import stock lines into a product, skipping blank and duplicate lines.
+
+    Args:
+        product_id: Product the lines are added to
+        contents: Stock lines (a list or a lazily read upload)
+        progress: Awaited after every batch with the counts so far
+
+    Returns:
+        {'received', 'added', 'duplicates'}
+    """
+    async with get_cursor() as cursor:
+        return await import_stock_async(cursor, product_id, contents, progress)
+
+
+# ==================== ORDER OPERATIONS ====================
+
+async def create_order(
+    bot_id: int,
+    bot_user_id: int,
+    product_id: int,
+    order_id: str,
+    amount: int,
+    fee: int = 0,
+    total: int = 0,
+    qris_string: str = None,
+    expired_at: datetime = None
+) -> dict:
+    """Create a new order; stock reserved for it is held until expired_at."""
+    async with get_cursor() as cursor:
+        await cursor.execute("""
+            WITH created AS (
+                INSERT INTO orders (bot_id, bot_user_id, product_id, order_id, amount, fee, total, qris_string, expired_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                RETURNING *
+            ), held AS (
+                UPDATE product_stock s SET reserved_until = created.expired_at
+                FROM created
+                WHERE s.reserved_order = created.order_id AND s.is_sold = false
+                  AND created.expired_at IS NOT NULL
+            )
+            SELECT * FROM created
+        """, (bot_id, bot_user_id, product_id, order_id, amount, fee, total, qris_string, expired_at))
+        return await cursor.fetchone()
+
+
+async def purchase_with_balance(bot_id: int, bot_user_id: int, product_id: int, order_id: str) -> dict:
+    """
+    Buy one item with the user's balance in one transaction and one
+    round-trip: take a free stock item, deduct the price, create the order
+    as paid and sell it the item. Nothing is written unless all of it succeeds.
+
+    Args:
+        bot_id: Database ID of the bot
+        bot_user_id: bot_users.id of the buyer
+        product_id: Product to buy
+        order_id: New order ID (orders.order_id)
+
+    Returns:
+        {'status', 'order', 'stock', 'price', 'balance'}; status is 'paid',
+        'no_product', 'no_stock' or 'insufficient_balance' and balance is
+        the balance after the purchase (or the unchanged balance)
+    """
+    async with get_cursor() as cursor:
+        await cursor.execute("""
+            WITH product AS (
+                SELECT id, price FROM products
+                WHERE id = %s AND bot_id = %s AND is_active = true
+            ), stock AS (
+                SELECT ps.id FROM product_stock ps
+                JOIN product ON ps.product_id = product.id
+                WHERE ps.is_sold = false
+                  AND (ps.reserved_until IS NULL OR ps.reserved_until < NOW())
+                ORDER BY ps.id
+                LIMIT 1
+                FOR UPDATE OF ps SKIP LOCKED
+            ), charged AS (
+                UPDATE bot_users bu SET balance = bu.balance - product.price
+                FROM product, stock
+                WHERE bu.id = %s AND bu.balance >= product.price
+                RETURNING bu.balance
+            ), created AS (
+                INSERT INTO orders (bot_id, bot_user_id, product_id, order_id, amount, fee, total,
+                                    status, payment_method, paid_at)
+                SELECT %s, %s, product.id, %s, product.price, 0, product.price,
+                       'paid', 'balance', NOW()
+                FROM product, charged
+                RETURNING *
+            ), sold AS (
+                UPDATE product_stock s
+                SET is_sold = true, sold_at = NOW(), order_id = created.id,
+                    reserved_order = NULL, reserved_until = NULL
+                FROM stock, created
+                WHERE s.id = stock.id
+                RETURNING s.id, s.content
+            )
+            SELECT product.price, stock.id IS NOT NULL as has_stock,
+                   COALESCE(charged.balance, bu.balance, 0) as balance,
+                   to_jsonb(created) as created_order,
+                   sold.id as stock_id, sold.content as stock_content
+            FROM (SELECT 1) one
+            LEFT JOIN product ON true
+            LEFT JOIN stock ON true
+            LEFT JOIN charged ON true
+            LEFT JOIN created ON true
+            LEFT JOIN sold ON true
+            LEFT JOIN bot_users bu ON bu.id = %s
+        """, (product_id, bot_id, bot_user_id, bot_id, bot_user_id, order_id, bot_user_id))
+        row = await cursor.fetchone()
+
+    if row['price'] is None:
+        status = 'no_product'
+    elif not row['has_stock']:
+        status = 'no_stock'
+    elif row['created_order'] is None:
+        status = 'insufficient_balance'
+    else:
+        status = 'paid'
+    return {
+        'status': status,
+        'order': row['created_order'],
+        'stock': {'id': row['stock_id'], 'content': row['stock_content']} if row['stock_id'] else None,
+        'price': row['price'],
+        'balance': row['balance']
+    }
+
+
+async def get_order_by_order_id(order_id: str) -> Optional[dict]:
+    """Get order by Pakasir order ID."""
+    async with get_cursor() as cursor:
+        await cursor.execute("""
+            SELECT o.*, p.name as product_name, bu.telegram_id
+            FROM orders o
+            LEFT JOIN products p ON o.product_id = p.id
+            LEFT JOIN bot_users bu ON o.bot_user_id = bu.id
+            WHERE o.order_id = %s
+        """, (order_id,))
+        return await cursor.fetchone()
+
+
+async def get_orders_by_bot(bot_id: int, limit: int = 50) -> list[dict]:
+    """Get orders for a bot."""
+    async with get_cursor() as cursor:
+        await cursor.execute("""
+            SELECT o.*, p.name as product_name, bu.username, bu.first_name
+            FROM orders o
+            LEFT JOIN products p ON o.product_id = p.id
+            LEFT JOIN bot_users bu ON o.bot_user_id = bu.id
+            WHERE o.bot_id = %s
+            ORDER BY o.created_at DESC
+            LIMIT %s
+        """, (bot_id, limit))
+        return await cursor.fetchall()
+
+
+async def get_orders_by_user(bot_id: int, bot_user_id: int, limit: int = 10) -> list[dict]:
+    """Get orders for a specific user."""
+    async with get_cursor() as cursor:
+        await cursor.execute("""
+            SELECT o.*, p.name as product_name
+            FROM orders o
+            LEFT JOIN products p ON o.product_id = p.id
+            WHERE o.bot_id = %s AND o.bot_user_id = %s
+            ORDER BY o.created_at DESC
+            LIMIT %s
+        """, (bot_id, bot_user_id, limit))
+        return await cursor.fetchall()
+
+
+async def update_order_status(order_id: str, status: str, paid_at: datetime = None, from_status: str = None) -> bool:
+    """
+    Update order status.
+
+    With from_status the update only applies while the order is still in
+    that status (e.g. cancel only a pending order, never a paid one).
+    """
+    async with get_cursor() as cursor:
+        await cursor.execute("""
+            UPDATE orders SET status = %s, paid_at = COALESCE(%s, paid_at)
+            WHERE order_id = %s AND (%s::text IS NULL OR status = %s)
+        """, (status, paid_at, order_id, from_status, from_status))
+        return cursor.rowcount > 0
+
+
+async def settle_order(order_id: str, paid_at: datetime = None) -> Optional[dict]:
+    """
+    Settle a paid order in one transaction and one round-trip: move it from
+    pending to paid, claim a stock item (the one held for it first) and
+    return the final state.
+
+    Only a pending order is moved, so settling twice (two taps on the
+    check button, the webhook and the poller racing) settles once.
+
+    Args:
+        order_id: Pakasir order ID (orders.order_id)
+        paid_at: Payment time (default: now)
+
+    Returns:
+        None if the order does not exist, else {'order', 'settled', 'stock'}:
+        settled is True only for the call that moved the order to paid;
+        stock is the item sold to the order ({'id', 'content'}) or None
+    """
+    async with get_cursor() as cursor:
+        await cursor.execute("""
+            WITH settled AS (
+                UPDATE orders SET status = 'paid', paid_at = COALESCE(%s, NOW())
+                WHERE order_id = %s AND status = 'pending'
+                RETURNING id, order_id, product_id
+            ), held AS (
+                SELECT ps.id FROM product_stock ps
+                JOIN settled ON ps.product_id = settled.product_id
+                WHERE ps.is_sold = false AND ps.reserved_order = settled.order_id
+                ORDER BY ps.id
+                LIMIT 1
+                FOR UPDATE OF ps SKIP LOCKED
+            ), free AS (
+                SELECT ps.id FROM product_stock ps
+                JOIN settled ON ps.product_id = settled.product_id
+                WHERE ps.is_sold = false
+                  AND (ps.reserved_until IS NULL OR ps.reserved_until < NOW())
+                  AND ps.reserved_order IS DISTINCT FROM settled.order_id
+                ORDER BY ps.id
+                LIMIT 1
+                FOR UPDATE OF ps SKIP LOCKED
+            ), picked AS (
+                SELECT id FROM held
+                UNION ALL
+                SELECT id FROM free
+                LIMIT 1
+            ), claimed AS (
+                UPDATE product_stock s
+                SET is_sold = true, sold_at = NOW(), order_id = settled.id,
+                    reserved_order = NULL, reserved_until = NULL
+                FROM picked, settled
+                WHERE s.id = picked.id
+                RETURNING s.id, s.content
+            )
+            SELECT o.*, p.name as product_name, bu.telegram_id,
+                   settled.id IS NOT NULL as settled_now,
+                   COALESCE(claimed.id, sold.id) as stock_id,
+                   COALESCE(claimed.content, sold.content) as stock_content
+            FROM orders o
+            LEFT JOIN products p ON o.product_id = p.id
+            LEFT JOIN bot_users bu ON o.bot_user_id = bu.id
+            LEFT JOIN settled ON true
+            LEFT JOIN claimed ON true
+            LEFT JOIN LATERAL (
+                SELECT id, content FROM product_stock
+                WHERE order_id = o.id ORDER BY id LIMIT 1
+            ) sold ON true
+            WHERE o.order_id = %s
+        """, (paid_at, order_id, order_id))
+        row = await cursor.fetchone()
+
+        # Lost a race with another settle: this statement's snapshot predates
+        # the winner's commit, so read the paid order and its item again
+        if row and not row['settled_now']:
+            await cursor.execute("""
+                SELECT o.*, p.name as product_name, bu.telegram_id,
+                       false as settled_now,
+                       sold.id as stock_id, sold.content as stock_content
+                FROM orders o
+                LEFT JOIN products p ON o.product_id = p.id
+                LEFT JOIN bot_users bu ON o.bot_user_id = bu.id
+                LEFT JOIN LATERAL (
+                    SELECT id, content FROM product_stock
+                    WHERE order_id = o.id ORDER BY id LIMIT 1
+                ) sold ON true
+                WHERE o.order_id = %s
+            """, (order_id,))
+            row = await cursor.fetchone()
+
+    if not row:
+        return None
+
+    order = dict(row)
+    settled = order.pop('settled_now')
+    stock_id, stock_content = order.pop('stock_id'), order.pop('stock_content')
+    if settled:
+        order['status'] = 'paid'
+    return {
+        'order': order,
+        'settled': settled,
+        'stock': {'id': stock_id, 'content': stock_content} if stock_id else None
+    }
+
+
+async def get_pending_payments(bot_ids: list[int], grace_seconds: int = 120, max_age_seconds: int = 86400) -> list[dict]:
+    """
+    Pending orders and deposits of some bots, for the payment reconciler.
+
+    Args:
+        bot_ids: Bots whose payments are returned
+        grace_seconds: Also return payments expired at most this long ago
+            (a payment made just before expiry is reported late)
+        max_age_seconds: Ignore payments created longer ago than this
+
+    Returns:
+        Rows with kind ('order' or 'deposit'), order_id, bot_id, telegram_id,
+        amount, age (seconds since created) and remaining (seconds until
+        expiry, None if it has no expiry)
+    """
+    async with get_cursor() as cursor:
+        await cursor.execute("""
+            SELECT 'order' as kind, o.order_id, o.bot_id, bu.telegram_id, o.amount,
+                   EXTRACT(EPOCH FROM NOW() - o.created_at)::float as age,
+                   EXTRACT(EPOCH FROM o.expired_at - NOW())::float as remaining
+            FROM orders o
+            JOIN bot_users bu ON o.bot_user_id = bu.id
+            WHERE o.status = 'pending' AND o.bot_id = ANY(%s)
+              AND o.created_at > NOW() - make_interval(secs => %s)
+              AND (o.expired_at IS NULL OR o.expired_at > NOW() - make_interval(secs => %s))
+            UNION ALL
+            SELECT 'deposit', d.order_id, d.bot_id, d.telegram_id, d.amount,
+                   EXTRACT(EPOCH FROM NOW() - d.created_at)::float,
+                   EXTRACT(EPOCH FROM d.expired_at - NOW())::float
+            FROM deposits d
+            WHERE d.status = 'pending' AND d.bot_id = ANY(%s)
+              AND d.created_at > NOW() - make_interval(secs => %s)
+              AND (d.expired_at IS NULL OR d.expired_at > NOW() - make_interval(secs => %s))
+        """, (bot_ids, max_age_seconds, grace_seconds, bot_ids, max_age_seconds, grace_seconds))
+        return await cursor.fetchall()
+
+
+async def get_bot_stats(bot_id: int) -> dict:
+    """Get statistics for a bot (from bot_stats counters)."""
+    async with get_cursor() as cursor:
+        await cursor.execute("""
+            SELECT COALESCE(SUM(total_products), 0) as total_products,
+                   COALESCE(SUM(total_users), 0) as total_users,
+                   COALESCE(SUM(total_transactions), 0) as total_orders,
+                   COALESCE(SUM(total_revenue), 0)::bigint as total_revenue
+            FROM bot_stats WHERE bot_id = %s
+        """, (bot_id,))
+        return await cursor.fetchone()
@@ -6,44 +6,63 @@ Uses connection pooling for fast response times.
 
 import os
 import psycopg2
-from psycopg2.pool import ThreadedConnectionPool
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
 from contextlib import contextmanager
 from datetime import datetime
-from typing import Optional
+from typing import Iterable, Optional
 from dotenv import load_dotenv
 import logging
 
+from utils.db_pool import ManagedConnectionPool, call_site
+from utils.stock_import import import_stock_sync
+
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL", "")
 
+# LISTEN needs a session-level connection; Neon's "-pooler" endpoint
+# (transaction pooling) does not deliver notifications.
+DATABASE_DIRECT_URL = os.getenv("DATABASE_DIRECT_URL") or DATABASE_URL.replace("-pooler.", ".")
+
+# NOTIFY channel the API uses to announce bot create/update/delete
+BOT_CHANGES_CHANNEL = "bot_changes"
+
+# NOTIFY channel the API uses to announce catalog (category/product/stock) changes
+CATALOG_CHANGES_CHANNEL = "catalog_changes"
+
+# Frames skipped when naming the call site of a checkout
+_POOL_WRAPPERS = ("get_connection", "get_cursor")
+
 # Owner Telegram ID - has unlimited points
 OWNER_TELEGRAM_ID = int(os.getenv("OWNER_TELEGRAM_ID", "0"))
 
 # Global connection pool
-_connection_pool: Optional[ThreadedConnectionPool] = None
+_connection_pool: Optional[ManagedConnectionPool] = None
 _pool_logger = logging.getLogger("db_pool")
 
 
-def init_connection_pool(minconn: int = 2, maxconn: int = 10):
+def init_connection_pool(minconn: int = None, maxconn: int = None):
     """
     Initialize the database connection pool.
     Call this once at application startup for faster database operations.
     
     Args:
-        minconn: Minimum connections to keep in pool (default: 2)
-        maxconn: Maximum connections allowed in pool (default: 10)
+        minconn: Minimum connections to keep in pool (default: DB_POOL_MIN)
+        maxconn: Maximum connections allowed in pool (default: DB_POOL_MAX)
     """
     global _connection_pool
     if _connection_pool is None:
         try:
-            _connection_pool = ThreadedConnectionPool(
+            _connection_pool = ManagedConnectionPool(
+                DATABASE_URL,
                 minconn=minconn,
                 maxconn=maxconn,
-                dsn=DATABASE_URL
+                name="runner"
+            )
+            _pool_logger.info(
+                f"Connection pool initialized "
+                f"(min={_connection_pool.minconn}, max={_connection_pool.maxconn})"
             )
-            _pool_logger.info(f"Connection pool initialized (min={minconn}, max={maxconn})")
         except Exception as e:
             _pool_logger.error(f"Failed to initialize connection pool: {e}")
             raise
@@ -58,16 +77,27 @@ def close_connection_pool():
         _pool_logger.info("Connection pool closed")
 
 
+def get_pool_stats() -> dict:
+    """Occupancy and per call site wait/hold stats of the connection pool."""
+    return _connection_pool.stats() if _connection_pool else {}
+
+
 @contextmanager
-def get_connection():
-    """Get database connection from pool with context manager."""
+def get_connection(site: str = None):
+    """
+    Get database connection from pool with context manager.
+    
+    Args:
+        site: Call site label for pool stats (default: the calling function)
+    """
     global _connection_pool
     
     # Initialize pool on first use if not already done
     if _connection_pool is None:
         init_connection_pool()
     
-    conn = _connection_pool.getconn()
+    pool = _connection_pool
+    conn = pool.getconn(site or call_site(_POOL_WRAPPERS))
     try:
         yield conn
         conn.commit()
@@ -76,7 +106,7 @@ def get_connection():
         raise
     finally:
         # Return connection to pool instead of closing
-        _connection_pool.putconn(conn)
+        pool.putconn(conn)
 
 
 @contextmanager
@@ -96,8 +126,8 @@ def get_active_bots() -> list[dict]:
     """Get all active bots from database."""
     with get_cursor() as cursor:
         cursor.execute("""
-            SELECT id, user_id, telegram_token, bot_username, bot_name,
-                   pakasir_slug, pakasir_api_key, bot_type, is_active
+            SELECT id, user_id, telegram_token, bot_username, bot_name, telegram_first_name,
+                   pakasir_slug, pakasir_api_key, bot_type, update_mode, is_active
             FROM bots
             WHERE is_active = true
         """)
@@ -108,14 +138,48 @@ def get_bot_by_id(bot_id: int) -> Optional[dict]:
     """Get bot by ID."""
     with get_cursor() as cursor:
         cursor.execute("""
-            SELECT id, user_id, telegram_token, bot_username, bot_name,
-                   pakasir_slug, pakasir_api_key, bot_type, is_active
+            SELECT id, user_id, telegram_token, bot_username, bot_name, telegram_first_name,
+                   pakasir_slug, pakasir_api_key, bot_type, update_mode, is_active
             FROM bots WHERE id = %s
         """, (bot_id,))
         row = cursor.fetchone()
         return dict(row) if row else None
 
 
+def update_bot_identity(bot_id: int, bot_username: str, telegram_first_name: str) -> bool:
+    """
+    Cache the bot's Telegram identity (from getMe) in the bots table.
+    bot_name is the tenant's label and is left alone.
+    """
+    with get_cursor() as cursor:
+        cursor.execute("""
+            UPDATE bots SET bot_username = %s, telegram_first_name = %s
+            WHERE id = %s
+        """, (bot_username, telegram_first_name, bot_id))
+        return cursor.rowcount > 0
+
+
+def deactivate_bot(bot_id: int) -> bool:
+    """Set a bot inactive (used when the runner quarantines it)."""
+    with get_cursor() as cursor:
+        cursor.execute("""
+            UPDATE bots SET is_active = false WHERE id = %s
+        """, (bot_id,))
+        return cursor.rowcount > 0
+
+
+def get_pending_order_counts() -> dict[int, int]:
+    """Get the number of unexpired pending orders per bot."""
+    with get_cursor() as cursor:
+        cursor.execute("""
+            SELECT bot_id, COUNT(*) as pending
+            FROM orders
+            WHERE status = 'pending' AND (expired_at IS NULL OR expired_at > NOW())
+            GROUP BY bot_id
+        """)
+        return {row['bot_id']: row['pending'] for row in cursor.fetchall()}
+
+
 def get_bot_owner_telegram_id(bot_id: int) -> Optional[int]:
     """Get the Telegram ID of the bot owner (for admin check)."""
     with get_cursor() as cursor:
@@ -132,22 +196,14 @@ def get_bot_owner_telegram_id(bot_id: int) -> Optional[int]:
 # ==================== BOT USER OPERATIONS ====================
 
 def get_or_create_bot_user(bot_id: int, telegram_id: int, username: str = None, first_name: str = None) -> dict:
-    """Get or create a bot user."""
+    """Get or create a bot user, refreshing its username and first name, in one statement."""
     with get_cursor() as cursor:
-        # Try to get existing
-        cursor.execute("""
-            SELECT * FROM bot_users
-            WHERE bot_id = %s AND telegram_id = %s
-        """, (bot_id, telegram_id))
-        row = cursor.fetchone()
-        
-        if row:
-            return dict(row)
-        
-        # Create new
         cursor.execute("""
             INSERT INTO bot_users (bot_id, telegram_id, username, first_name)
             VALUES (%s, %s, %s, %s)
+            ON CONFLICT (bot_id, telegram_id) DO UPDATE SET
+                username = EXCLUDED.username,
+                first_name = EXCLUDED.first_name
             RETURNING *
         """, (bot_id, telegram_id, username, first_name))
         return dict(cursor.fetchone())
@@ -165,31 +221,24 @@ def get_bot_user(bot_id: int, telegram_id: int) -> Optional[dict]:
 
 
 def get_store_stats(bot_id: int) -> dict:
-    """Get store statistics: total users and completed transactions."""
+    """Get store statistics: total users and completed transactions (from bot_stats counters)."""
     with get_cursor() as cursor:
         cursor.execute("""
-            SELECT 
-                (SELECT COUNT(*) FROM bot_users WHERE bot_id = %s) as total_users,
-                (SELECT COUNT(*) FROM orders WHERE bot_id = %s AND status = 'paid') as total_transactions,
-                (SELECT COALESCE(SUM(amount), 0) FROM orders WHERE bot_id = %s AND status = 'paid') as total_revenue
-        """, (bot_id, bot_id, bot_id))
-        row = cursor.fetchone()
-        return dict(row) if row else {'total_users': 0, 'total_transactions': 0, 'total_revenue': 0}
+            SELECT COALESCE(SUM(total_users), 0) as total_users,
+                   COALESCE(SUM(total_transactions), 0) as total_transactions,
+                   COALESCE(SUM(total_revenue), 0)::bigint as total_revenue
+            FROM bot_stats WHERE bot_id = %s
+        """, (bot_id,))
+        return dict(cursor.fetchone())
 
 
 def get_leaderboard(bot_id: int, limit: int = 10) -> list[dict]:
-    """Get top buyers leaderboard."""
-    with get_cursor() as cursor:
-        cursor.execute("""
-            SELECT 
-                bu.username, bu.first_name, bu.telegram_id,
-                COUNT(o.id) as total_orders,
-                COALESCE(SUM(o.amount), 0) as total_spent
-            FROM bot_users bu
-            LEFT JOIN orders o ON bu.id = o.bot_user_id AND o.status = 'paid'
-            WHERE bu.bot_id = %s
-            GROUP BY bu.id, bu.username, bu.first_name, bu.telegram_id
-            HAVING COUNT(o.id) > 0
+    """Get top buyers leaderboard (from bot_users buyer totals)."""
+    with get_cursor() as cursor:
+        cursor.execute("""
+            SELECT username, first_name, telegram_id, total_orders, total_spent
+            FROM bot_users
+            WHERE bot_id = %s AND total_orders > 0
             ORDER BY total_spent DESC, total_orders DESC
             LIMIT %s
         """, (bot_id, limit))
@@ -249,20 +298,129 @@ def get_deposit_by_order_id(order_id: str) -> Optional[dict]:
         return dict(row) if row else None
 
 
-def update_deposit_status(order_id: str, status: str, paid_at=None) -> bool:
-    """Update deposit status."""
+def update_deposit_status(order_id: str, status: str, paid_at=None, from_status: str = None) -> bool:
+    """
+    Update deposit status.
+
+    With from_status the update only applies while the deposit is still in
+    that status (e.g. cancel only a pending deposit, never a paid one).
+    """
     with get_cursor() as cursor:
-        if paid_at:
-            cursor.execute("""
-                UPDATE deposits SET status = %s, paid_at = %s WHERE order_id = %s
-            """, (status, paid_at, order_id))
-        else:
-            cursor.execute("""
-                UPDATE deposits SET status = %s WHERE order_id = %s
-            """, (status, order_id))
+        cursor.execute("""
+            UPDATE deposits SET status = %s, paid_at = COALESCE(%s, paid_at)
+            WHERE order_id = %s AND (%s::text IS NULL OR status = %s)
+        """, (status, paid_at, order_id, from_status, from_status))
         return cursor.rowcount > 0
 
 
+def settle_deposit(order_id: str, paid_at: datetime = None) -> Optional[dict]:
+    """
+    Settle a paid deposit in one transaction and one round-trip: move it
+    from pending to paid, credit the user's balance and return the final
+    state. Only a pending deposit is credited, so repeated settles credit once.
+
+    Args:
+        order_id: Pakasir order ID (deposits.order_id)
+        paid_at: Payment time (default: now)
+
+    Returns:
+        None if the deposit does not exist, else {'deposit', 'settled', 'balance'}
+    """
+    with get_cursor() as cursor:
+        cursor.execute("""
+            WITH settled AS (
+                UPDATE deposits SET status = 'paid', paid_at = COALESCE(%s, NOW())
+                WHERE order_id = %s AND status = 'pending'
+                RETURNING bot_id, telegram_id, amount
+            ), credited AS (
+                INSERT INTO bot_users (bot_id, telegram_id, balance)
+                SELECT bot_id, telegram_id, amount FROM settled
+                ON CONFLICT (bot_id, telegram_id) DO UPDATE
+                SET balance = COALESCE(bot_users.balance, 0) + EXCLUDED.balance
+                RETURNING balance
+            )
+            SELECT d.*,
+                   settled.amount IS NOT NULL as settled_now,
+                   COALESCE(credited.balance, bu.balance, 0) as balance_after
+            FROM deposits d
+            LEFT JOIN settled ON true
+            LEFT JOIN credited ON true
+            LEFT JOIN bot_users bu ON bu.bot_id = d.bot_id AND bu.telegram_id = d.telegram_id
+            WHERE d.order_id = %s
+        """, (paid_at, order_id, order_id))
+        row = cursor.fetchone()
+
+        # Lost a race with another settle: read the credited balance again
+        if row and not row['settled_now']:
+            cursor.execute("""
+                SELECT d.*, false as settled_now, COALESCE(bu.balance, 0) as balance_after
+                FROM deposits d
+                LEFT JOIN bot_users bu ON bu.bot_id = d.bot_id AND bu.telegram_id = d.telegram_id
+                WHERE d.order_id = %s
+            """, (order_id,))
+            row = cursor.fetchone()
+
+    if not row:
+        return None
+
+    deposit = dict(row)
+    settled = deposit.pop('settled_now')
+    balance = deposit.pop('balance_after')
+    if settled:
+        deposit['status'] = 'paid'
+    return {'deposit': deposit, 'settled': settled, 'balance': balance}
+
+
+# ==================== PERSISTENCE OPERATIONS ====================
+
+def get_persisted_entry(bot_id: int, kind: str, key: str) -> Optional[dict]:
+    """Get one persisted entry (user_data, chat_data) of a bot."""
+    with get_cursor() as cursor:
+        cursor.execute("""
+            SELECT data FROM bot_persistence
+            WHERE bot_id = %s AND kind = %s AND key = %s
+        """, (bot_id, kind, key))
+        row = cursor.fetchone()
+        return row['data'] if row else None
+
+
+def get_persisted_entries(bot_id: int, kind: str) -> dict[str, object]:
+    """Get all persisted entries of one kind (e.g. a conversation) of a bot."""
+    with get_cursor() as cursor:
+        cursor.execute("""
+            SELECT key, data FROM bot_persistence
+            WHERE bot_id = %s AND kind = %s
+        """, (bot_id, kind))
+        return {row['key']: row['data'] for row in cursor.fetchall()}
+
+
+def save_persisted_entries(bot_id: int, entries: dict[tuple, Optional[str]]) -> None:
+    """
+    Write a batch of persisted entries in one transaction.
+    
+    Args:
+        bot_id: Database ID of the bot
+        entries: (kind, key) -> JSON-encoded data, or None to delete the entry
+    """
+    upserts = [(bot_id, kind, key, data) for (kind, key), data in entries.items() if data is not None]
+    deletes = [(bot_id, kind, key) for (kind, key), data in entries.items() if data is None]
+    
+    with get_cursor() as cursor:
+        if upserts:
+            execute_values(cursor, """
+                INSERT INTO bot_persistence (bot_id, kind, key, data)
+                VALUES %s
+                ON CONFLICT (bot_id, kind, key)
+                DO UPDATE SET data = EXCLUDED.data, updated_at = NOW()
+            """, upserts, template="(%s, %s, %s, %s::jsonb)")
+        if deletes:
+            execute_values(cursor, """
+                DELETE FROM bot_persistence p
+                USING (VALUES %s) AS d(bot_id, kind, key)
+                WHERE p.bot_id = d.bot_id AND p.kind = d.kind AND p.key = d.key
+            """, deletes)
+
+
 # ==================== CATEGORY OPERATIONS ====================
 
 def get_categories_by_bot(bot_id: int, active_only: bool = True) -> list[dict]:
@@ -328,9 +486,13 @@ def get_products_by_bot(bot_id: int, active_only: bool = True) -> list[dict]:
     with get_cursor() as cursor:
         query = """
             SELECT p.*, c.name as category_name,
-                   (SELECT COUNT(*) FROM product_stock WHERE product_id = p.id AND is_sold = false) as stock
+                   COALESCE(sc.available - sc.reserved, 0) as stock
             FROM products p
             LEFT JOIN categories c ON p.category_id = c.id
+            LEFT JOIN LATERAL (
+                SELECT SUM(available) as available, SUM(sold) as sold, SUM(reserved) as reserved
+                FROM product_stock_counts WHERE product_id = p.id
+            ) sc ON true
             WHERE p.bot_id = %s
         """
         if active_only:
@@ -345,8 +507,12 @@ def get_products_by_category(category_id: int, bot_id: int, active_only: bool =
     with get_cursor() as cursor:
         query = """
             SELECT p.*,
-                   (SELECT COUNT(*) FROM product_stock WHERE product_id = p.id AND is_sold = false) as stock
+                   COALESCE(sc.available - sc.reserved, 0) as stock
             FROM products p
+            LEFT JOIN LATERAL (
+                SELECT SUM(available) as available, SUM(sold) as sold, SUM(reserved) as reserved
+                FROM product_stock_counts WHERE product_id = p.id
+            ) sc ON true
             WHERE p.category_id = %s AND p.bot_id = %s
         """
         if active_only:
@@ -361,8 +527,12 @@ def get_product_by_id(product_id: int) -> Optional[dict]:
     with get_cursor() as cursor:
         cursor.execute("""
             SELECT p.*,
-                   (SELECT COUNT(*) FROM product_stock WHERE product_id = p.id AND is_sold = false) as stock
+                   COALESCE(sc.available - sc.reserved, 0) as stock
             FROM products p
+            LEFT JOIN LATERAL (
+                SELECT SUM(available) as available, SUM(sold) as sold, SUM(reserved) as reserved
+                FROM product_stock_counts WHERE product_id = p.id
+            ) sc ON true
             WHERE p.id = %s
         """, (product_id,))
         row = cursor.fetchone()
@@ -409,38 +579,69 @@ def delete_product(product_id: int) -> bool:
 
 # ==================== STOCK OPERATIONS ====================
 
-def get_available_stock(product_id: int) -> Optional[dict]:
-    """Get one available stock item (not sold)."""
-    with get_cursor() as cursor:
-        cursor.execute("""
-            SELECT * FROM product_stock
-            WHERE product_id = %s AND is_sold = false
-            LIMIT 1
-        """, (product_id,))
-        row = cursor.fetchone()
-        return dict(row) if row else None
+def claim_stock(product_id: int, order_id: int, quantity: int = 1, order_code: str = None) -> list[dict]:
+    """
+    Atomically claim up to quantity unsold stock items of a product for an order.
 
+    Items held for order_code are taken first; the rest come from items
+    nobody holds. Rows locked by concurrent claims are skipped instead of
+    waited for, so simultaneous buyers each get different items without
+    queueing.
+
+    Args:
+        product_id: Product to take stock from
+        order_id: orders.id the items are sold to
+        quantity: Number of items wanted
+        order_code: orders.order_id whose held items should be used
 
-def mark_stock_sold(stock_id: int, order_id: int) -> bool:
-    """Mark a stock item as sold."""
+    Returns:
+        Claimed items ({'id', 'content'}), fewer than quantity when stock ran out
+    """
     with get_cursor() as cursor:
         cursor.execute("""
-            UPDATE product_stock
-            SET is_sold = true, sold_at = NOW(), order_id = %s
-            WHERE id = %s
-        """, (order_id, stock_id))
-        return cursor.rowcount > 0
+            WITH held AS (
+                SELECT id FROM product_stock
+                WHERE product_id = %s AND is_sold = false AND reserved_order = %s
+                ORDER BY id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            ), free AS (
+                SELECT id FROM product_stock
+                WHERE product_id = %s AND is_sold = false
+                  AND (reserved_until IS NULL OR reserved_until < NOW())
+                  AND COALESCE(reserved_order <> %s, true)
+                ORDER BY id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            ), picked AS (
+                SELECT id FROM held
+                UNION ALL
+                SELECT id FROM free
+                LIMIT %s
+            )
+            UPDATE product_stock s
+            SET is_sold = true, sold_at = NOW(), order_id = %s,
+                reserved_order = NULL, reserved_until = NULL
+            FROM picked
+            WHERE s.id = picked.id
+            RETURNING s.id, s.content
+        """, (
+            product_id, order_code, quantity,
+            product_id, order_code, quantity,
+            quantity, order_id
+        ))
+        return [dict(row) for row in cursor.fetchall()]
 
 
-def add_stock_items(product_id: int, contents: list[str]) -> int:
-    """Add multiple stock items to a product."""
+def add_stock_items(product_id: int, contents: Iterable[str], progress=None) -> dict:
+    """
+    Bulk-import stock lines into a product, skipping blank and duplicate lines.
+
+    Returns:
+        {'received', 'added', 'duplicates'}
+    """
     with get_cursor() as cursor:
-        for content in contents:
-            cursor.execute("""
-                INSERT INTO product_stock (product_id, content)
-                VALUES (%s, %s)
-            """, (product_id, content.strip()))
-        return len(contents)
+        return import_stock_sync(cursor, product_id, contents, progress)
 
 
 # ==================== ORDER OPERATIONS ====================
@@ -509,35 +710,266 @@ def get_orders_by_user(bot_id: int, bot_user_id: int, limit: int = 10) -> list[d
         return [dict(row) for row in cursor.fetchall()]
 
 
-def update_order_status(order_id: str, status: str, paid_at: datetime = None) -> bool:
-    """Update order status."""
+def update_order_status(order_id: str, status: str, paid_at: datetime = None, from_status: str = None) -> bool:
+    """
+    Update order status.
+
+    With from_status the update only applies while the order is still in
+    that status (e.g. cancel only a pending order, never a paid one).
+    """
     with get_cursor() as cursor:
-        if paid_at:
-            cursor.execute("""
-                UPDATE orders SET status = %s, paid_at = %s
-                WHERE order_id = %s
-            """, (status, paid_at, order_id))
-        else:
-            cursor.execute("""
-                UPDATE orders SET status = %s
-                WHERE order_id = %s
-            """, (status, order_id))
+        cursor.execute("""
+            UPDATE orders SET status = %s, paid_at = COALESCE(%s, paid_at)
+            WHERE order_id = %s AND (%s::text IS NULL OR status = %s)
+        """, (status, paid_at, order_id, from_status, from_status))
         return cursor.rowcount > 0
 
 
+def settle_order(order_id: str, paid_at: datetime = None) -> Optional[dict]:
+    """
+    Settle a paid order in one transaction and one round-trip: move it from
+    pending to paid, claim a stock item (the one held for it first) and
+    return the final state.
+
+    Only a pending order is moved, so settling twice (two taps on the
+    check button, the webhook and the poller racing) settles once.
+
+    Args:
+        order_id: Pakasir order ID (orders.order_id)
+        paid_at: Payment time (default: now)
+
+    Returns:
+        None if the order does not exist, else {'order', 'settled', 'stock'}:
+        settled is True only for the call that moved the order to paid;
+        stock is the item sold to the order ({'id', 'content'}) or None
+    """
+    with get_cursor() as cursor:
+        cursor.execute("""
+            WITH settled AS (
+                UPDATE orders SET status = 'paid', paid_at = COALESCE(%s, NOW())
+                WHERE order_id = %s AND status = 'pending'
+                RETURNING id, order_id, product_id
+            ), held AS (
+                SELECT ps.id FROM product_stock ps
+                JOIN settled ON ps.product_id = settled.product_id
+                WHERE ps.is_sold = false AND ps.reserved_order = settled.order_id
+                ORDER BY ps.id
+                LIMIT 1
+                FOR UPDATE OF ps SKIP LOCKED
+            ), free AS (
+                SELECT ps.id FROM product_stock ps
+                JOIN settled ON ps.product_id = settled.product_id
+                WHERE ps.is_sold = false
+                  AND (ps.reserved_until IS NULL OR ps.reserved_until < NOW())
+                  AND ps.reserved_order IS DISTINCT FROM settled.order_id
+                ORDER BY ps.id
+                LIMIT 1
+                FOR UPDATE OF ps SKIP LOCKED
+            ), picked AS (
+                SELECT id FROM held
+                UNION ALL
+                SELECT id FROM free
+                LIMIT 1
+            ), claimed AS (
+                UPDATE product_stock s
+                SET is_sold = true, sold_at = NOW(), order_id = settled.id,
+                    reserved_order = NULL, reserved_until = NULL
+                FROM picked, settled
+                WHERE s.id = picked.id
+                RETURNING s.id, s.content
+            )
+            SELECT o.*, p.name as product_name, bu.telegram_id,
+                   settled.id IS NOT NULL as settled_now,
+                   COALESCE(claimed.id, sold.id) as stock_id,
+                   COALESCE(claimed.content, sold.content) as stock_content
+            FROM orders o
+            LEFT JOIN products p ON o.product_id = p.id
+            LEFT JOIN bot_users bu ON o.bot_user_id = bu.id
+            LEFT JOIN settled ON true
+            LEFT JOIN claimed ON true
+            LEFT JOIN LATERAL (
+                SELECT id, content FROM product_stock
+                WHERE order_id = o.id ORDER BY id LIMIT 1
+            ) sold ON true
+            WHERE o.order_id = %s
+        """, (paid_at, order_id, order_id))
+        row = cursor.fetchone()
+
+        # Lost a race with another settle: this statement's snapshot predates
+        # the winner's commit, so read the paid order and its item again
+        if row and not row['settled_now']:
+            cursor.execute("""
+                SELECT o.*, p.name as product_name, bu.telegram_id,
+                       false as settled_now,
+                       sold.id as stock_id, sold.content as stock_content
+                FROM orders o
+                LEFT JOIN products p ON o.product_id = p.id
+                LEFT JOIN bot_users bu ON o.bot_user_id = bu.id
+                LEFT JOIN LATERAL (
+                    SELECT id, content FROM product_stock
+                    WHERE order_id = o.id ORDER BY id LIMIT 1
+                ) sold ON true
+                WHERE o.order_id = %s
+            """, (order_id,))
+            row = cursor.fetchone()
+
+    if not row:
+        return None
+
+    order = dict(row)
+    settled = order.pop('settled_now')
+    stock_id, stock_content = order.pop('stock_id'), order.pop('stock_content')
+    if settled:
+        order['status'] = 'paid'
+    return {
+        'order': order,
+        'settled': settled,
+        'stock': {'id': stock_id, 'content': stock_content} if stock_id else None
+    }
+
+
 def get_bot_stats(bot_id: int) -> dict:
-    """Get statistics for a bot."""
+    """Get statistics for a bot (from bot_stats counters)."""
     with get_cursor() as cursor:
         cursor.execute("""
-            SELECT 
-                (SELECT COUNT(*) FROM products WHERE bot_id = %s) as total_products,
-                (SELECT COUNT(*) FROM bot_users WHERE bot_id = %s) as total_users,
-                (SELECT COUNT(*) FROM orders WHERE bot_id = %s AND status = 'paid') as total_orders,
-                (SELECT COALESCE(SUM(amount), 0) FROM orders WHERE bot_id = %s AND status = 'paid') as total_revenue
-        """, (bot_id, bot_id, bot_id, bot_id))
+            SELECT COALESCE(SUM(total_products), 0) as total_products,
+                   COALESCE(SUM(total_users), 0) as total_users,
+                   COALESCE(SUM(total_transactions), 0) as total_orders,
+                   COALESCE(SUM(total_revenue), 0)::bigint as total_revenue
+            FROM bot_stats WHERE bot_id = %s
+        """, (bot_id,))
         return dict(cursor.fetchone())
 
 
+def rebuild_bot_stats(bot_id: int) -> dict:
+    """
+    Recount a bot's bot_stats counters from bot_users, orders and products,
+    its buyers' leaderboard totals and rollups from orders, and its
+    products' stock counters (product_stock_counts) from product_stock.
+    
+    The bot's and its products' counters locks are taken first, so writers
+    that commit meanwhile apply their deltas after the recount instead of
+    being lost.
+    
+    Args:
+        bot_id: Database ID of the bot
+    
+    Returns:
+        Counters before and after the rebuild, and how many buyers' totals
+        and products' stock counters were off
+    """
+    with get_cursor() as cursor:
+        # Hold the bot's counters lock exclusive (writers take it shared),
+        # then read and recount in new statements, which see every write
+        # committed while waiting
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext('bot_stats'), %s)", (bot_id,))
+        cursor.execute("""
+            SELECT COALESCE(SUM(total_users), 0) as total_users,
+                   COALESCE(SUM(total_transactions), 0) as total_transactions,
+                   COALESCE(SUM(total_revenue), 0)::bigint as total_revenue,
+                   COALESCE(SUM(total_products), 0) as total_products
+            FROM bot_stats WHERE bot_id = %s
+        """, (bot_id,))
+        before = dict(cursor.fetchone())
+        
+        # Fold the slots into slot 0
+        cursor.execute("DELETE FROM bot_stats WHERE bot_id = %s AND slot <> 0", (bot_id,))
+        cursor.execute("""
+            INSERT INTO bot_stats (bot_id, slot, total_users, total_transactions, total_revenue, total_products)
+            VALUES (
+                %s, 0,
+                (SELECT COUNT(*) FROM bot_users WHERE bot_id = %s),
+                (SELECT COUNT(*) FROM orders WHERE bot_id = %s AND status = 'paid'),
+                (SELECT COALESCE(SUM(amount), 0) FROM orders WHERE bot_id = %s AND status = 'paid'),
+                (SELECT COUNT(*) FROM products WHERE bot_id = %s)
+            )
+            ON CONFLICT (bot_id, slot) DO UPDATE SET
+                total_users = EXCLUDED.total_users,
+                total_transactions = EXCLUDED.total_transactions,
+                total_revenue = EXCLUDED.total_revenue,
+                total_products = EXCLUDED.total_products,
+                updated_at = NOW()
+            RETURNING total_users, total_transactions, total_revenue, total_products
+        """, (bot_id, bot_id, bot_id, bot_id, bot_id))
+        after = dict(cursor.fetchone())
+        
+        # Buyer leaderboard totals and weekly/monthly rollups
+        cursor.execute("""
+            UPDATE bot_users bu SET
+                total_orders = COALESCE(a.total_orders, 0),
+                total_spent = COALESCE(a.total_spent, 0)
+            FROM bot_users b
+            LEFT JOIN (
+                SELECT bot_user_id, COUNT(*) as total_orders, SUM(amount) as total_spent
+                FROM orders WHERE bot_id = %s AND status = 'paid'
+                GROUP BY bot_user_id
+            ) a ON a.bot_user_id = b.id
+            WHERE bu.id = b.id AND b.bot_id = %s
+              AND (bu.total_orders, bu.total_spent)
+                  IS DISTINCT FROM (COALESCE(a.total_orders, 0), COALESCE(a.total_spent, 0))
+        """, (bot_id, bot_id))
+        buyers_fixed = cursor.rowcount
+        
+        cursor.execute("DELETE FROM bot_user_spend_rollups WHERE bot_id = %s", (bot_id,))
+        cursor.execute("""
+            INSERT INTO bot_user_spend_rollups
+                (bot_user_id, bot_id, period, period_start, total_orders, total_spent)
+            SELECT o.bot_user_id, o.bot_id, p.period,
+                   date_trunc(p.period, COALESCE(o.paid_at, o.created_at))::date,
+                   COUNT(*), SUM(o.amount)
+            FROM orders o
+            CROSS JOIN (VALUES ('week'), ('month')) AS p(period)
+            WHERE o.bot_id = %s AND o.status = 'paid' AND o.bot_user_id IS NOT NULL
+            GROUP BY 1, 2, 3, 4
+        """, (bot_id,))
+        
+        # Product stock counters: hold each product's counters lock exclusive
+        # (stock writers take it shared), then recount in a new statement so
+        # writes committed while waiting are counted and later ones wait
+        cursor.execute("""
+            SELECT pg_advisory_xact_lock(hashtext('product_stock_counts'), id)
+            FROM (SELECT id FROM products WHERE bot_id = %s ORDER BY id) p
+        """, (bot_id,))
+        cursor.execute("""
+            WITH actual AS (
+                SELECT p.id as product_id,
+                       COUNT(s.id) FILTER (WHERE s.is_sold = false) as available,
+                       COUNT(s.id) FILTER (WHERE s.is_sold = true) as sold,
+                       COUNT(s.id) FILTER (WHERE s.is_sold = false AND s.reserved_order IS NOT NULL) as reserved
+                FROM products p
+                LEFT JOIN product_stock s ON s.product_id = p.id
+                WHERE p.bot_id = %s
+                GROUP BY p.id
+            ), counted AS (
+                SELECT product_id, SUM(available) as available, SUM(sold) as sold, SUM(reserved) as reserved
+                FROM product_stock_counts
+                WHERE product_id IN (SELECT product_id FROM actual)
+                GROUP BY product_id
+            ), drifted AS (
+                SELECT a.* FROM actual a
+                LEFT JOIN counted c ON c.product_id = a.product_id
+                WHERE (a.available, a.sold, a.reserved)
+                      IS DISTINCT FROM (COALESCE(c.available, 0), COALESCE(c.sold, 0), COALESCE(c.reserved, 0))
+            ), cleared AS (
+                DELETE FROM product_stock_counts
+                WHERE product_id IN (SELECT product_id FROM drifted) AND slot <> 0
+            )
+            INSERT INTO product_stock_counts (product_id, slot, available, sold, reserved)
+            SELECT product_id, 0, available, sold, reserved FROM drifted
+            ON CONFLICT (product_id, slot) DO UPDATE SET
+                available = EXCLUDED.available,
+                sold = EXCLUDED.sold,
+                reserved = EXCLUDED.reserved
+        """, (bot_id,))
+        products_fixed = cursor.rowcount
+        return {
+            'before': before,
+            'after': after,
+            'buyers_fixed': buyers_fixed,
+            'products_fixed': products_fixed
+        }
+
+
 # ==================== VERIFICATION OPERATIONS ====================
 
 def create_verification(bot_id: int, telegram_id: int, student_id: str, full_name: str) -> dict:
@@ -12,57 +12,36 @@ from telegram.ext import (
     filters
 )
 
-from .start import (
-    start_command, back_to_menu, help_menu,
-    show_leaderboard, show_balance, show_all_products
-)
-from .catalog import show_catalog, show_category_products, show_product_detail
-from .order import (
-    show_buy_confirmation,
-    process_purchase,
-    check_payment_status,
-    cancel_payment,
-    show_my_orders
-)
-from .deposit import (
-    show_deposit_menu,
-    process_deposit,
-    check_deposit_status,
-    cancel_deposit
-)
+from utils.metrics import instrument_handler
+
+from .start import start_command
 from .admin import (
-    admin_menu,
-    admin_categories,
-    admin_category_detail,
-    admin_category_toggle,
-    admin_category_delete,
     admin_category_add_start,
     admin_category_add_name,
     admin_category_add_desc,
-    admin_products,
-    admin_product_detail,
-    admin_product_toggle,
-    admin_product_delete,
     admin_product_add_start,
     admin_product_select_category,
     admin_product_add_name,
     admin_product_add_desc,
     admin_product_add_price,
     admin_product_add_content,
+    admin_stock_add_start,
+    admin_stock_add_content,
     admin_cancel,
-    admin_orders,
-    admin_stats,
     CAT_NAME, CAT_DESC,
-    PROD_NAME, PROD_DESC, PROD_PRICE, PROD_CONTENT, PROD_CATEGORY
+    PROD_NAME, PROD_DESC, PROD_PRICE, PROD_CONTENT, PROD_CATEGORY,
+    STOCK_CONTENT
 )
+from .router import get_store_router
 
 
-def get_all_store_handlers(bot_id: int) -> list:
+def get_all_store_handlers(bot_id: int, persistent: bool = False) -> list:
     """
     Get all handlers for a store bot.
     
     Args:
         bot_id: Database ID of the bot
+        persistent: Keep conversation states in the application's persistence
         
     Returns:
         List of handlers to register
@@ -83,10 +62,15 @@ def get_all_store_handlers(bot_id: int) -> list:
         fallbacks=[
             CallbackQueryHandler(admin_cancel, pattern="^admin_cancel$")
         ],
-        per_message=False
+        per_message=False,
+        name="admin_add_category",
+        persistent=persistent
     )
     handlers.append(add_category_conv)
     
+    # Stock arrives as text or as a .txt/.csv document
+    stock_input = (filters.TEXT & ~filters.COMMAND) | filters.Document.ALL
+    
     # Add Product Conversation
     add_product_conv = ConversationHandler(
         entry_points=[
@@ -97,62 +81,41 @@ def get_all_store_handlers(bot_id: int) -> list:
             PROD_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_product_add_name)],
             PROD_DESC: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_product_add_desc)],
             PROD_PRICE: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_product_add_price)],
-            PROD_CONTENT: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_product_add_content)],
+            PROD_CONTENT: [MessageHandler(stock_input, admin_product_add_content)],
         },
         fallbacks=[
             CallbackQueryHandler(admin_cancel, pattern="^admin_cancel$")
         ],
-        per_message=False
+        per_message=False,
+        name="admin_add_product",
+        persistent=persistent
     )
     handlers.append(add_product_conv)
     
-    # Admin menu and callbacks
-    handlers.extend([
-        CallbackQueryHandler(admin_menu, pattern="^admin_menu$"),
-        CallbackQueryHandler(admin_categories, pattern="^admin_categories$"),
-        CallbackQueryHandler(admin_category_detail, pattern="^admin_cat_\\d+$"),
-        CallbackQueryHandler(admin_category_toggle, pattern="^admin_cat_toggle_\\d+$"),
-        CallbackQueryHandler(admin_category_delete, pattern="^admin_cat_del_\\d+$"),
-        CallbackQueryHandler(admin_products, pattern="^admin_products$"),
-        CallbackQueryHandler(admin_product_detail, pattern="^admin_prod_\\d+$"),
-        CallbackQueryHandler(admin_product_toggle, pattern="^admin_prod_toggle_\\d+$"),
-        CallbackQueryHandler(admin_product_delete, pattern="^admin_prod_del_\\d+$"),
-        CallbackQueryHandler(admin_orders, pattern="^admin_orders$"),
-        CallbackQueryHandler(admin_stats, pattern="^admin_stats$"),
-    ])
-    
-    # === START / MENU HANDLERS ===
-    handlers.extend([
-        CommandHandler("start", start_command),
-        CallbackQueryHandler(back_to_menu, pattern="^back_menu$"),
-        CallbackQueryHandler(help_menu, pattern="^menu_help$"),
-        CallbackQueryHandler(show_leaderboard, pattern="^menu_leaderboard$"),
-        CallbackQueryHandler(show_balance, pattern="^menu_balance$"),
-        CallbackQueryHandler(show_all_products, pattern="^menu_all_products$"),
-    ])
-    
-    # === CATALOG HANDLERS ===
-    handlers.extend([
-        CallbackQueryHandler(show_catalog, pattern="^menu_catalog$"),
-        CallbackQueryHandler(show_category_products, pattern="^cat_\\d+$"),
-        CallbackQueryHandler(show_product_detail, pattern="^prod_\\d+$"),
-    ])
+    # Add Stock Conversation (existing product)
+    add_stock_conv = ConversationHandler(
+        entry_points=[
+            CallbackQueryHandler(admin_stock_add_start, pattern="^admin_stock_add_\\d+$")
+        ],
+        states={
+            STOCK_CONTENT: [MessageHandler(stock_input, admin_stock_add_content)],
+        },
+        fallbacks=[
+            CallbackQueryHandler(admin_cancel, pattern="^admin_cancel$")
+        ],
+        per_message=False,
+        name="admin_add_stock",
+        persistent=persistent
+    )
+    handlers.append(add_stock_conv)
     
-    # === ORDER HANDLERS ===
-    handlers.extend([
-        CallbackQueryHandler(show_buy_confirmation, pattern="^buy_\\d+$"),
-        CallbackQueryHandler(process_purchase, pattern="^confirm_buy_\\d+$"),
-        CallbackQueryHandler(check_payment_status, pattern="^check_[A-Z0-9]+$"),
-        CallbackQueryHandler(cancel_payment, pattern="^cancel_[A-Z0-9]+$"),
-        CallbackQueryHandler(show_my_orders, pattern="^menu_orders$"),
-    ])
+    # === START COMMAND ===
+    handlers.append(CommandHandler("start", start_command))
     
-    # === DEPOSIT HANDLERS ===
-    handlers.extend([
-        CallbackQueryHandler(show_deposit_menu, pattern="^menu_deposit$"),
-        CallbackQueryHandler(process_deposit, pattern="^deposit_\\d+$"),
-        CallbackQueryHandler(check_deposit_status, pattern="^dep_check_[A-Z0-9]+$"),
-        CallbackQueryHandler(cancel_deposit, pattern="^dep_cancel_[A-Z0-9]+$"),
-    ])
+    # === CALLBACK QUERIES ===
+    # One router (shared by all store bots) dispatches menu, catalog,
+    # order, deposit and admin callbacks; it times each route itself
+    handlers = [instrument_handler(handler) for handler in handlers]
+    handlers.append(get_store_router())
     
     return handlers
@@ -3,18 +3,18 @@ Store Bot - Admin Handler.
 Handles admin operations for store management.
 """
 
+import io
 import os
+import time
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import TelegramError
 from telegram.ext import ContextTypes, ConversationHandler
 
-from database_pg import (
-    get_categories_by_bot,
+from database_async import (
     get_category_by_id,
     create_category,
     update_category,
     delete_category,
-    get_products_by_bot,
-    get_product_by_id,
     create_product,
     update_product,
     delete_product,
@@ -22,11 +22,28 @@ from database_pg import (
     get_bot_stats,
     add_stock_items
 )
+from catalog_cache import (
+    get_categories_by_bot,
+    get_products_by_bot,
+    get_product_by_id,
+    invalidate_catalog
+)
 from utils.keyboard import create_back_keyboard
+from utils.stock_import import iter_lines, read_chunks
 
 # Conversation states
 CAT_NAME, CAT_DESC = range(2)
 PROD_NAME, PROD_DESC, PROD_PRICE, PROD_CONTENT, PROD_CATEGORY = range(2, 7)
+STOCK_CONTENT = 7
+
+# Stock files accepted as a document upload
+STOCK_FILE_EXTENSIONS = (".txt", ".csv")
+
+# Largest file the Bot API lets a bot download
+STOCK_FILE_MAX_SIZE = 20 * 1024 * 1024
+
+# Minimum seconds between edits of an import's progress message
+IMPORT_PROGRESS_INTERVAL = 2
 
 # Owner check
 OWNER_TELEGRAM_ID = int(os.getenv("OWNER_TELEGRAM_ID", "0"))
@@ -72,7 +89,7 @@ async def admin_categories(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     bot_id = context.bot_data.get('bot_id')
-    categories = get_categories_by_bot(bot_id, active_only=False)
+    categories = await get_categories_by_bot(bot_id, active_only=False)
     
     keyboard = []
     for cat in categories:
@@ -101,7 +118,7 @@ async def admin_category_detail(update: Update, context: ContextTypes.DEFAULT_TY
         return
     
     category_id = int(query.data.split("_")[2])
-    category = get_category_by_id(category_id)
+    category = await get_category_by_id(category_id)
     
     if not category:
         await query.edit_message_text("❌ Kategori tidak ditemukan.")
@@ -137,11 +154,12 @@ async def admin_category_toggle(update: Update, context: ContextTypes.DEFAULT_TY
         return
     
     category_id = int(query.data.split("_")[3])
-    category = get_category_by_id(category_id)
+    category = await get_category_by_id(category_id)
     
     if category:
         new_status = not category['is_active']
-        update_category(category_id, is_active=new_status)
+        await update_category(category_id, is_active=new_status)
+        invalidate_catalog(category['bot_id'])
     
     # Redirect back to detail
     query.data = f"admin_cat_{category_id}"
@@ -157,7 +175,8 @@ async def admin_category_delete(update: Update, context: ContextTypes.DEFAULT_TY
         return
     
     category_id = int(query.data.split("_")[3])
-    delete_category(category_id)
+    await delete_category(category_id)
+    invalidate_catalog(context.bot_data.get('bot_id'))
     
     await admin_categories(update, context)
 
@@ -201,7 +220,8 @@ async def admin_category_add_desc(update: Update, context: ContextTypes.DEFAULT_
     name = context.user_data.get('new_cat_name')
     desc = update.message.text if update.message.text != '-' else None
     
-    create_category(bot_id, name, desc)
+    await create_category(bot_id, name, desc)
+    invalidate_catalog(bot_id)
     
     await update.message.reply_text(
         f"✅ Kategori *{name}* berhasil ditambahkan!",
@@ -223,7 +243,7 @@ async def admin_products(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     bot_id = context.bot_data.get('bot_id')
-    products = get_products_by_bot(bot_id, active_only=False)
+    products = await get_products_by_bot(bot_id, active_only=False)
     
     keyboard = []
     for prod in products:
@@ -253,7 +273,7 @@ async def admin_product_detail(update: Update, context: ContextTypes.DEFAULT_TYP
         return
     
     product_id = int(query.data.split("_")[2])
-    product = get_product_by_id(product_id)
+    product = await get_product_by_id(product_id)
     
     if not product:
         await query.edit_message_text("❌ Produk tidak ditemukan.")
@@ -273,6 +293,7 @@ async def admin_product_detail(update: Update, context: ContextTypes.DEFAULT_TYP
     
     toggle_text = "❌ Nonaktifkan" if product['is_active'] else "✅ Aktifkan"
     keyboard = [
+        [InlineKeyboardButton("📥 Tambah Stok", callback_data=f"admin_stock_add_{product_id}")],
         [InlineKeyboardButton(toggle_text, callback_data=f"admin_prod_toggle_{product_id}")],
         [InlineKeyboardButton("🗑️ Hapus", callback_data=f"admin_prod_del_{product_id}")],
         [InlineKeyboardButton("◀️ Kembali", callback_data="admin_products")]
@@ -294,11 +315,12 @@ async def admin_product_toggle(update: Update, context: ContextTypes.DEFAULT_TYP
         return
     
     product_id = int(query.data.split("_")[3])
-    product = get_product_by_id(product_id)
+    product = await get_product_by_id(product_id)
     
     if product:
         new_status = not product['is_active']
-        update_product(product_id, is_active=new_status)
+        await update_product(product_id, is_active=new_status)
+        invalidate_catalog(product['bot_id'])
     
     query.data = f"admin_prod_{product_id}"
     await admin_product_detail(update, context)
@@ -313,7 +335,8 @@ async def admin_product_delete(update: Update, context: ContextTypes.DEFAULT_TYP
         return
     
     product_id = int(query.data.split("_")[3])
-    delete_product(product_id)
+    await delete_product(product_id)
+    invalidate_catalog(context.bot_data.get('bot_id'))
     
     await admin_products(update, context)
 
@@ -327,7 +350,7 @@ async def admin_product_add_start(update: Update, context: ContextTypes.DEFAULT_
         return ConversationHandler.END
     
     bot_id = context.bot_data.get('bot_id')
-    categories = get_categories_by_bot(bot_id)
+    categories = await get_categories_by_bot(bot_id)
     
     if not categories:
         await query.edit_message_text(
@@ -414,33 +437,96 @@ async def admin_product_add_price(update: Update, context: ContextTypes.DEFAULT_
         "📦 Masukkan stok produk (satu item per baris):\n\n"
         "Contoh:\n"
         "akun1@email.com:pass123\n"
-        "akun2@email.com:pass456",
+        "akun2@email.com:pass456\n\n"
+        "📎 Stok banyak? Kirim sebagai file .txt/.csv.",
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
     
     return PROD_CONTENT
 
 
+async def _read_stock_upload(update: Update):
+    """
+    Get the stock lines of a message: its text, or an uploaded .txt/.csv.
+
+    Returns:
+        Lazily split lines, or None (after replying) if the file is not accepted
+    """
+    document = update.message.document
+    if not document:
+        return iter_lines([update.message.text or ""])
+
+    filename = (document.file_name or "").lower()
+    if not filename.endswith(STOCK_FILE_EXTENSIONS):
+        await update.message.reply_text("❌ Kirim file .txt atau .csv (satu item per baris).")
+        return None
+    if document.file_size and document.file_size > STOCK_FILE_MAX_SIZE:
+        await update.message.reply_text("❌ File terlalu besar (maks. 20 MB). Pecah menjadi beberapa file.")
+        return None
+
+    buffer = io.BytesIO()
+    file = await document.get_file()
+    await file.download_to_memory(buffer)
+    buffer.seek(0)
+    return iter_lines(read_chunks(buffer))
+
+
+async def _import_stock(update: Update, product_id: int, lines) -> dict:
+    """Import stock lines, showing progress in a status message."""
+    status = await update.message.reply_text("⏳ Mengimpor stok...")
+    last_edit = time.monotonic()
+
+    async def progress(counts: dict):
+        nonlocal last_edit
+        if time.monotonic() - last_edit < IMPORT_PROGRESS_INTERVAL:
+            return
+        last_edit = time.monotonic()
+        try:
+            await status.edit_text(
+                f"⏳ Mengimpor stok... {counts['received']:,} baris diproses, "
+                f"{counts['added']:,} ditambahkan".replace(",", ".")
+            )
+        except TelegramError:
+            pass
+
+    result = await add_stock_items(product_id, lines, progress)
+    try:
+        await status.delete()
+    except TelegramError:
+        pass
+    return result
+
+
+def _import_summary(result: dict) -> str:
+    text = f"📦 {result['added']:,} stok ditambahkan".replace(",", ".")
+    if result['duplicates']:
+        text += f"\n♻️ {result['duplicates']:,} duplikat dilewati".replace(",", ".")
+    return text
+
+
 async def admin_product_add_content(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Receive product content and create."""
+    """Receive product content (text or .txt/.csv file) and create."""
     bot_id = context.bot_data.get('bot_id')
     
     name = context.user_data.get('new_prod_name')
     desc = context.user_data.get('new_prod_desc')
     price = context.user_data.get('new_prod_price')
     category_id = context.user_data.get('new_prod_cat')
-    stock_items = update.message.text.strip().split('\n')
+    
+    stock_lines = await _read_stock_upload(update)
+    if stock_lines is None:
+        return PROD_CONTENT
     
     # Create product
-    product = create_product(bot_id, category_id, name, price, desc)
+    product = await create_product(bot_id, category_id, name, price, desc)
     
     # Add stock items
-    if stock_items and stock_items[0]:
-        add_stock_items(product['id'], stock_items)
+    result = await _import_stock(update, product['id'], stock_lines)
+    invalidate_catalog(bot_id)
     
     await update.message.reply_text(
         f"✅ Produk *{name}* berhasil ditambahkan!\n"
-        f"📦 {len(stock_items)} stok ditambahkan.",
+        f"{_import_summary(result)}",
         parse_mode="Markdown",
         reply_markup=create_back_keyboard("admin_products")
     )
@@ -454,6 +540,59 @@ async def admin_product_add_content(update: Update, context: ContextTypes.DEFAUL
     return ConversationHandler.END
 
 
+async def admin_stock_add_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Start adding stock to an existing product."""
+    query = update.callback_query
+    await query.answer()
+    
+    if not is_owner(update.effective_user.id):
+        return ConversationHandler.END
+    
+    product_id = int(query.data.split("_")[3])  # admin_stock_add_<id>
+    product = await get_product_by_id(product_id)
+    
+    if not product:
+        await query.edit_message_text("❌ Produk tidak ditemukan.")
+        return ConversationHandler.END
+    
+    context.user_data['stock_prod_id'] = product_id
+    keyboard = [[InlineKeyboardButton("❌ Batal", callback_data="admin_cancel")]]
+    
+    await query.edit_message_text(
+        f"📥 *Tambah Stok - {product['name']}*\n\n"
+        "Kirim stok (satu item per baris) sebagai pesan, "
+        "atau sebagai file .txt/.csv untuk stok dalam jumlah besar.\n\n"
+        "_Baris yang sudah ada di stok produk ini akan dilewati._",
+        parse_mode="Markdown",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+    
+    return STOCK_CONTENT
+
+
+async def admin_stock_add_content(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Receive stock (text or .txt/.csv file) for an existing product."""
+    bot_id = context.bot_data.get('bot_id')
+    product_id = context.user_data.get('stock_prod_id')
+    
+    stock_lines = await _read_stock_upload(update)
+    if stock_lines is None:
+        return STOCK_CONTENT
+    
+    result = await _import_stock(update, product_id, stock_lines)
+    invalidate_catalog(bot_id)
+    
+    await update.message.reply_text(
+        f"✅ *Stok Diperbarui*\n\n"
+        f"{_import_summary(result)}",
+        parse_mode="Markdown",
+        reply_markup=create_back_keyboard(f"admin_prod_{product_id}")
+    )
+    
+    context.user_data.pop('stock_prod_id', None)
+    return ConversationHandler.END
+
+
 async def admin_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Cancel admin operation."""
     query = update.callback_query
@@ -478,7 +617,7 @@ async def admin_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     bot_id = context.bot_data.get('bot_id')
-    orders = get_orders_by_bot(bot_id, limit=20)
+    orders = await get_orders_by_bot(bot_id, limit=20)
     
     if not orders:
         await query.edit_message_text(
@@ -513,7 +652,7 @@ async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     bot_id = context.bot_data.get('bot_id')
-    stats = get_bot_stats(bot_id)
+    stats = await get_bot_stats(bot_id)
     
     revenue_str = f"Rp {stats['total_revenue']:,}".replace(",", ".")
     
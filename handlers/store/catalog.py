@@ -6,11 +6,11 @@ Handles category and product browsing.
 from telegram import Update
 from telegram.ext import ContextTypes
 
-from database_pg import (
+from database_async import get_category_by_id
+from catalog_cache import (
     get_categories_by_bot,
     get_products_by_category,
-    get_product_by_id,
-    get_category_by_id
+    get_product_by_id
 )
 from utils.keyboard import (
     create_category_keyboard,
@@ -26,7 +26,7 @@ async def show_catalog(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     bot_id = context.bot_data.get('bot_id')
-    categories = get_categories_by_bot(bot_id)
+    categories = await get_categories_by_bot(bot_id)
     
     if not categories:
         await query.edit_message_text(
@@ -58,8 +58,8 @@ async def show_category_products(update: Update, context: ContextTypes.DEFAULT_T
     # Extract category ID from callback data
     category_id = int(query.data.split("_")[1])
     
-    category = get_category_by_id(category_id)
-    products = get_products_by_category(category_id, bot_id)
+    category = await get_category_by_id(category_id)
+    products = await get_products_by_category(category_id, bot_id)
     
     if not category:
         await query.edit_message_text(
@@ -92,7 +92,7 @@ async def show_product_detail(update: Update, context: ContextTypes.DEFAULT_TYPE
     # Extract product ID from callback data
     product_id = int(query.data.split("_")[1])
     
-    product = get_product_by_id(product_id)
+    product = await get_product_by_id(product_id)
     
     if not product:
         await query.edit_message_text(
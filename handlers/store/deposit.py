@@ -8,15 +8,15 @@ from datetime import datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 
-from database_pg import (
+from database_async import (
     get_bot_user,
     create_deposit,
     get_deposit_by_order_id,
     update_deposit_status,
-    add_user_balance,
+    settle_deposit,
     get_user_balance
 )
-from services.pakasir import PakasirClient
+from services.pakasir import get_pakasir_client
 from utils.qr_generator import generate_qr_image
 from utils.keyboard import create_back_keyboard
 
@@ -39,7 +39,7 @@ async def show_deposit_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     bot_id = context.bot_data.get('bot_id')
     user = update.effective_user
-    balance = get_user_balance(bot_id, user.id)
+    balance = await get_user_balance(bot_id, user.id)
     balance_str = f"Rp {balance:,}".replace(",", ".")
     
     text = (
@@ -92,7 +92,7 @@ async def process_deposit(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     
     # Create Pakasir transaction
-    pakasir = PakasirClient(pakasir_slug, pakasir_api_key)
+    pakasir = get_pakasir_client(pakasir_slug, pakasir_api_key)
     payment = await pakasir.create_transaction(
         order_id=order_id,
         amount=amount
@@ -115,7 +115,7 @@ async def process_deposit(update: Update, context: ContextTypes.DEFAULT_TYPE):
         expired_at = None
     
     # Save deposit to database
-    deposit = create_deposit(
+    deposit = await create_deposit(
         bot_id=bot_id,
         telegram_id=user.id,
         order_id=order_id,
@@ -179,14 +179,14 @@ async def check_deposit_status(update: Update, context: ContextTypes.DEFAULT_TYP
     # Extract order ID
     order_id = query.data.replace("dep_check_", "")
     
-    deposit = get_deposit_by_order_id(order_id)
+    deposit = await get_deposit_by_order_id(order_id)
     
     if not deposit:
         await query.message.reply_text("❌ Deposit tidak ditemukan.")
         return
     
     if deposit['status'] == "paid":
-        balance = get_user_balance(bot_id, user.id)
+        balance = await get_user_balance(bot_id, user.id)
         balance_str = f"Rp {balance:,}".replace(",", ".")
         await query.message.reply_text(
             f"✅ *Deposit Sudah Berhasil!*\n\n"
@@ -197,25 +197,19 @@ async def check_deposit_status(update: Update, context: ContextTypes.DEFAULT_TYP
         return
     
     # Check from Pakasir
-    pakasir = PakasirClient(pakasir_slug, pakasir_api_key)
+    pakasir = get_pakasir_client(pakasir_slug, pakasir_api_key)
     status = await pakasir.get_transaction_status(order_id, deposit['amount'])
     
     if status and status.status == "completed":
-        # Update deposit status
-        update_deposit_status(order_id, "paid", datetime.now())
-        
-        # Add balance to user
-        add_user_balance(bot_id, user.id, deposit['amount'])
-        
-        balance = get_user_balance(bot_id, user.id)
-        balance_str = f"Rp {balance:,}".replace(",", ".")
-        amount_str = f"Rp {deposit['amount']:,}".replace(",", ".")
-        
+        result = await settle_deposit(order_id)
+        if result['deposit']['status'] != "paid":
+            await query.message.reply_text(
+                f"⚠️ Deposit `{order_id}` tidak dapat diproses (status: {result['deposit']['status']})",
+                parse_mode="Markdown"
+            )
+            return
         await query.message.reply_text(
-            f"✅ *Deposit Berhasil!*\n\n"
-            f"💵 *Deposit:* +{amount_str}\n"
-            f"💰 *Saldo Anda:* {balance_str}\n\n"
-            f"Terima kasih! Saldo sudah bisa digunakan untuk berbelanja.",
+            format_deposit_credit(result),
             parse_mode="Markdown",
             reply_markup=create_back_keyboard()
         )
@@ -228,6 +222,18 @@ async def check_deposit_status(update: Update, context: ContextTypes.DEFAULT_TYP
         )
 
 
+def format_deposit_credit(result: dict) -> str:
+    """Message for a settled deposit (see settle_deposit)."""
+    amount_str = f"Rp {result['deposit']['amount']:,}".replace(",", ".")
+    balance_str = f"Rp {result['balance']:,}".replace(",", ".")
+    return (
+        f"✅ *Deposit Berhasil!*\n\n"
+        f"💵 *Deposit:* +{amount_str}\n"
+        f"💰 *Saldo Anda:* {balance_str}\n\n"
+        f"Terima kasih! Saldo sudah bisa digunakan untuk berbelanja."
+    )
+
+
 async def cancel_deposit(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Cancel pending deposit."""
     query = update.callback_query
@@ -239,7 +245,7 @@ async def cancel_deposit(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Extract order ID
     order_id = query.data.replace("dep_cancel_", "")
     
-    deposit = get_deposit_by_order_id(order_id)
+    deposit = await get_deposit_by_order_id(order_id)
     
     if not deposit:
         await query.message.reply_text("❌ Deposit tidak ditemukan.")
@@ -253,11 +259,16 @@ async def cancel_deposit(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     # Cancel on Pakasir
-    pakasir = PakasirClient(pakasir_slug, pakasir_api_key)
+    pakasir = get_pakasir_client(pakasir_slug, pakasir_api_key)
     await pakasir.cancel_transaction(order_id, deposit['amount'])
     
-    # Update local status
-    update_deposit_status(order_id, "cancelled")
+    # Update local status (unless it was paid meanwhile)
+    if not await update_deposit_status(order_id, "cancelled", from_status="pending"):
+        await query.message.reply_text(
+            f"⚠️ Deposit `{order_id}` tidak dapat dibatalkan (sudah diproses).",
+            parse_mode="Markdown"
+        )
+        return
     
     await query.message.reply_text(
         f"✅ *Deposit Dibatalkan*\n\n"
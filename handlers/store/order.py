@@ -9,17 +9,21 @@ from datetime import datetime
 from telegram import Update
 from telegram.ext import ContextTypes
 
-from database_pg import (
-    get_product_by_id,
+from database_async import (
     get_bot_user,
+    get_user_balance,
     create_order,
+    purchase_with_balance,
     get_order_by_order_id,
     get_orders_by_user,
     update_order_status,
-    get_available_stock,
-    mark_stock_sold
+    settle_order,
+    reserve_stock,
+    release_reservation
 )
-from services.pakasir import PakasirClient
+from catalog_cache import get_product_by_id, invalidate_catalog
+from leaderboard_cache import invalidate_leaderboard
+from services.pakasir import get_pakasir_client
 from utils.qr_generator import generate_qr_image
 from utils.keyboard import (
     create_confirm_purchase_keyboard,
@@ -27,6 +31,10 @@ from utils.keyboard import (
     create_back_keyboard
 )
 
+# Seconds a stock item is held while the QRIS is created; once the order
+# exists the hold lasts until the payment's expired_at
+STOCK_HOLD_SECONDS = int(os.getenv("STOCK_HOLD_SECONDS", "900"))
+
 
 def generate_order_id() -> str:
     """Generate unique order ID."""
@@ -42,7 +50,7 @@ async def show_buy_confirmation(update: Update, context: ContextTypes.DEFAULT_TY
     
     # Extract product ID
     product_id = int(query.data.split("_")[1])
-    product = get_product_by_id(product_id)
+    product = await get_product_by_id(product_id)
     
     if not product:
         await query.edit_message_text("❌ Produk tidak ditemukan.")
@@ -59,18 +67,27 @@ async def show_buy_confirmation(update: Update, context: ContextTypes.DEFAULT_TY
     # Format price
     price_str = f"Rp {product['price']:,}".replace(",", ".")
     
+    balance = await get_user_balance(context.bot_data.get('bot_id'), update.effective_user.id)
+    balance_str = f"Rp {balance:,}".replace(",", ".")
+    pay_with_balance = balance >= product['price']
+    
     text = (
         f"🛒 *Konfirmasi Pembelian*\n\n"
         f"📦 *Produk:* {product['name']}\n"
-        f"💰 *Harga:* {price_str}\n\n"
-        f"_Biaya tambahan dari payment gateway akan ditampilkan saat pembayaran._\n\n"
+        f"💰 *Harga:* {price_str}\n"
+        f"👛 *Saldo Anda:* {balance_str}\n\n"
+        + (
+            "_Bayar dengan saldo: produk langsung dikirim tanpa biaya tambahan._\n\n"
+            if pay_with_balance else ""
+        )
+        + "_Biaya tambahan dari payment gateway akan ditampilkan saat pembayaran QRIS._\n\n"
         f"Lanjutkan pembayaran?"
     )
     
     await query.edit_message_text(
         text,
         parse_mode="Markdown",
-        reply_markup=create_confirm_purchase_keyboard(product_id)
+        reply_markup=create_confirm_purchase_keyboard(product_id, pay_with_balance)
     )
 
 
@@ -85,7 +102,7 @@ async def process_purchase(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Extract product ID
     product_id = int(query.data.split("_")[2])  # confirm_buy_<id>
-    product = get_product_by_id(product_id)
+    product = await get_product_by_id(product_id)
     
     if not product:
         await query.edit_message_text("❌ Produk tidak ditemukan.")
@@ -94,7 +111,7 @@ async def process_purchase(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Get bot user
     bot_user_id = context.user_data.get('bot_user_id')
     if not bot_user_id:
-        bot_user = get_bot_user(bot_id, update.effective_user.id)
+        bot_user = await get_bot_user(bot_id, update.effective_user.id)
         if not bot_user:
             await query.edit_message_text("❌ User tidak ditemukan. Silakan /start ulang.")
             return
@@ -103,22 +120,64 @@ async def process_purchase(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Generate unique order ID
     order_id = generate_order_id()
     
-    # Show processing message
-    await query.edit_message_text(
-        "⏳ *Membuat pembayaran QRIS...*\n\nMohon tunggu sebentar.",
-        parse_mode="Markdown"
-    )
-    
-    # Create Pakasir client for this bot
-    pakasir = PakasirClient(pakasir_slug, pakasir_api_key)
+    # Hold a stock item first so no QRIS is created for stock that is gone
+    if not await reserve_stock(product_id, order_id, STOCK_HOLD_SECONDS):
+        invalidate_catalog(bot_id)
+        await query.edit_message_text(
+            "❌ Maaf, stok produk habis.",
+            reply_markup=create_back_keyboard(f"cat_{product['category_id']}")
+        )
+        return
+    invalidate_catalog(bot_id)
     
-    # Create transaction via Pakasir
-    payment = await pakasir.create_transaction(
-        order_id=order_id,
-        amount=product['price']
-    )
+    # Shared Pakasir client of this bot's project
+    pakasir = get_pakasir_client(pakasir_slug, pakasir_api_key)
+    payment = None
+    try:
+        # Show processing message
+        await query.edit_message_text(
+            "⏳ *Membuat pembayaran QRIS...*\n\nMohon tunggu sebentar.",
+            parse_mode="Markdown"
+        )
+        
+        # Create transaction via Pakasir
+        payment = await pakasir.create_transaction(
+            order_id=order_id,
+            amount=product['price']
+        )
+        
+        if payment:
+            # Parse expired_at
+            try:
+                expired_at = datetime.fromisoformat(payment.expired_at.replace("Z", "+00:00"))
+            except:
+                expired_at = None
+            
+            # Save order to database
+            order = await create_order(
+                bot_id=bot_id,
+                bot_user_id=bot_user_id,
+                product_id=product_id,
+                order_id=order_id,
+                amount=product['price'],
+                fee=payment.fee,
+                total=payment.total_payment,
+                qris_string=payment.payment_number,
+                expired_at=expired_at
+            )
+    except BaseException:
+        # Failed or cancelled midway: free the held item and drop the
+        # order and QRIS, if they were created, so neither lingers pending
+        await release_reservation(order_id)
+        invalidate_catalog(bot_id)
+        if payment:
+            await update_order_status(order_id, "cancelled", from_status="pending")
+            await pakasir.cancel_transaction(order_id, product['price'])
+        raise
     
     if not payment:
+        await release_reservation(order_id)
+        invalidate_catalog(bot_id)
         await query.edit_message_text(
             "❌ *Gagal membuat pembayaran*\n\n"
             "Terjadi kesalahan saat menghubungi payment gateway. "
@@ -128,25 +187,6 @@ async def process_purchase(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    # Parse expired_at
-    try:
-        expired_at = datetime.fromisoformat(payment.expired_at.replace("Z", "+00:00"))
-    except:
-        expired_at = None
-    
-    # Save order to database
-    order = create_order(
-        bot_id=bot_id,
-        bot_user_id=bot_user_id,
-        product_id=product_id,
-        order_id=order_id,
-        amount=product['price'],
-        fee=payment.fee,
-        total=payment.total_payment,
-        qris_string=payment.payment_number,
-        expired_at=expired_at
-    )
-    
     # Generate QR code image
     qr_image = generate_qr_image(payment.payment_number)
     
@@ -182,6 +222,59 @@ async def process_purchase(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+async def process_balance_purchase(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Buy with the user's balance: charge, create the order and deliver at once."""
+    query = update.callback_query
+    await query.answer("⏳ Memproses pembelian...")
+    
+    bot_id = context.bot_data.get('bot_id')
+    
+    # Extract product ID
+    product_id = int(query.data.split("_")[2])  # pay_balance_<id>
+    
+    # Get bot user
+    bot_user_id = context.user_data.get('bot_user_id')
+    if not bot_user_id:
+        bot_user = await get_bot_user(bot_id, update.effective_user.id)
+        if not bot_user:
+            await query.edit_message_text("❌ User tidak ditemukan. Silakan /start ulang.")
+            return
+        bot_user_id = bot_user['id']
+    
+    result = await purchase_with_balance(bot_id, bot_user_id, product_id, generate_order_id())
+    
+    if result['status'] == 'no_product':
+        await query.edit_message_text("❌ Produk tidak ditemukan.")
+        return
+    if result['status'] == 'no_stock':
+        invalidate_catalog(bot_id)
+        await query.edit_message_text(
+            "❌ Maaf, stok produk habis.",
+            reply_markup=create_back_keyboard(f"prod_{product_id}")
+        )
+        return
+    if result['status'] == 'insufficient_balance':
+        balance_str = f"Rp {result['balance']:,}".replace(",", ".")
+        await query.edit_message_text(
+            f"❌ *Saldo Tidak Cukup*\n\n"
+            f"👛 *Saldo Anda:* {balance_str}\n"
+            f"Silakan deposit saldo atau bayar dengan QRIS.",
+            parse_mode="Markdown",
+            reply_markup=create_back_keyboard(f"buy_{product_id}")
+        )
+        return
+    
+    invalidate_leaderboard(bot_id)
+    invalidate_catalog(bot_id)
+    
+    balance_str = f"Rp {result['balance']:,}".replace(",", ".")
+    await query.edit_message_text(
+        format_order_delivery(result) + f"\n\n👛 *Sisa Saldo:* {balance_str}",
+        parse_mode="Markdown",
+        reply_markup=create_back_keyboard()
+    )
+
+
 async def check_payment_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Check payment status manually."""
     query = update.callback_query
@@ -193,7 +286,7 @@ async def check_payment_status(update: Update, context: ContextTypes.DEFAULT_TYP
     # Extract order ID
     order_id = query.data.split("_")[1]  # check_<order_id>
     
-    order = get_order_by_order_id(order_id)
+    order = await get_order_by_order_id(order_id)
     
     if not order:
         await query.message.reply_text("❌ Order tidak ditemukan.")
@@ -208,30 +301,20 @@ async def check_payment_status(update: Update, context: ContextTypes.DEFAULT_TYP
         return
     
     # Check status from Pakasir
-    pakasir = PakasirClient(pakasir_slug, pakasir_api_key)
+    pakasir = get_pakasir_client(pakasir_slug, pakasir_api_key)
     status = await pakasir.get_transaction_status(order_id, order['amount'])
     
     if status and status.status == "completed":
-        # Update order status
-        update_order_status(order_id, "paid", datetime.now())
-        
-        # Get and deliver stock
-        stock_item = get_available_stock(order['product_id'])
-        if stock_item:
-            mark_stock_sold(stock_item['id'], order['id'])
-            
-            await query.message.reply_text(
-                f"✅ *Pembayaran Berhasil!*\n\n"
-                f"Order: `{order_id}`\n\n"
-                f"📦 *Produk Anda:*\n"
-                f"```\n{stock_item['content']}\n```",
-                parse_mode="Markdown"
-            )
+        result = await settle_order(order_id)
+        if result['settled']:
+            invalidate_leaderboard(order['bot_id'])
+            if result['stock']:
+                invalidate_catalog(order['bot_id'])
+        if result['order']['status'] == "paid":
+            await query.message.reply_text(format_order_delivery(result), parse_mode="Markdown")
         else:
             await query.message.reply_text(
-                f"✅ *Pembayaran Berhasil!*\n\n"
-                f"Order: `{order_id}`\n\n"
-                f"⚠️ Mohon hubungi admin untuk pengiriman produk.",
+                f"⚠️ Order `{order_id}` tidak dapat diproses (status: {result['order']['status']})",
                 parse_mode="Markdown"
             )
     else:
@@ -243,6 +326,27 @@ async def check_payment_status(update: Update, context: ContextTypes.DEFAULT_TYP
         )
 
 
+def format_order_delivery(result: dict) -> str:
+    """
+    Message for a settled order (see settle_order), with the product if one
+    was delivered.
+    """
+    order_id = result['order']['order_id']
+    stock_item = result['stock']
+    if stock_item:
+        return (
+            f"✅ *Pembayaran Berhasil!*\n\n"
+            f"Order: `{order_id}`\n\n"
+            f"📦 *Produk Anda:*\n"
+            f"```\n{stock_item['content']}\n```"
+        )
+    return (
+        f"✅ *Pembayaran Berhasil!*\n\n"
+        f"Order: `{order_id}`\n\n"
+        f"⚠️ Mohon hubungi admin untuk pengiriman produk."
+    )
+
+
 async def cancel_payment(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Cancel a pending payment."""
     query = update.callback_query
@@ -254,7 +358,7 @@ async def cancel_payment(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Extract order ID
     order_id = query.data.split("_")[1]  # cancel_<order_id>
     
-    order = get_order_by_order_id(order_id)
+    order = await get_order_by_order_id(order_id)
     
     if not order:
         await query.message.reply_text("❌ Order tidak ditemukan.")
@@ -268,11 +372,18 @@ async def cancel_payment(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     # Cancel on Pakasir
-    pakasir = PakasirClient(pakasir_slug, pakasir_api_key)
+    pakasir = get_pakasir_client(pakasir_slug, pakasir_api_key)
     await pakasir.cancel_transaction(order_id, order['amount'])
     
-    # Update local status
-    update_order_status(order_id, "cancelled")
+    # Update local status (unless it was paid meanwhile) and give the held stock back
+    if not await update_order_status(order_id, "cancelled", from_status="pending"):
+        await query.message.reply_text(
+            f"⚠️ Order `{order_id}` tidak dapat dibatalkan (sudah diproses).",
+            parse_mode="Markdown"
+        )
+        return
+    if await release_reservation(order_id):
+        invalidate_catalog(order['bot_id'])
     
     await query.message.reply_text(
         f"✅ *Order Dibatalkan*\n\n"
@@ -291,7 +402,7 @@ async def show_my_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
     bot_user_id = context.user_data.get('bot_user_id')
     
     if not bot_user_id:
-        bot_user = get_bot_user(bot_id, update.effective_user.id)
+        bot_user = await get_bot_user(bot_id, update.effective_user.id)
         if not bot_user:
             await query.edit_message_text(
                 "❌ User tidak ditemukan. Silakan /start.",
@@ -300,7 +411,7 @@ async def show_my_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         bot_user_id = bot_user['id']
     
-    orders = get_orders_by_user(bot_id, bot_user_id)
+    orders = await get_orders_by_user(bot_id, bot_user_id)
     
     if not orders:
         await query.edit_message_text(
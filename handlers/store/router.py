@@ -0,0 +1,191 @@
+"""
+Store Callback Router.
+One handler dispatching every store callback query through precompiled
+lookup tables instead of a linear scan over regex CallbackQueryHandlers.
+The router is stateless and shared by all store bots.
+"""
+
+import re
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, BaseHandler
+
+from utils.metrics import HANDLER_ERRORS, HANDLER_LATENCY
+
+from .start import (
+    back_to_menu, help_menu,
+    show_leaderboard, show_balance, show_all_products
+)
+from .catalog import show_catalog, show_category_products, show_product_detail
+from .order import (
+    show_buy_confirmation,
+    process_purchase,
+    process_balance_purchase,
+    check_payment_status,
+    cancel_payment,
+    show_my_orders
+)
+from .deposit import (
+    show_deposit_menu,
+    process_deposit,
+    check_deposit_status,
+    cancel_deposit
+)
+from .admin import (
+    admin_menu,
+    admin_categories,
+    admin_category_detail,
+    admin_category_toggle,
+    admin_category_delete,
+    admin_products,
+    admin_product_detail,
+    admin_product_toggle,
+    admin_product_delete,
+    admin_orders,
+    admin_stats
+)
+
+# Accepted argument formats after a prefix
+NUMERIC = re.compile(r"\d+", re.ASCII)
+ORDER_ID = re.compile(r"[A-Z0-9]+")
+
+
+class CallbackRouter(BaseHandler):
+    """
+    Routes callback_data to callbacks.
+
+    Exact matches (e.g. 'menu_catalog') are looked up first; otherwise the
+    data is split once on its last underscore into '<prefix>_' and an
+    argument ('cat_12' -> 'cat_', '12') and the prefix is looked up, with
+    the argument validated against the route's format.
+    """
+
+    def __init__(self):
+        super().__init__(self._dispatch)
+        self._exact: Dict[str, Tuple[Callable, str]] = {}
+        self._prefixes: Dict[str, Tuple[Callable, re.Pattern, str]] = {}
+
+    def add(self, data: str, callback: Callable):
+        """Route one exact callback_data value."""
+        self._exact[data] = (callback, data)
+
+    def add_prefix(self, prefix: str, callback: Callable, arg: re.Pattern = NUMERIC):
+        """Route '<prefix><arg>' (prefix must end with '_')."""
+        label = f"{prefix}<{'n' if arg is NUMERIC else 'order_id'}>"
+        self._prefixes[prefix] = (callback, arg, label)
+
+    def resolve(self, data: str) -> Optional[Tuple[Callable, str]]:
+        """
+        Find the callback for callback_data.
+
+        Returns:
+            (callback, route label) or None if no route matches
+        """
+        route = self._exact.get(data)
+        if route:
+            return route
+
+        head, sep, arg = data.rpartition("_")
+        if not sep:
+            return None
+        route = self._prefixes.get(head + sep)
+        if route and route[1].fullmatch(arg):
+            return route[0], route[2]
+        return None
+
+    def check_update(self, update: object) -> Optional[Tuple[Callable, str]]:
+        if not isinstance(update, Update) or not update.callback_query:
+            return None
+        data = update.callback_query.data
+        if not isinstance(data, str):
+            return None
+        return self.resolve(data)
+
+    async def handle_update(self, update, application, check_result, context):
+        return await self._dispatch(update, context, check_result)
+
+    async def _dispatch(self, update, context, route: Optional[Tuple[Callable, str]] = None):
+        """
+        Run the route of a callback query, recording latency and errors.
+
+        Args:
+            update: Update with a callback query
+            context: Handler context
+            route: (callback, label) already resolved by check_update;
+                resolved from the callback data when omitted
+        """
+        route = route or self.resolve(update.callback_query.data)
+        if route is None:
+            return None
+
+        callback, label = route
+        start = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except ApplicationHandlerStop:
+            raise
+        except Exception:
+            HANDLER_ERRORS.inc(label)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - start, label)
+
+
+def _build_store_router() -> CallbackRouter:
+    router = CallbackRouter()
+
+    # Admin
+    router.add("admin_menu", admin_menu)
+    router.add("admin_categories", admin_categories)
+    router.add("admin_products", admin_products)
+    router.add("admin_orders", admin_orders)
+    router.add("admin_stats", admin_stats)
+    router.add_prefix("admin_cat_", admin_category_detail)
+    router.add_prefix("admin_cat_toggle_", admin_category_toggle)
+    router.add_prefix("admin_cat_del_", admin_category_delete)
+    router.add_prefix("admin_prod_", admin_product_detail)
+    router.add_prefix("admin_prod_toggle_", admin_product_toggle)
+    router.add_prefix("admin_prod_del_", admin_product_delete)
+
+    # Start / menu
+    router.add("back_menu", back_to_menu)
+    router.add("menu_help", help_menu)
+    router.add("menu_leaderboard", show_leaderboard)
+    router.add("leaderboard_week", show_leaderboard)
+    router.add("leaderboard_month", show_leaderboard)
+    router.add("menu_balance", show_balance)
+    router.add("menu_all_products", show_all_products)
+
+    # Catalog
+    router.add("menu_catalog", show_catalog)
+    router.add_prefix("cat_", show_category_products)
+    router.add_prefix("prod_", show_product_detail)
+
+    # Orders
+    router.add_prefix("buy_", show_buy_confirmation)
+    router.add_prefix("confirm_buy_", process_purchase)
+    router.add_prefix("pay_balance_", process_balance_purchase)
+    router.add_prefix("check_", check_payment_status, ORDER_ID)
+    router.add_prefix("cancel_", cancel_payment, ORDER_ID)
+    router.add("menu_orders", show_my_orders)
+
+    # Deposit
+    router.add("menu_deposit", show_deposit_menu)
+    router.add_prefix("deposit_", process_deposit)
+    router.add_prefix("dep_check_", check_deposit_status, ORDER_ID)
+    router.add_prefix("dep_cancel_", cancel_deposit, ORDER_ID)
+
+    return router
+
+
+_store_router: Optional[CallbackRouter] = None
+
+
+def get_store_router() -> CallbackRouter:
+    """Get the callback router shared by all store bots."""
+    global _store_router
+    if _store_router is None:
+        _store_router = _build_store_router()
+    return _store_router
@@ -4,19 +4,29 @@ Handles /start command and main menu for store bots.
 ChenStore-style UI with stats and category buttons.
 """
 
+import asyncio
 import os
 from telegram import Update
 from telegram.ext import ContextTypes
 
-from database_pg import (
-    get_or_create_bot_user, 
-    get_store_stats, 
-    get_categories_by_bot,
-    get_user_balance,
-    get_leaderboard,
-    get_products_by_bot
+from database_async import get_menu_snapshot, get_user_balance
+from catalog_cache import get_categories_by_bot, get_products_by_bot
+from known_users import remember_row
+from leaderboard_cache import get_leaderboard
+from utils.keyboard import (
+    create_menu_keyboard,
+    create_admin_menu_keyboard,
+    create_back_keyboard,
+    create_leaderboard_keyboard
 )
-from utils.keyboard import create_menu_keyboard, create_admin_menu_keyboard, create_back_keyboard
+
+# Leaderboard callback_data -> period (None = all time)
+LEADERBOARD_PERIODS = {
+    "menu_leaderboard": None,
+    "leaderboard_week": "week",
+    "leaderboard_month": "month",
+}
+LEADERBOARD_TITLES = {None: "Sepanjang Masa", "week": "Minggu Ini", "month": "Bulan Ini"}
 
 # Owner Telegram ID for admin access
 OWNER_TELEGRAM_ID = int(os.getenv("OWNER_TELEGRAM_ID", "0"))
@@ -27,30 +37,43 @@ def is_owner(user_id: int) -> bool:
     return user_id == OWNER_TELEGRAM_ID
 
 
-async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle /start command - show main menu with stats (ChenStore style)."""
+async def load_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Load what the main menu shows with one database round-trip: the user
+    snapshot query runs alongside the (normally cached) catalog lookup.
+    
+    Returns:
+        (store stats, categories, balance)
+    """
     user = update.effective_user
     bot_id = context.bot_data.get('bot_id')
-    bot_name = context.bot_data.get('bot_name', 'Digital Store')
     
-    # Get or create bot user in database
-    bot_user = get_or_create_bot_user(
-        bot_id=bot_id,
-        telegram_id=user.id,
-        username=user.username,
-        first_name=user.first_name or "User"
+    snapshot, categories = await asyncio.gather(
+        get_menu_snapshot(
+            bot_id,
+            user.id,
+            username=user.username,
+            first_name=user.first_name or "User"
+        ),
+        get_categories_by_bot(bot_id)
     )
     
     # Store bot_user_id in user_data for later use
-    context.user_data['bot_user_id'] = bot_user['id']
+    context.user_data['bot_user_id'] = snapshot['user']['id']
+    remember_row(bot_id, snapshot['user'], user.username, user.first_name or "User")
+    return snapshot['stats'], categories, snapshot['balance']
+
+
+async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /start command - show main menu with stats (ChenStore style)."""
+    user = update.effective_user
+    bot_name = context.bot_data.get('bot_name', 'Digital Store')
     
     # Check if user is owner (admin)
     is_admin = is_owner(user.id)
     
-    # Get store stats for display
-    stats = get_store_stats(bot_id)
-    categories = get_categories_by_bot(bot_id)
-    balance = get_user_balance(bot_id, user.id)
+    # User (created if new), balance, store stats and categories
+    stats, categories, balance = await load_menu(update, context)
     
     # Build ChenStore-style welcome message
     welcome_text = (
@@ -81,14 +104,11 @@ async def back_to_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     user = update.effective_user
-    bot_id = context.bot_data.get('bot_id')
     bot_name = context.bot_data.get('bot_name', 'Digital Store')
     is_admin = is_owner(user.id)
     
     # Get store stats for display
-    stats = get_store_stats(bot_id)
-    categories = get_categories_by_bot(bot_id)
-    balance = get_user_balance(bot_id, user.id)
+    stats, categories, balance = await load_menu(update, context)
     
     # Build ChenStore-style welcome message
     welcome_text = (
@@ -143,20 +163,22 @@ async def help_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def show_leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Show top buyers leaderboard."""
+    """Show top buyers leaderboard (all time, this week or this month)."""
     query = update.callback_query
     await query.answer()
     
     bot_id = context.bot_data.get('bot_id')
-    leaderboard = get_leaderboard(bot_id, limit=10)
+    period = LEADERBOARD_PERIODS.get(query.data)
+    leaderboard = await get_leaderboard(bot_id, limit=10, period=period)
+    title = LEADERBOARD_TITLES[period]
     
     if not leaderboard:
         text = (
-            "🏆 *Leaderboard*\n\n"
+            f"🏆 *Leaderboard - {title}*\n\n"
             "📭 Belum ada transaksi. Jadilah yang pertama berbelanja!"
         )
     else:
-        text = "🏆 *Leaderboard - Top Buyers*\n\n"
+        text = f"🏆 *Leaderboard - Top Buyers {title}*\n\n"
         medals = ["🥇", "🥈", "🥉"]
         
         for i, buyer in enumerate(leaderboard):
@@ -169,7 +191,7 @@ async def show_leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.edit_message_text(
         text,
         parse_mode="Markdown",
-        reply_markup=create_back_keyboard()
+        reply_markup=create_leaderboard_keyboard(period)
     )
 
 
@@ -180,7 +202,7 @@ async def show_balance(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     bot_id = context.bot_data.get('bot_id')
     user = update.effective_user
-    balance = get_user_balance(bot_id, user.id)
+    balance = await get_user_balance(bot_id, user.id)
     balance_str = f"Rp {balance:,}".replace(",", ".")
     
     text = (
@@ -209,7 +231,7 @@ async def show_all_products(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     bot_id = context.bot_data.get('bot_id')
-    products = get_products_by_bot(bot_id)
+    products = await get_products_by_bot(bot_id)
     
     if not products:
         text = "📦 *Semua Produk*\n\n📭 Belum ada produk tersedia."
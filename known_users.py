@@ -0,0 +1,126 @@
+"""
+Known Users Module.
+Per-bot LRU of Telegram users already registered in bot_users, so a repeat
+/start does not touch Postgres. Username/first name changes seen on cached
+users are written lazily, batched every PROFILE_FLUSH_INTERVAL seconds.
+"""
+
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from database_async import get_or_create_bot_user, update_bot_user_profiles
+
+logger = logging.getLogger(__name__)
+
+# Users remembered per bot (least recently seen are evicted first)
+KNOWN_USERS_PER_BOT = int(os.getenv("KNOWN_USERS_PER_BOT", "10000"))
+
+# Seconds between batched profile writes
+PROFILE_FLUSH_INTERVAL = 30
+
+# bot_id -> telegram_id -> (bot_user_id, username, first_name)
+_known: Dict[int, "OrderedDict[int, Tuple[int, Optional[str], Optional[str]]]"] = {}
+
+# bot_user_id -> (username, first_name) waiting to be written
+_dirty: Dict[int, Tuple[Optional[str], Optional[str]]] = {}
+_flush_task: Optional[asyncio.Task] = None
+
+
+def remember(bot_id: int, telegram_id: int, bot_user_id: int, username: str = None, first_name: str = None):
+    """Record a user known to exist in bot_users with the stored profile."""
+    users = _known.setdefault(bot_id, OrderedDict())
+    users[telegram_id] = (bot_user_id, username, first_name)
+    users.move_to_end(telegram_id)
+    if len(users) > KNOWN_USERS_PER_BOT:
+        users.popitem(last=False)
+
+
+def seen(bot_id: int, telegram_id: int, username: str = None, first_name: str = None) -> Optional[int]:
+    """
+    Look up a known user and queue a profile write if it changed.
+
+    Returns:
+        bot_user_id, or None if the user is not cached
+    """
+    users = _known.get(bot_id)
+    entry = users.get(telegram_id) if users else None
+    if entry is None:
+        return None
+
+    users.move_to_end(telegram_id)
+    bot_user_id, old_username, old_first_name = entry
+    if (username, first_name) != (old_username, old_first_name):
+        users[telegram_id] = (bot_user_id, username, first_name)
+        _queue_profile(bot_user_id, username, first_name)
+    return bot_user_id
+
+
+def remember_row(bot_id: int, row: dict, username: str = None, first_name: str = None):
+    """
+    Cache a bot_users row read elsewhere (e.g. the menu snapshot) and queue
+    a profile write if the current username/first name differ from it.
+    """
+    remember(bot_id, row['telegram_id'], row['id'], row.get('username'), row.get('first_name'))
+    seen(bot_id, row['telegram_id'], username, first_name)
+
+
+async def ensure_bot_user(bot_id: int, telegram_id: int, username: str = None, first_name: str = None) -> int:
+    """
+    Register a user if needed; cached users cost no database round-trip.
+
+    Returns:
+        bot_user_id
+    """
+    bot_user_id = seen(bot_id, telegram_id, username, first_name)
+    if bot_user_id is not None:
+        return bot_user_id
+
+    row = await get_or_create_bot_user(bot_id, telegram_id, username, first_name)
+    remember(bot_id, telegram_id, row['id'], username, first_name)
+    return row['id']
+
+
+def forget_bot(bot_id: int):
+    """Drop a bot's cached users (bot stopped or deleted)."""
+    _known.pop(bot_id, None)
+
+
+# ---------- lazy profile writes ----------
+
+def _queue_profile(bot_user_id: int, username: Optional[str], first_name: Optional[str]):
+    global _flush_task
+    _dirty[bot_user_id] = (username, first_name)
+    if _flush_task is None or _flush_task.done():
+        _flush_task = asyncio.create_task(_flush_later())
+
+
+async def _flush_later():
+    # Keeps going while writes fail
+    while _dirty:
+        await asyncio.sleep(PROFILE_FLUSH_INTERVAL)
+        await flush_profiles()
+
+
+async def flush_profiles():
+    """Write queued profile changes now (also called on runner shutdown)."""
+    if not _dirty:
+        return
+    batch = [(bot_user_id, *profile) for bot_user_id, profile in _dirty.items()]
+    _dirty.clear()
+    try:
+        await update_bot_user_profiles(batch)
+    except Exception as e:
+        logger.error(f"Could not write {len(batch)} user profile(s): {e}")
+        for bot_user_id, username, first_name in batch:
+            _dirty.setdefault(bot_user_id, (username, first_name))
+
+
+def get_known_users_stats() -> dict:
+    return {
+        "bots": len(_known),
+        "users": sum(len(users) for users in _known.values()),
+        "pending_profiles": len(_dirty),
+    }
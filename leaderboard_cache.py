@@ -0,0 +1,60 @@
+"""
+Leaderboard Cache Module.
+Keeps each store bot's top buyers (all time, this week, this month) in
+memory. The boards are read from the buyer totals and rollups maintained by
+the orders triggers, dropped when this runner settles a payment and
+reloaded after LEADERBOARD_CACHE_TTL for payments settled elsewhere
+(webhook server, API).
+"""
+
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+from database_async import get_leaderboard as load_leaderboard
+
+# Seconds a cached board is served without a reload
+LEADERBOARD_CACHE_TTL = float(os.getenv("LEADERBOARD_CACHE_TTL", "60"))
+
+# Buyers kept per board
+LEADERBOARD_SIZE = 10
+
+# None = all time
+PERIODS = (None, "week", "month")
+
+# (bot_id, period) -> (loaded at, top buyers)
+_boards: Dict[Tuple[int, Optional[str]], Tuple[float, list]] = {}
+
+# Bumped by invalidate_leaderboard so a load racing a payment is not stored
+_generations: Dict[int, int] = {}
+
+
+async def get_leaderboard(bot_id: int, limit: int = LEADERBOARD_SIZE, period: str = None) -> list[dict]:
+    """
+    Get the top buyers of a bot.
+
+    Args:
+        bot_id: Database ID of the bot
+        limit: Number of buyers (at most LEADERBOARD_SIZE come from the cache)
+        period: None for all time, 'week' or 'month'
+    """
+    if limit > LEADERBOARD_SIZE:
+        return await load_leaderboard(bot_id, limit, period)
+
+    key = (bot_id, period)
+    cached = _boards.get(key)
+    if cached and time.monotonic() - cached[0] < LEADERBOARD_CACHE_TTL:
+        return cached[1][:limit]
+
+    generation = _generations.get(bot_id, 0)
+    board = await load_leaderboard(bot_id, LEADERBOARD_SIZE, period)
+    if _generations.get(bot_id, 0) == generation:
+        _boards[key] = (time.monotonic(), board)
+    return board[:limit]
+
+
+def invalidate_leaderboard(bot_id: int):
+    """Drop a bot's boards after one of its orders was paid."""
+    _generations[bot_id] = _generations.get(bot_id, 0) + 1
+    for period in PERIODS:
+        _boards.pop((bot_id, period), None)
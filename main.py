@@ -36,10 +36,18 @@ def main():
     if not owner_id:
         print("⚠️ OWNER_TELEGRAM_ID not set - admin features will be disabled")
     
+    # Sharded mode: a supervisor spreads bots over several worker processes,
+    # each with its own BotManager and connection pool
+    workers = int(os.getenv("BOT_WORKERS", "1"))
+    if workers > 1:
+        from shard_runner import ShardSupervisor
+        ShardSupervisor(workers).run()
+        return
+    
     # Initialize database connection pool for fast responses
     print("🔌 Initializing database connection pool...")
     try:
-        init_connection_pool(minconn=2, maxconn=10)
+        init_connection_pool()
         print("✅ Connection pool ready!")
     except Exception as e:
         print(f"❌ Failed to initialize connection pool: {e}")
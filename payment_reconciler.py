@@ -0,0 +1,256 @@
+"""
+Payment Reconciler Module.
+Polls Pakasir for the pending orders and deposits of a BotManager's bots
+and settles and delivers them as soon as they are paid, so buyers do not
+have to tap "Cek Status".
+
+Each payment is checked every PAYMENT_POLL_MIN seconds during its first
+PAYMENT_POLL_FAST_WINDOW seconds (when most buyers pay), then ever less
+often up to PAYMENT_POLL_MAX as it ages towards expiry, with one last
+check at expiry. Checks per Pakasir project are capped at
+PAYMENT_PROJECT_CONCURRENCY.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+from telegram.error import RetryAfter, TelegramError
+
+from catalog_cache import invalidate_catalog
+from database_async import get_pending_payments, settle_deposit, settle_order
+from handlers.store.deposit import format_deposit_credit
+from handlers.store.order import format_order_delivery
+from leaderboard_cache import invalidate_leaderboard
+from services.pakasir import get_pakasir_client
+from utils.metrics import PAYMENT_DELIVERY_DELAY, PAYMENTS_SETTLED, PAYMENTS_TRACKED
+
+logger = logging.getLogger(__name__)
+
+# How often pending payments are reloaded from the database (seconds, 0 disables the reconciler)
+PAYMENT_SCAN_INTERVAL = float(os.getenv("PAYMENT_SCAN_INTERVAL", "5"))
+
+# Seconds between checks of a young payment
+PAYMENT_POLL_MIN = float(os.getenv("PAYMENT_POLL_MIN", "3"))
+
+# Longest gap between checks of an old payment (seconds)
+PAYMENT_POLL_MAX = float(os.getenv("PAYMENT_POLL_MAX", "60"))
+
+# Payments younger than this are checked every PAYMENT_POLL_MIN; after it the
+# interval doubles every window (seconds)
+PAYMENT_POLL_FAST_WINDOW = float(os.getenv("PAYMENT_POLL_FAST_WINDOW", "120"))
+
+# Status checks running at the same time per Pakasir project
+PAYMENT_PROJECT_CONCURRENCY = int(os.getenv("PAYMENT_PROJECT_CONCURRENCY", "4"))
+
+# Payments stay tracked this long after expiry (Pakasir may report a
+# payment made at the last moment late)
+PAYMENT_EXPIRY_GRACE = 120
+
+# Reconciler loop tick (seconds)
+TICK = 1
+
+
+def poll_interval(age: float) -> float:
+    """Seconds until the next check of a payment created `age` seconds ago."""
+    if age < PAYMENT_POLL_FAST_WINDOW:
+        return PAYMENT_POLL_MIN
+    doublings = (age - PAYMENT_POLL_FAST_WINDOW) / PAYMENT_POLL_FAST_WINDOW
+    return min(PAYMENT_POLL_MAX, PAYMENT_POLL_MIN * 2 ** doublings)
+
+
+class PendingPayment:
+    """Polling state of one pending order or deposit."""
+
+    def __init__(self, row: dict, now: float):
+        self.kind = row['kind']
+        self.order_id = row['order_id']
+        self.bot_id = row['bot_id']
+        self.telegram_id = row['telegram_id']
+        self.amount = row['amount']
+        # Monotonic clock times, from the database's age and remaining
+        self.created = now - row['age']
+        self.expires = now + row['remaining'] if row['remaining'] is not None else None
+        self.checks = 0
+        self.checking = False
+        # First check somewhere within one interval, so a restart with many
+        # pending payments does not check them all at once
+        self.next_check = now + random.uniform(0, poll_interval(row['age']))
+
+    def schedule(self, now: float):
+        """Plan the next check after one that found the payment unpaid."""
+        self.next_check = now + poll_interval(now - self.created)
+        if self.expires is not None and now < self.expires < self.next_check:
+            self.next_check = self.expires
+
+
+class PaymentReconciler:
+    """Background settlement and delivery of a BotManager's QRIS payments."""
+
+    def __init__(self, manager):
+        """
+        Initialize reconciler.
+
+        Args:
+            manager: BotManager whose running store bots are reconciled
+        """
+        self.manager = manager
+        self.pending: Dict[str, PendingPayment] = {}
+        self.settled = {"order": 0, "deposit": 0}
+        self._semaphores: Dict[Tuple[str, str], asyncio.Semaphore] = {}
+        self._tasks: set = set()
+        self._last_scan = 0.0
+        PAYMENTS_TRACKED.set_callback(self._tracked_counts)
+
+    def _tracked_counts(self) -> dict:
+        counts = {("order",): 0, ("deposit",): 0}
+        for payment in list(self.pending.values()):
+            counts[(payment.kind,)] += 1
+        return counts
+
+    def _semaphore(self, project: Tuple[str, str]) -> asyncio.Semaphore:
+        if project not in self._semaphores:
+            self._semaphores[project] = asyncio.Semaphore(PAYMENT_PROJECT_CONCURRENCY)
+        return self._semaphores[project]
+
+    # ---------- tracking ----------
+
+    async def _scan(self):
+        """Reload pending payments; paid, cancelled and expired ones drop out."""
+        bot_ids = [
+            bot_id for bot_id, bot in self.manager.bots.items()
+            if bot.pakasir_slug and bot.pakasir_api_key
+        ]
+        rows = await get_pending_payments(bot_ids, PAYMENT_EXPIRY_GRACE) if bot_ids else []
+
+        now = time.monotonic()
+        pending = {}
+        for row in rows:
+            payment = self.pending.get(row['order_id'])
+            pending[row['order_id']] = payment or PendingPayment(row, now)
+        self.pending = pending
+
+    def _dispatch(self, now: float):
+        """Start the checks that are due."""
+        for payment in list(self.pending.values()):
+            if payment.checking or payment.next_check > now:
+                continue
+            payment.checking = True
+            task = asyncio.create_task(self._check(payment))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    # ---------- checking ----------
+
+    async def _check(self, payment: PendingPayment):
+        try:
+            instance = self.manager.bots.get(payment.bot_id)
+            if instance is None:
+                return
+
+            project = (instance.pakasir_slug, instance.pakasir_api_key)
+            async with self._semaphore(project):
+                status = await get_pakasir_client(*project).get_transaction_status(
+                    payment.order_id, payment.amount
+                )
+            payment.checks += 1
+
+            if status and status.status == "completed":
+                await self._settle(instance, payment, status.completed_at)
+            else:
+                payment.schedule(time.monotonic())
+        except Exception as e:
+            logger.error(f"Payment check of {payment.order_id} failed: {e}")
+            payment.schedule(time.monotonic())
+        finally:
+            payment.checking = False
+
+    async def _settle(self, instance, payment: PendingPayment, completed_at: Optional[str]):
+        """Settle a completed payment and send the buyer the product or new balance."""
+        if payment.kind == "order":
+            result = await settle_order(payment.order_id)
+        else:
+            result = await settle_deposit(payment.order_id)
+        self.pending.pop(payment.order_id, None)
+
+        # Already settled by the check button or the webhook, which answered the buyer
+        if not result or not result['settled']:
+            return
+
+        if payment.kind == "order":
+            invalidate_leaderboard(payment.bot_id)
+            if result['stock']:
+                invalidate_catalog(payment.bot_id)
+            text = format_order_delivery(result)
+        else:
+            text = format_deposit_credit(result)
+
+        self.settled[payment.kind] += 1
+        PAYMENTS_SETTLED.inc(payment.kind)
+        self._observe_delay(payment.kind, completed_at)
+        logger.info(f"💰 {payment.kind.capitalize()} {payment.order_id} paid, settled after {payment.checks} check(s)")
+
+        await self._deliver(instance, payment, text)
+
+    @staticmethod
+    def _observe_delay(kind: str, completed_at: Optional[str]):
+        """Record pay-to-settlement time when Pakasir gave a zoned completion time."""
+        try:
+            paid = datetime.fromisoformat(completed_at)
+        except (TypeError, ValueError):
+            return
+        if paid.tzinfo is not None:
+            delay = (datetime.now(timezone.utc) - paid).total_seconds()
+            PAYMENT_DELIVERY_DELAY.observe(max(0.0, delay), kind)
+
+    async def _deliver(self, instance, payment: PendingPayment, text: str):
+        for attempt in range(2):
+            try:
+                await instance.app.bot.send_message(payment.telegram_id, text, parse_mode="Markdown")
+                return
+            except RetryAfter as e:
+                if attempt:
+                    break
+                delay = e.retry_after
+                if hasattr(delay, 'total_seconds'):
+                    delay = delay.total_seconds()
+                await asyncio.sleep(delay)
+            except TelegramError as e:
+                logger.warning(f"Could not deliver {payment.order_id} to {payment.telegram_id}: {e}")
+                return
+        logger.warning(f"Could not deliver {payment.order_id} to {payment.telegram_id}: rate limited")
+
+    # ---------- loop ----------
+
+    async def run(self):
+        """Reconcile loop: rescans every PAYMENT_SCAN_INTERVAL, starts due checks every TICK."""
+        try:
+            while True:
+                try:
+                    now = time.monotonic()
+                    if now - self._last_scan >= PAYMENT_SCAN_INTERVAL:
+                        self._last_scan = now
+                        await self._scan()
+                    self._dispatch(time.monotonic())
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Payment reconcile iteration failed: {e}")
+                await asyncio.sleep(TICK)
+        finally:
+            for task in list(self._tasks):
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def get_status(self) -> dict:
+        """Tracked, in-flight and settled payment counts."""
+        tracked = self._tracked_counts()
+        return {
+            "tracked": {kind: count for (kind,), count in tracked.items()},
+            "checking": len(self._tasks),
+            "settled": dict(self.settled),
+        }
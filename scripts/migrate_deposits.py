@@ -55,6 +55,11 @@ def run_migration():
         cursor.execute("""
             CREATE INDEX IF NOT EXISTS idx_deposits_status ON deposits(status)
         """)
+        # The payment reconciler rescans pending deposits every few seconds
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_deposits_pending
+            ON deposits(bot_id, created_at) WHERE status = 'pending'
+        """)
         
         conn.commit()
         print("✅ Database migrations completed successfully!")
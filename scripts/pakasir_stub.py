@@ -0,0 +1,216 @@
+"""
+Local stand-in for the Pakasir API, for load and failure testing.
+
+Implements the endpoints services/pakasir.py calls (transactioncreate,
+transactiondetail, transactioncancel, paymentsimulation) plus balance, keeps
+transactions in memory, and can add latency, errors and hangs on demand.
+Point the runner at it with PAKASIR_API_BASE_URL=http://127.0.0.1:8090/api.
+
+Usage:
+    python scripts/pakasir_stub.py
+    python scripts/pakasir_stub.py --latency 0.3 --jitter 0.2 --error-rate 0.1
+    python scripts/pakasir_stub.py --auto-pay 20 --webhook-url http://127.0.0.1:5001/webhook/pakasir
+
+Failure behaviour can also be changed while it runs:
+    curl -X POST 'http://127.0.0.1:8090/_control?error_rate=1'     # Pakasir "down"
+    curl -X POST 'http://127.0.0.1:8090/_control?error_rate=0'
+    curl http://127.0.0.1:8090/_stats
+"""
+
+import argparse
+import asyncio
+import random
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from aiohttp import ClientSession, web
+
+# Fee charged on top of the amount, like Pakasir's QRIS fee
+FEE_PERCENT = 0.7
+
+# Minutes until a QRIS expires
+EXPIRY_MINUTES = 60
+
+
+class PakasirStub:
+    """In-memory Pakasir with configurable latency and faults."""
+
+    def __init__(self, args):
+        self.latency = args.latency
+        self.jitter = args.jitter
+        self.error_rate = args.error_rate
+        self.hang_rate = args.hang_rate
+        self.auto_pay = args.auto_pay
+        self.webhook_url = args.webhook_url
+        self.transactions = {}
+        self.counts = {"requests": 0, "errors": 0, "hangs": 0, "created": 0, "completed": 0}
+
+    async def _delay_or_fail(self):
+        """Apply latency and injected faults; returns an error response or None."""
+        self.counts["requests"] += 1
+        if self.hang_rate and random.random() < self.hang_rate:
+            self.counts["hangs"] += 1
+            await asyncio.sleep(3600)
+        await asyncio.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+        if self.error_rate and random.random() < self.error_rate:
+            self.counts["errors"] += 1
+            return web.json_response({"error": "injected failure"}, status=503)
+        return None
+
+    async def _params(self, request: web.Request) -> dict:
+        if request.method == "GET":
+            return dict(request.query)
+        try:
+            return await request.json()
+        except ValueError:
+            return {}
+
+    def _find(self, params: dict):
+        tx = self.transactions.get(params.get("order_id"))
+        if tx and int(params.get("amount", 0)) == tx["amount"]:
+            return tx
+        return None
+
+    async def create(self, request: web.Request):
+        error = await self._delay_or_fail()
+        if error:
+            return error
+        params = await self._params(request)
+        if not params.get("project") or not params.get("api_key"):
+            return web.json_response({"error": "project and api_key required"}, status=401)
+
+        amount = int(params.get("amount", 0))
+        fee = int(amount * FEE_PERCENT / 100)
+        tx = {
+            "project": params["project"],
+            "order_id": params.get("order_id", ""),
+            "amount": amount,
+            "fee": fee,
+            "total_payment": amount + fee,
+            "payment_method": request.match_info["method"],
+            "payment_number": f"00020101021226STUB{uuid.uuid4().hex.upper()}5303360540{amount}6304ABCD",
+            "expired_at": (datetime.now(timezone.utc) + timedelta(minutes=EXPIRY_MINUTES)).isoformat(),
+            "status": "pending",
+            "completed_at": None,
+        }
+        self.transactions[tx["order_id"]] = tx
+        self.counts["created"] += 1
+        if self.auto_pay is not None:
+            asyncio.get_running_loop().call_later(
+                self.auto_pay, lambda: asyncio.ensure_future(self._complete(tx))
+            )
+        return web.json_response({"payment": {k: v for k, v in tx.items() if k not in ("status", "completed_at")}})
+
+    async def detail(self, request: web.Request):
+        error = await self._delay_or_fail()
+        if error:
+            return error
+        tx = self._find(await self._params(request))
+        if not tx:
+            return web.json_response({"error": "transaction not found"}, status=404)
+        return web.json_response({"transaction": {
+            "amount": tx["amount"],
+            "order_id": tx["order_id"],
+            "project": tx["project"],
+            "status": tx["status"],
+            "payment_method": tx["payment_method"],
+            "completed_at": tx["completed_at"],
+        }})
+
+    async def cancel(self, request: web.Request):
+        error = await self._delay_or_fail()
+        if error:
+            return error
+        tx = self._find(await self._params(request))
+        if not tx:
+            return web.json_response({"error": "transaction not found"}, status=404)
+        if tx["status"] == "pending":
+            tx["status"] = "canceled"
+        return web.json_response({"success": True})
+
+    async def simulate(self, request: web.Request):
+        error = await self._delay_or_fail()
+        if error:
+            return error
+        tx = self._find(await self._params(request))
+        if not tx:
+            return web.json_response({"error": "transaction not found"}, status=404)
+        await self._complete(tx)
+        return web.json_response({"success": True})
+
+    async def balance(self, request: web.Request):
+        error = await self._delay_or_fail()
+        if error:
+            return error
+        return web.json_response({"balance": 0})
+
+    async def _complete(self, tx: dict):
+        if tx["status"] != "pending":
+            return
+        tx["status"] = "completed"
+        tx["completed_at"] = datetime.now(timezone.utc).isoformat()
+        self.counts["completed"] += 1
+        if not self.webhook_url:
+            return
+        payload = {
+            "amount": tx["amount"],
+            "order_id": tx["order_id"],
+            "project": tx["project"],
+            "status": "completed",
+            "payment_method": tx["payment_method"],
+            "completed_at": tx["completed_at"],
+        }
+        try:
+            async with ClientSession() as session:
+                async with session.post(self.webhook_url, json=payload) as response:
+                    print(f"📤 Webhook {tx['order_id']}: HTTP {response.status}")
+        except Exception as e:
+            print(f"❌ Webhook {tx['order_id']} failed: {e}")
+
+    async def control(self, request: web.Request):
+        for name in ("latency", "jitter", "error_rate", "hang_rate"):
+            if name in request.query:
+                setattr(self, name, float(request.query[name]))
+        return await self.stats(request)
+
+    async def stats(self, request: web.Request):
+        return web.json_response({
+            **self.counts,
+            "transactions": len(self.transactions),
+            "latency": self.latency,
+            "jitter": self.jitter,
+            "error_rate": self.error_rate,
+            "hang_rate": self.hang_rate,
+        })
+
+
+def build_app(stub: PakasirStub) -> web.Application:
+    app = web.Application()
+    app.router.add_post("/api/transactioncreate/{method}", stub.create)
+    app.router.add_get("/api/transactiondetail", stub.detail)
+    app.router.add_post("/api/transactioncancel", stub.cancel)
+    app.router.add_post("/api/paymentsimulation", stub.simulate)
+    app.router.add_get("/api/balance", stub.balance)
+    app.router.add_post("/_control", stub.control)
+    app.router.add_get("/_stats", stub.stats)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Pakasir API stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds added to every answer")
+    parser.add_argument("--jitter", type=float, default=0.0, help="+/- seconds of random extra latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 503")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="Share of requests that never answer")
+    parser.add_argument("--auto-pay", type=float, default=None, help="Complete transactions after N seconds")
+    parser.add_argument("--webhook-url", default=None, help="POST completions here (webhook/server.py)")
+    args = parser.parse_args()
+
+    print(f"🧪 Pakasir stand-in on http://{args.host}:{args.port}/api")
+    web.run_app(build_app(PakasirStub(args)), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
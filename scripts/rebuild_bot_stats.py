@@ -0,0 +1,43 @@
+"""
+Rebuild the bot_stats counters from bot_users, orders and products, the
+buyer leaderboard totals and weekly/monthly rollups from orders, and the
+products' stock counters (product_stock_counts) from product_stock.
+
+The counters are kept up to date by triggers; run this after a migration,
+a manual data fix or whenever they look off.
+
+Usage:
+    python scripts/rebuild_bot_stats.py            # every bot
+    python scripts/rebuild_bot_stats.py 12 15      # only bots 12 and 15
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database_pg import get_cursor, rebuild_bot_stats
+
+
+def main(bot_ids: list[int]):
+    if not bot_ids:
+        with get_cursor() as cursor:
+            cursor.execute("SELECT id FROM bots ORDER BY id")
+            bot_ids = [row['id'] for row in cursor.fetchall()]
+
+    print(f"🔄 Rebuilding stats of {len(bot_ids)} bot(s)...")
+    drifted = 0
+    for bot_id in bot_ids:
+        result = rebuild_bot_stats(bot_id)
+        if result['before'] != result['after'] or result['buyers_fixed'] or result['products_fixed']:
+            drifted += 1
+            print(
+                f"   Bot {bot_id}: {result['before']} -> {result['after']}, "
+                f"{result['buyers_fixed']} buyer(s), {result['products_fixed']} product(s) fixed"
+            )
+
+    print(f"✅ Done, {drifted} bot(s) had drifted")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]])
@@ -31,6 +31,21 @@ def update_schema():
             ADD COLUMN IF NOT EXISTS bot_type VARCHAR(50) DEFAULT 'store'
         """)
         
+        # Add update_mode column (NULL = runner default, 'polling' or 'webhook')
+        print("   Adding update_mode column to bots table...")
+        cursor.execute("""
+            ALTER TABLE bots 
+            ADD COLUMN IF NOT EXISTS update_mode VARCHAR(20)
+        """)
+        
+        # Telegram's first_name of the bot (cached from getMe by the runner);
+        # bot_name stays the tenant's own label
+        print("   Adding telegram_first_name column to bots table...")
+        cursor.execute("""
+            ALTER TABLE bots 
+            ADD COLUMN IF NOT EXISTS telegram_first_name VARCHAR(100)
+        """)
+        
         # Create verifications table (for simple verification bot)
         print("   Creating verifications table...")
         cursor.execute("""
@@ -186,6 +201,464 @@ def update_schema():
             )
         """)
         
+        # ==================== BOT PERSISTENCE TABLE ====================
+        print("   Creating bot_persistence table (user/chat data, conversations)...")
+        
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS bot_persistence (
+                bot_id INTEGER NOT NULL REFERENCES bots(id) ON DELETE CASCADE,
+                kind VARCHAR(100) NOT NULL,
+                key VARCHAR(100) NOT NULL,
+                data JSONB NOT NULL,
+                updated_at TIMESTAMP DEFAULT NOW(),
+                PRIMARY KEY (bot_id, kind, key)
+            )
+        """)
+        
+        # ==================== BOT STATS COUNTERS ====================
+        print("   Creating bot_stats counters table and triggers...")
+        
+        # A bot's counters are spread over up to 16 slot rows, summed on read.
+        # A writer always adds to the slot of its connection
+        # (pg_backend_pid() % 16), so settlements and new buyers of one bot
+        # update different rows instead of queueing on one counters row.
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS bot_stats (
+                bot_id INTEGER NOT NULL REFERENCES bots(id) ON DELETE CASCADE,
+                slot SMALLINT NOT NULL DEFAULT 0,
+                total_users INTEGER NOT NULL DEFAULT 0,
+                total_transactions INTEGER NOT NULL DEFAULT 0,
+                total_revenue BIGINT NOT NULL DEFAULT 0,
+                total_products INTEGER NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT NOW(),
+                PRIMARY KEY (bot_id, slot)
+            )
+        """)
+        
+        # Counters tables created with one row per bot become slot 0
+        cursor.execute("""
+            DO $$
+            BEGIN
+                IF NOT EXISTS (
+                    SELECT 1 FROM information_schema.columns
+                    WHERE table_name = 'bot_stats' AND column_name = 'slot'
+                ) THEN
+                    ALTER TABLE bot_stats ADD COLUMN slot SMALLINT NOT NULL DEFAULT 0;
+                    ALTER TABLE bot_stats DROP CONSTRAINT bot_stats_pkey;
+                    ALTER TABLE bot_stats ADD PRIMARY KEY (bot_id, slot);
+                END IF;
+            END
+            $$
+        """)
+        
+        # Apply counter deltas in the writing transaction, to its slot. The
+        # bot's advisory lock is taken shared (writers never wait on each
+        # other) and exclusive by rebuild_bot_stats' recount. Deletes only
+        # update: during a bot's cascade delete its bots row is already gone.
+        cursor.execute("""
+            CREATE OR REPLACE FUNCTION bot_stats_apply(
+                p_bot_id INTEGER, d_users INTEGER, d_transactions INTEGER,
+                d_revenue BIGINT, d_products INTEGER
+            ) RETURNS void AS $$
+            BEGIN
+                IF p_bot_id IS NULL THEN
+                    RETURN;
+                END IF;
+                PERFORM pg_advisory_xact_lock_shared(hashtext('bot_stats'), p_bot_id);
+                UPDATE bot_stats SET
+                    total_users = total_users + d_users,
+                    total_transactions = total_transactions + d_transactions,
+                    total_revenue = total_revenue + d_revenue,
+                    total_products = total_products + d_products,
+                    updated_at = NOW()
+                WHERE bot_id = p_bot_id AND slot = pg_backend_pid() % 16;
+                IF NOT FOUND AND EXISTS (SELECT 1 FROM bots WHERE id = p_bot_id) THEN
+                    INSERT INTO bot_stats (bot_id, slot, total_users, total_transactions, total_revenue, total_products)
+                    VALUES (p_bot_id, pg_backend_pid() % 16, d_users, d_transactions, d_revenue, d_products)
+                    ON CONFLICT (bot_id, slot) DO UPDATE SET
+                        total_users = bot_stats.total_users + d_users,
+                        total_transactions = bot_stats.total_transactions + d_transactions,
+                        total_revenue = bot_stats.total_revenue + d_revenue,
+                        total_products = bot_stats.total_products + d_products,
+                        updated_at = NOW();
+                END IF;
+            END
+            $$ LANGUAGE plpgsql
+        """)
+        cursor.execute("""
+            CREATE OR REPLACE FUNCTION bot_stats_users_trigger() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'INSERT' THEN
+                    PERFORM bot_stats_apply(NEW.bot_id, 1, 0, 0, 0);
+                ELSE
+                    PERFORM bot_stats_apply(OLD.bot_id, -1, 0, 0, 0);
+                END IF;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+        """)
+        cursor.execute("""
+            CREATE OR REPLACE FUNCTION bot_stats_products_trigger() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'INSERT' THEN
+                    PERFORM bot_stats_apply(NEW.bot_id, 0, 0, 0, 1);
+                ELSE
+                    PERFORM bot_stats_apply(OLD.bot_id, 0, 0, 0, -1);
+                END IF;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+        """)
+        cursor.execute("""
+            CREATE OR REPLACE FUNCTION bot_stats_orders_trigger() RETURNS trigger AS $$
+            DECLARE
+                old_paid INTEGER := 0;
+                new_paid INTEGER := 0;
+                old_amount BIGINT := 0;
+                new_amount BIGINT := 0;
+            BEGIN
+                IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.status = 'paid' THEN
+                    old_paid := 1;
+                    old_amount := OLD.amount;
+                END IF;
+                IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.status = 'paid' THEN
+                    new_paid := 1;
+                    new_amount := NEW.amount;
+                END IF;
+                IF new_paid <> old_paid OR new_amount <> old_amount THEN
+                    PERFORM bot_stats_apply(
+                        CASE WHEN TG_OP = 'DELETE' THEN OLD.bot_id ELSE NEW.bot_id END,
+                        0, new_paid - old_paid, new_amount - old_amount, 0
+                    );
+                END IF;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+        """)
+        cursor.execute("""
+            DROP TRIGGER IF EXISTS bot_stats_users ON bot_users;
+            CREATE TRIGGER bot_stats_users AFTER INSERT OR DELETE ON bot_users
+                FOR EACH ROW EXECUTE FUNCTION bot_stats_users_trigger();
+            DROP TRIGGER IF EXISTS bot_stats_products ON products;
+            CREATE TRIGGER bot_stats_products AFTER INSERT OR DELETE ON products
+                FOR EACH ROW EXECUTE FUNCTION bot_stats_products_trigger();
+            DROP TRIGGER IF EXISTS bot_stats_orders ON orders;
+            CREATE TRIGGER bot_stats_orders AFTER INSERT OR UPDATE OF status, amount OR DELETE ON orders
+                FOR EACH ROW EXECUTE FUNCTION bot_stats_orders_trigger();
+        """)
+        
+        # Backfill bots that have no counters yet (scripts/rebuild_bot_stats.py fixes drift)
+        cursor.execute("""
+            INSERT INTO bot_stats (bot_id, slot, total_users, total_transactions, total_revenue, total_products)
+            SELECT b.id, 0,
+                   (SELECT COUNT(*) FROM bot_users WHERE bot_id = b.id),
+                   (SELECT COUNT(*) FROM orders WHERE bot_id = b.id AND status = 'paid'),
+                   (SELECT COALESCE(SUM(amount), 0) FROM orders WHERE bot_id = b.id AND status = 'paid'),
+                   (SELECT COUNT(*) FROM products WHERE bot_id = b.id)
+            FROM bots b
+            WHERE NOT EXISTS (SELECT 1 FROM bot_stats WHERE bot_id = b.id)
+            ON CONFLICT (bot_id, slot) DO NOTHING
+        """)
+        
+        # ==================== BUYER LEADERBOARD AGGREGATES ====================
+        print("   Adding buyer totals to bot_users and weekly/monthly rollups...")
+        
+        cursor.execute("""
+            ALTER TABLE bot_users
+            ADD COLUMN IF NOT EXISTS total_orders INTEGER NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS total_spent BIGINT NOT NULL DEFAULT 0
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_bot_users_leaderboard
+            ON bot_users(bot_id, total_spent DESC, total_orders DESC)
+            WHERE total_orders > 0
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS bot_user_spend_rollups (
+                bot_user_id INTEGER NOT NULL REFERENCES bot_users(id) ON DELETE CASCADE,
+                bot_id INTEGER NOT NULL REFERENCES bots(id) ON DELETE CASCADE,
+                period VARCHAR(10) NOT NULL,
+                period_start DATE NOT NULL,
+                total_orders INTEGER NOT NULL DEFAULT 0,
+                total_spent BIGINT NOT NULL DEFAULT 0,
+                PRIMARY KEY (bot_user_id, period, period_start)
+            )
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_spend_rollups_leaderboard
+            ON bot_user_spend_rollups(bot_id, period, period_start, total_spent DESC)
+        """)
+        
+        # Paid orders add to (and un-paid orders subtract from) the buyer's
+        # totals and the week/month of their payment
+        cursor.execute("""
+            CREATE OR REPLACE FUNCTION buyer_totals_apply(
+                p_bot_id INTEGER, p_bot_user_id INTEGER, p_at TIMESTAMP,
+                d_orders INTEGER, d_spent BIGINT
+            ) RETURNS void AS $$
+            DECLARE
+                p VARCHAR;
+            BEGIN
+                IF p_bot_user_id IS NULL THEN
+                    RETURN;
+                END IF;
+                UPDATE bot_users SET
+                    total_orders = total_orders + d_orders,
+                    total_spent = total_spent + d_spent
+                WHERE id = p_bot_user_id;
+                IF NOT FOUND THEN
+                    RETURN;
+                END IF;
+                FOREACH p IN ARRAY ARRAY['week', 'month'] LOOP
+                    INSERT INTO bot_user_spend_rollups
+                        (bot_user_id, bot_id, period, period_start, total_orders, total_spent)
+                    VALUES (p_bot_user_id, p_bot_id, p, date_trunc(p, p_at)::date, d_orders, d_spent)
+                    ON CONFLICT (bot_user_id, period, period_start) DO UPDATE SET
+                        total_orders = bot_user_spend_rollups.total_orders + d_orders,
+                        total_spent = bot_user_spend_rollups.total_spent + d_spent;
+                END LOOP;
+            END
+            $$ LANGUAGE plpgsql
+        """)
+        cursor.execute("""
+            CREATE OR REPLACE FUNCTION buyer_totals_orders_trigger() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'UPDATE' AND OLD.status = 'paid' AND NEW.status = 'paid'
+                   AND OLD.amount = NEW.amount AND OLD.bot_user_id IS NOT DISTINCT FROM NEW.bot_user_id
+                   AND OLD.paid_at IS NOT DISTINCT FROM NEW.paid_at THEN
+                    RETURN NULL;
+                END IF;
+                IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.status = 'paid' THEN
+                    PERFORM buyer_totals_apply(OLD.bot_id, OLD.bot_user_id,
+                        COALESCE(OLD.paid_at, OLD.created_at), -1, -OLD.amount);
+                END IF;
+                IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.status = 'paid' THEN
+                    PERFORM buyer_totals_apply(NEW.bot_id, NEW.bot_user_id,
+                        COALESCE(NEW.paid_at, NOW()::timestamp), 1, NEW.amount);
+                END IF;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+        """)
+        # Named to fire after bot_stats_orders, whose bot_stats advisory lock
+        # serializes it with scripts/rebuild_bot_stats.py
+        cursor.execute("""
+            DROP TRIGGER IF EXISTS bot_stats_orders_buyers ON orders;
+            CREATE TRIGGER bot_stats_orders_buyers
+                AFTER INSERT OR UPDATE OF status, amount, paid_at, bot_user_id OR DELETE ON orders
+                FOR EACH ROW EXECUTE FUNCTION buyer_totals_orders_trigger();
+        """)
+        
+        # Backfill buyer totals and rollups from paid orders
+        cursor.execute("""
+            UPDATE bot_users bu SET total_orders = a.total_orders, total_spent = a.total_spent
+            FROM (
+                SELECT bot_user_id, COUNT(*) as total_orders, SUM(amount) as total_spent
+                FROM orders WHERE status = 'paid' AND bot_user_id IS NOT NULL
+                GROUP BY bot_user_id
+            ) a
+            WHERE bu.id = a.bot_user_id
+              AND (bu.total_orders, bu.total_spent) IS DISTINCT FROM (a.total_orders, a.total_spent)
+        """)
+        cursor.execute("""
+            INSERT INTO bot_user_spend_rollups
+                (bot_user_id, bot_id, period, period_start, total_orders, total_spent)
+            SELECT o.bot_user_id, o.bot_id, p.period,
+                   date_trunc(p.period, COALESCE(o.paid_at, o.created_at))::date,
+                   COUNT(*), SUM(o.amount)
+            FROM orders o
+            CROSS JOIN (VALUES ('week'), ('month')) AS p(period)
+            WHERE o.status = 'paid' AND o.bot_user_id IS NOT NULL
+            GROUP BY 1, 2, 3, 4
+            ON CONFLICT (bot_user_id, period, period_start) DO UPDATE SET
+                total_orders = EXCLUDED.total_orders,
+                total_spent = EXCLUDED.total_spent
+        """)
+        
+        # ==================== PRODUCT STOCK COUNTERS ====================
+        print("   Creating product_stock_counts (sharded per-product stock counters)...")
+        
+        # Each product's available/sold/reserved counts are spread over up to
+        # 16 slot rows, summed on read. A writer always adds to the slot of its
+        # connection (pg_backend_pid() % 16), so concurrent buyers of one
+        # product update different rows instead of queueing on one counter.
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS product_stock_counts (
+                product_id INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+                slot SMALLINT NOT NULL,
+                available INTEGER NOT NULL DEFAULT 0,
+                sold INTEGER NOT NULL DEFAULT 0,
+                reserved INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (product_id, slot)
+            )
+        """)
+        
+        # Replaced by product_stock_counts: every claim updated the products row
+        cursor.execute("""
+            ALTER TABLE products
+            DROP COLUMN IF EXISTS stock_available,
+            DROP COLUMN IF EXISTS stock_sold,
+            DROP COLUMN IF EXISTS stock_reserved
+        """)
+        
+        # Unsold lines held for a pending order (orders.order_id) until
+        # reserved_until; expired holds are released by the runner's sweeper
+        cursor.execute("""
+            ALTER TABLE product_stock
+            ADD COLUMN IF NOT EXISTS reserved_order VARCHAR(50),
+            ADD COLUMN IF NOT EXISTS reserved_until TIMESTAMP
+        """)
+        
+        # Writers take the product's advisory lock shared (they never wait on
+        # each other); the recount in rebuild_bot_stats takes it exclusive.
+        # Deletes of a product's lines during its cascade delete are skipped.
+        cursor.execute("""
+            CREATE OR REPLACE FUNCTION product_stock_counts_apply(
+                p_product_id INTEGER, d_available BIGINT, d_sold BIGINT, d_reserved BIGINT
+            ) RETURNS void AS $$
+            BEGIN
+                IF d_available = 0 AND d_sold = 0 AND d_reserved = 0 THEN
+                    RETURN;
+                END IF;
+                PERFORM pg_advisory_xact_lock_shared(hashtext('product_stock_counts'), p_product_id);
+                INSERT INTO product_stock_counts (product_id, slot, available, sold, reserved)
+                SELECT p_product_id, pg_backend_pid() % 16, d_available, d_sold, d_reserved
+                WHERE EXISTS (SELECT 1 FROM products WHERE id = p_product_id)
+                ON CONFLICT (product_id, slot) DO UPDATE SET
+                    available = product_stock_counts.available + EXCLUDED.available,
+                    sold = product_stock_counts.sold + EXCLUDED.sold,
+                    reserved = product_stock_counts.reserved + EXCLUDED.reserved;
+            END
+            $$ LANGUAGE plpgsql
+        """)
+        
+        # Statement-level triggers with transition tables: a bulk insert of
+        # N stock lines updates each product's counters once, not N times
+        cursor.execute("""
+            CREATE OR REPLACE FUNCTION product_stock_counts_trigger() RETURNS trigger AS $$
+            DECLARE
+                d RECORD;
+            BEGIN
+                IF TG_OP = 'INSERT' THEN
+                    FOR d IN
+                        SELECT product_id,
+                               COUNT(*) FILTER (WHERE is_sold = false) as available,
+                               COUNT(*) FILTER (WHERE is_sold = true) as sold,
+                               COUNT(*) FILTER (WHERE is_sold = false AND reserved_order IS NOT NULL) as reserved
+                        FROM new_rows GROUP BY product_id ORDER BY product_id
+                    LOOP
+                        PERFORM product_stock_counts_apply(d.product_id, d.available, d.sold, d.reserved);
+                    END LOOP;
+                ELSIF TG_OP = 'DELETE' THEN
+                    FOR d IN
+                        SELECT product_id,
+                               COUNT(*) FILTER (WHERE is_sold = false) as available,
+                               COUNT(*) FILTER (WHERE is_sold = true) as sold,
+                               COUNT(*) FILTER (WHERE is_sold = false AND reserved_order IS NOT NULL) as reserved
+                        FROM old_rows GROUP BY product_id ORDER BY product_id
+                    LOOP
+                        PERFORM product_stock_counts_apply(d.product_id, -d.available, -d.sold, -d.reserved);
+                    END LOOP;
+                ELSE
+                    FOR d IN
+                        SELECT product_id,
+                               SUM(sign) FILTER (WHERE is_sold = false) as available,
+                               SUM(sign) FILTER (WHERE is_sold = true) as sold,
+                               SUM(sign) FILTER (WHERE is_sold = false AND reserved_order IS NOT NULL) as reserved
+                        FROM (
+                            SELECT product_id, is_sold, reserved_order, 1 as sign FROM new_rows
+                            UNION ALL
+                            SELECT product_id, is_sold, reserved_order, -1 FROM old_rows
+                        ) changes
+                        GROUP BY product_id ORDER BY product_id
+                    LOOP
+                        PERFORM product_stock_counts_apply(d.product_id,
+                            COALESCE(d.available, 0), COALESCE(d.sold, 0), COALESCE(d.reserved, 0));
+                    END LOOP;
+                END IF;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+        """)
+        cursor.execute("""
+            DROP TRIGGER IF EXISTS product_stock_counts_insert ON product_stock;
+            CREATE TRIGGER product_stock_counts_insert AFTER INSERT ON product_stock
+                REFERENCING NEW TABLE AS new_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION product_stock_counts_trigger();
+            DROP TRIGGER IF EXISTS product_stock_counts_update ON product_stock;
+            CREATE TRIGGER product_stock_counts_update AFTER UPDATE ON product_stock
+                REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION product_stock_counts_trigger();
+            DROP TRIGGER IF EXISTS product_stock_counts_delete ON product_stock;
+            CREATE TRIGGER product_stock_counts_delete AFTER DELETE ON product_stock
+                REFERENCING OLD TABLE AS old_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION product_stock_counts_trigger();
+        """)
+        
+        # Backfill from product_stock into slot 0 (writers wait meanwhile)
+        cursor.execute("LOCK TABLE product_stock IN SHARE MODE")
+        cursor.execute("DELETE FROM product_stock_counts")
+        cursor.execute("""
+            INSERT INTO product_stock_counts (product_id, slot, available, sold, reserved)
+            SELECT product_id, 0,
+                   COUNT(*) FILTER (WHERE is_sold = false),
+                   COUNT(*) FILTER (WHERE is_sold = true),
+                   COUNT(*) FILTER (WHERE is_sold = false AND reserved_order IS NOT NULL)
+            FROM product_stock
+            WHERE product_id IS NOT NULL
+            GROUP BY product_id
+        """)
+        
+        # ==================== STOCK CONTENT HASHES ====================
+        print("   Adding content_hash to product_stock for import dedup...")
+        
+        # Computed by Postgres for every insert path; bulk imports skip lines
+        # whose hash the product already has
+        cursor.execute("""
+            ALTER TABLE product_stock
+            ADD COLUMN IF NOT EXISTS content_hash BYTEA
+                GENERATED ALWAYS AS (decode(md5(content), 'hex')) STORED
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_product_stock_content_hash
+            ON product_stock(product_id, content_hash)
+        """)
+        
+        # ==================== HOT PATH INDEXES ====================
+        print("   Creating stock, reservation, order and bot user indexes...")
+        
+        # Plain CREATE INDEX (this script runs in one transaction); on very
+        # large tables create them by hand with CONCURRENTLY first.
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_product_stock_unsold
+            ON product_stock(product_id, id) WHERE is_sold = false
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_product_stock_reserved_order
+            ON product_stock(reserved_order) WHERE reserved_order IS NOT NULL
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_product_stock_reserved_until
+            ON product_stock(reserved_until) WHERE reserved_until IS NOT NULL AND is_sold = false
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_orders_bot_status
+            ON orders(bot_id, status)
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_orders_user_created
+            ON orders(bot_user_id, created_at DESC)
+        """)
+        # The payment reconciler rescans pending payments every few seconds
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_orders_pending
+            ON orders(bot_id, created_at) WHERE status = 'pending'
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_bot_users_bot_created
+            ON bot_users(bot_id, created_at)
+        """)
+        
         # ==================== USER PROXIES TABLE ====================
         print("   Creating user_proxies table for multi-proxy storage...")
         
@@ -1,14 +1,48 @@
 """
 Pakasir API Client for QRIS payment integration.
 Supports per-bot configuration for multi-bot platform.
+
+All clients share one long-lived aiohttp session (keep-alive connection
+pool, cached DNS) per event loop, so a call does not pay a TLS handshake.
+Every call is bounded by PAKASIR_TIMEOUT; idempotent calls (status, cancel,
+simulate) are retried with jittered backoff on transient failures, and a
+process-wide circuit breaker fails calls fast while Pakasir is down.
+
+Tuning (environment):
+    PAKASIR_API_BASE_URL       API base URL (point at scripts/pakasir_stub.py for load tests)
+    PAKASIR_TIMEOUT            Total seconds per attempt (default 8)
+    PAKASIR_CONNECT_TIMEOUT    Seconds to connect (default 3)
+    PAKASIR_RETRIES            Extra attempts for idempotent calls (default 2)
+    PAKASIR_POOL_SIZE          Max open connections to Pakasir (default 100)
+    PAKASIR_BREAKER_THRESHOLD  Consecutive failures that open the breaker (default 5)
+    PAKASIR_BREAKER_COOLDOWN   Seconds the breaker stays open before a trial call (default 30)
 """
 
-import aiohttp
-from typing import Optional
+import asyncio
+import logging
+import os
+import random
+import time
 from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+import aiohttp
+
+from utils.metrics import PAKASIR_CIRCUIT_OPEN, PAKASIR_LATENCY, PAKASIR_RETRIED
 
+logger = logging.getLogger(__name__)
 
-PAKASIR_API_BASE_URL = "https://app.pakasir.com/api"
+PAKASIR_API_BASE_URL = os.getenv("PAKASIR_API_BASE_URL", "https://app.pakasir.com/api").rstrip("/")
+
+PAKASIR_TIMEOUT = float(os.getenv("PAKASIR_TIMEOUT", "8"))
+PAKASIR_CONNECT_TIMEOUT = float(os.getenv("PAKASIR_CONNECT_TIMEOUT", "3"))
+PAKASIR_RETRIES = int(os.getenv("PAKASIR_RETRIES", "2"))
+PAKASIR_POOL_SIZE = int(os.getenv("PAKASIR_POOL_SIZE", "100"))
+PAKASIR_BREAKER_THRESHOLD = int(os.getenv("PAKASIR_BREAKER_THRESHOLD", "5"))
+PAKASIR_BREAKER_COOLDOWN = float(os.getenv("PAKASIR_BREAKER_COOLDOWN", "30"))
+
+# First retry waits up to this long; each further retry doubles it
+RETRY_BACKOFF = 0.25
 
 
 @dataclass
@@ -34,13 +68,119 @@ class TransactionStatus:
     completed_at: Optional[str] = None
 
 
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    closed: calls pass. After `threshold` failures in a row it opens and
+    calls fail fast for `cooldown` seconds; then one trial call is let
+    through (half-open) and its result closes or reopens the breaker.
+    """
+
+    def __init__(self, threshold: int = PAKASIR_BREAKER_THRESHOLD, cooldown: float = PAKASIR_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.cooldown:
+            return "open"
+        return "half_open"
+
+    def allow(self) -> bool:
+        """Whether a call may go out now."""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial:
+            self._trial = True
+            return True
+        return False
+
+    def end_trial(self):
+        """Let another trial call through if this one ended without a result (e.g. cancelled)."""
+        self._trial = False
+
+    def record_success(self):
+        if self.opened_at is not None:
+            logger.info("Pakasir circuit closed")
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        PAKASIR_CIRCUIT_OPEN.set(0)
+
+    def record_failure(self):
+        self.failures += 1
+        if self._trial or (self.opened_at is None and self.failures >= self.threshold):
+            logger.warning(f"Pakasir circuit open after {self.failures} failure(s), failing fast for {self.cooldown:.0f}s")
+            self.opened_at = time.monotonic()
+            PAKASIR_CIRCUIT_OPEN.set(1)
+        self._trial = False
+
+    def stats(self) -> dict:
+        return {"state": self.state, "consecutive_failures": self.failures}
+
+
+class _TransientError(Exception):
+    """Failure worth retrying and counted by the breaker (network, timeout, 5xx)."""
+
+
+_breaker = CircuitBreaker()
+
+# One session per event loop (the runner has one; tests may create more)
+_session: Optional[aiohttp.ClientSession] = None
+_session_loop: Optional[asyncio.AbstractEventLoop] = None
+
+# (slug, api_key) -> client
+_clients: Dict[Tuple[str, str], "PakasirClient"] = {}
+
+
+def _get_session() -> aiohttp.ClientSession:
+    global _session, _session_loop
+    loop = asyncio.get_running_loop()
+    if _session is None or _session.closed or _session_loop is not loop:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=PAKASIR_POOL_SIZE, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(total=PAKASIR_TIMEOUT, connect=PAKASIR_CONNECT_TIMEOUT)
+        )
+        _session_loop = loop
+    return _session
+
+
+async def close_pakasir_session():
+    """Close the shared session. Call on runner shutdown."""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+def get_pakasir_client(project_slug: str = None, api_key: str = None) -> "PakasirClient":
+    """Get the shared client of a Pakasir project (created on first use)."""
+    key = (project_slug or "", api_key or "")
+    client = _clients.get(key)
+    if client is None:
+        client = _clients[key] = PakasirClient(*key)
+    return client
+
+
+def get_pakasir_stats() -> dict:
+    """Breaker state and client count, for status endpoints."""
+    return {"clients": len(_clients), "breaker": _breaker.stats()}
+
+
 class PakasirClient:
     """Pakasir API client for payment operations."""
-    
+
     def __init__(self, project_slug: str = None, api_key: str = None):
         """
-        Initialize Pakasir client.
-        
+        Initialize Pakasir client. Prefer get_pakasir_client(), which reuses clients.
+
         Args:
             project_slug: Pakasir project slug (per-bot)
             api_key: Pakasir API key (per-bot)
@@ -48,161 +188,187 @@ class PakasirClient:
         self.base_url = PAKASIR_API_BASE_URL
         self.project = project_slug or ""
         self.api_key = api_key or ""
-    
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.project and self.api_key)
+
+    async def _request(self, operation: str, method: str, path: str, *,
+                       idempotent: bool, json: dict = None, params: dict = None) -> Optional[dict]:
+        """
+        Call the API through the shared session.
+
+        Returns:
+            The JSON body of a 200 answer, {} if it had none, or None on failure
+        """
+        start = time.perf_counter()
+        outcome = "error"
+        attempts = 1 + (PAKASIR_RETRIES if idempotent else 0)
+        try:
+            for attempt in range(attempts):
+                if not _breaker.allow():
+                    outcome = "circuit_open"
+                    logger.warning(f"Pakasir {operation} skipped: circuit open")
+                    return None
+                try:
+                    data = await self._send(method, path, json, params)
+                except _TransientError as e:
+                    _breaker.record_failure()
+                    failure = e
+                else:
+                    _breaker.record_success()
+                    outcome = "ok" if data is not None else "failed"
+                    return data
+                finally:
+                    # A cancelled or unexpectedly failing trial must not
+                    # leave the breaker half-open forever
+                    _breaker.end_trial()
+
+                if attempt + 1 < attempts:
+                    PAKASIR_RETRIED.inc(operation)
+                    await asyncio.sleep(random.uniform(0, RETRY_BACKOFF * 2 ** attempt))
+                    continue
+                logger.error(f"Pakasir {operation} failed: {failure}")
+                return None
+        finally:
+            PAKASIR_LATENCY.observe(time.perf_counter() - start, operation, outcome)
+
+    async def _send(self, method: str, path: str, json: dict, params: dict) -> Optional[dict]:
+        """One attempt. Raises _TransientError; None for a definitive error answer."""
+        try:
+            async with _get_session().request(method, f"{self.base_url}/{path}", json=json, params=params) as response:
+                if response.status >= 500:
+                    raise _TransientError(f"HTTP {response.status}")
+                if response.status != 200:
+                    error_text = await response.text()
+                    logger.error(f"Pakasir API error: {response.status} - {error_text[:200]}")
+                    return None
+                try:
+                    return await response.json(content_type=None) or {}
+                except ValueError:
+                    return {}
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise _TransientError(f"{type(e).__name__}: {e}") from e
+
+    def _payload(self, order_id: str, amount: int) -> dict:
+        return {
+            "project": self.project,
+            "order_id": order_id,
+            "amount": amount,
+            "api_key": self.api_key
+        }
+
     async def create_transaction(
-        self, 
-        order_id: str, 
+        self,
+        order_id: str,
         amount: int,
         payment_method: str = "qris"
     ) -> Optional[PaymentResponse]:
         """
-        Create a new payment transaction.
-        
+        Create a new payment transaction. Not retried: a retry after a
+        timeout could create a second transaction.
+
         Args:
             order_id: Unique order identifier
             amount: Payment amount in IDR (without fee)
             payment_method: Payment method (qris, bni_va, bri_va, etc.)
-        
+
         Returns:
             PaymentResponse with QRIS string and payment details
         """
-        if not self.project or not self.api_key:
+        if not self.configured:
             print("❌ Pakasir not configured for this bot")
             return None
-        
-        url = f"{self.base_url}/transactioncreate/{payment_method}"
-        payload = {
-            "project": self.project,
-            "order_id": order_id,
-            "amount": amount,
-            "api_key": self.api_key
-        }
-        
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.post(url, json=payload) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        payment = data.get("payment", {})
-                        return PaymentResponse(
-                            project=payment.get("project", ""),
-                            order_id=payment.get("order_id", ""),
-                            amount=payment.get("amount", 0),
-                            fee=payment.get("fee", 0),
-                            total_payment=payment.get("total_payment", 0),
-                            payment_method=payment.get("payment_method", ""),
-                            payment_number=payment.get("payment_number", ""),
-                            expired_at=payment.get("expired_at", "")
-                        )
-                    else:
-                        error_text = await response.text()
-                        print(f"❌ Pakasir API error: {response.status} - {error_text}")
-                        return None
-            except Exception as e:
-                print(f"❌ Pakasir API exception: {e}")
-                return None
-    
+
+        data = await self._request(
+            "create", "POST", f"transactioncreate/{payment_method}",
+            idempotent=False, json=self._payload(order_id, amount)
+        )
+        if not data:
+            return None
+
+        payment = data.get("payment", {})
+        return PaymentResponse(
+            project=payment.get("project", ""),
+            order_id=payment.get("order_id", ""),
+            amount=payment.get("amount", 0),
+            fee=payment.get("fee", 0),
+            total_payment=payment.get("total_payment", 0),
+            payment_method=payment.get("payment_method", ""),
+            payment_number=payment.get("payment_number", ""),
+            expired_at=payment.get("expired_at", "")
+        )
+
     async def get_transaction_status(
-        self, 
-        order_id: str, 
+        self,
+        order_id: str,
         amount: int
     ) -> Optional[TransactionStatus]:
         """
         Get the status of a transaction.
-        
+
         Args:
             order_id: Order identifier
             amount: Original transaction amount
-        
+
         Returns:
             TransactionStatus with current status
         """
-        if not self.project or not self.api_key:
+        if not self.configured:
             return None
-        
-        url = f"{self.base_url}/transactiondetail"
-        params = {
-            "project": self.project,
-            "order_id": order_id,
-            "amount": amount,
-            "api_key": self.api_key
-        }
-        
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.get(url, params=params) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        tx = data.get("transaction", {})
-                        return TransactionStatus(
-                            order_id=tx.get("order_id", ""),
-                            amount=tx.get("amount", 0),
-                            status=tx.get("status", ""),
-                            payment_method=tx.get("payment_method", ""),
-                            completed_at=tx.get("completed_at")
-                        )
-                    else:
-                        return None
-            except Exception as e:
-                print(f"❌ Pakasir status check error: {e}")
-                return None
-    
+
+        data = await self._request(
+            "status", "GET", "transactiondetail",
+            idempotent=True, params=self._payload(order_id, amount)
+        )
+        if not data:
+            return None
+
+        tx = data.get("transaction", {})
+        return TransactionStatus(
+            order_id=tx.get("order_id", ""),
+            amount=tx.get("amount", 0),
+            status=tx.get("status", ""),
+            payment_method=tx.get("payment_method", ""),
+            completed_at=tx.get("completed_at")
+        )
+
     async def cancel_transaction(self, order_id: str, amount: int) -> bool:
         """
         Cancel a pending transaction.
-        
+
         Args:
             order_id: Order identifier
             amount: Original transaction amount
-        
+
         Returns:
             True if cancelled successfully
         """
-        if not self.project or not self.api_key:
+        if not self.configured:
             return False
-        
-        url = f"{self.base_url}/transactioncancel"
-        payload = {
-            "project": self.project,
-            "order_id": order_id,
-            "amount": amount,
-            "api_key": self.api_key
-        }
-        
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.post(url, json=payload) as response:
-                    return response.status == 200
-            except Exception as e:
-                print(f"❌ Pakasir cancel error: {e}")
-                return False
-    
+
+        data = await self._request(
+            "cancel", "POST", "transactioncancel",
+            idempotent=True, json=self._payload(order_id, amount)
+        )
+        return data is not None
+
     async def simulate_payment(self, order_id: str, amount: int) -> bool:
         """
         Simulate a payment (only works in sandbox mode).
-        
+
         Args:
             order_id: Order identifier
             amount: Transaction amount
-        
+
         Returns:
             True if simulation successful
         """
-        if not self.project or not self.api_key:
+        if not self.configured:
             return False
-        
-        url = f"{self.base_url}/paymentsimulation"
-        payload = {
-            "project": self.project,
-            "order_id": order_id,
-            "amount": amount,
-            "api_key": self.api_key
-        }
-        
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.post(url, json=payload) as response:
-                    return response.status == 200
-            except Exception as e:
-                print(f"❌ Pakasir simulation error: {e}")
-                return False
+
+        data = await self._request(
+            "simulate", "POST", "paymentsimulation",
+            idempotent=True, json=self._payload(order_id, amount)
+        )
+        return data is not None
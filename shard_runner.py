@@ -0,0 +1,286 @@
+"""
+Sharded Bot Runner.
+Spreads bots over several worker processes so one busy tenant cannot
+stall the others. A supervisor assigns bots to workers by consistent
+hashing on bot id, restarts crashed workers and rebalances when workers
+are added (SIGUSR1) or removed (SIGUSR2).
+"""
+
+import asyncio
+import bisect
+import hashlib
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Virtual nodes per worker on the hash ring
+RING_REPLICAS = 64
+
+# Restart backoff for crashed workers (seconds)
+RESTART_BACKOFF_MAX = 60
+# A worker alive this long is considered healthy again (seconds)
+RESTART_RESET_AFTER = 60
+
+
+def _hash(key: str) -> int:
+    return int(hashlib.md5(key.encode()).hexdigest()[:16], 16)
+
+
+class HashRing:
+    """Consistent hash ring mapping bot ids to worker names."""
+
+    def __init__(self, members: List[str], replicas: int = RING_REPLICAS):
+        self.members = list(members)
+        self._keys: List[int] = []
+        self._nodes: List[str] = []
+
+        points = sorted(
+            (_hash(f"{member}#{i}"), member)
+            for member in self.members
+            for i in range(replicas)
+        )
+        for key, member in points:
+            self._keys.append(key)
+            self._nodes.append(member)
+
+    def owner(self, bot_id: int) -> Optional[str]:
+        """Worker name responsible for a bot."""
+        if not self._keys:
+            return None
+        index = bisect.bisect(self._keys, _hash(f"bot:{bot_id}")) % len(self._keys)
+        return self._nodes[index]
+
+
+class Shard:
+    """
+    Ownership filter handed to a worker's BotManager.
+
+    Membership is read from memory shared with the supervisor, so workers
+    that are not restarted during a rebalance still see the new ring.
+    """
+
+    def __init__(self, name: str, membership):
+        self.name = name
+        self.index = int(name[1:])
+        self._membership = membership
+        self._raw = None
+        self.ring = HashRing([])
+
+    def _sync(self):
+        raw = self._membership.value.decode()
+        if raw != self._raw:
+            self._raw = raw
+            self.ring = HashRing(raw.split(","))
+
+    def owns(self, bot_id: int) -> bool:
+        self._sync()
+        return self.ring.owner(bot_id) == self.name
+
+    def __repr__(self):
+        return f"Shard({self.name}, {self.index + 1}/{len(self.ring.members)})"
+
+
+def _worker_main(name: str, membership):
+    """Entry point of a worker process."""
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    logging.basicConfig(
+        format=f"%(asctime)s - [{name}] %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO
+    )
+
+    from bot_manager import BotManager
+    from database_pg import init_connection_pool, close_connection_pool
+
+    # Each worker owns its own connection pool (DB_POOL_MIN..DB_POOL_MAX)
+    init_connection_pool()
+    manager = BotManager(shard=Shard(name, membership))
+
+    try:
+        asyncio.run(manager.run())
+    finally:
+        close_connection_pool()
+
+
+class _Worker:
+    """Supervisor-side state of one worker process."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.process: Optional[multiprocessing.Process] = None
+        self.started_at = 0.0
+        self.restarts = 0
+        self.next_start = 0.0
+
+
+class ShardSupervisor:
+    """Runs and supervises N bot worker processes."""
+
+    def __init__(self, workers: int):
+        self._ctx = multiprocessing.get_context("spawn")
+        self._next_id = 0
+        self._workers: Dict[str, _Worker] = {}
+        self._stopping = False
+        self._resize_to: Optional[int] = None
+        # Comma-separated worker names, shared with every worker
+        self._membership = self._ctx.Array("c", 4096)
+
+        for _ in range(max(1, workers)):
+            self._new_worker()
+        self._publish_members()
+
+    @property
+    def members(self) -> List[str]:
+        return list(self._workers.keys())
+
+    def _new_worker(self) -> _Worker:
+        worker = _Worker(f"w{self._next_id}")
+        self._next_id += 1
+        self._workers[worker.name] = worker
+        return worker
+
+    def _publish_members(self):
+        self._membership.value = ",".join(self.members).encode()
+
+    def _start(self, worker: _Worker):
+        worker.process = self._ctx.Process(
+            target=_worker_main,
+            args=(worker.name, self._membership),
+            name=f"bot-{worker.name}",
+            daemon=False
+        )
+        worker.process.start()
+        worker.started_at = time.monotonic()
+        logger.info(f"Worker {worker.name} started (PID {worker.process.pid})")
+
+    def _stop(self, worker: _Worker, timeout: float = 30):
+        process = worker.process
+        if not process or not process.is_alive():
+            return
+        process.terminate()
+        process.join(timeout)
+        if process.is_alive():
+            logger.warning(f"Worker {worker.name} did not stop in {timeout}s, killing")
+            process.kill()
+            process.join()
+
+    def _assignments(self, members: List[str]) -> Dict[str, set]:
+        """Current active bots grouped by owning worker."""
+        from database_pg import get_active_bots
+
+        ring = HashRing(members)
+        assignment = {name: set() for name in members}
+        for bot in get_active_bots():
+            assignment[ring.owner(bot['id'])].add(bot['id'])
+        return assignment
+
+    def resize(self, workers: int):
+        """Request a new worker count; applied by the supervision loop."""
+        self._resize_to = max(1, workers)
+
+    def _rebalance(self, workers: int):
+        """Add or remove workers, restarting only those whose bots moved."""
+        old_members = self.members
+        before = self._assignments(old_members)
+
+        while len(self._workers) < workers:
+            self._new_worker()
+        removed = []
+        while len(self._workers) > workers:
+            name = self.members[-1]
+            removed.append(self._workers.pop(name))
+            self._next_id -= 1
+
+        try:
+            after = self._assignments(self.members)
+        except Exception as e:
+            logger.error(f"Could not compute new assignment ({e}), restarting all workers")
+            after = {}
+
+        # Stop losing/removed workers first so no bot ever runs twice
+        changed = [
+            self._workers[name] for name in old_members
+            if name in self._workers and before[name] != after.get(name)
+        ]
+        for worker in removed + changed:
+            self._stop(worker)
+        self._publish_members()
+        for worker in changed:
+            self._start(worker)
+        for name in self.members:
+            if name not in old_members:
+                self._start(self._workers[name])
+
+        logger.info(
+            f"Rebalanced to {workers} worker(s): "
+            f"{len(changed)} restarted, {len(removed)} removed"
+        )
+
+    def _supervise(self):
+        """Restart crashed workers with exponential backoff."""
+        now = time.monotonic()
+        for worker in self._workers.values():
+            process = worker.process
+            if process and process.is_alive():
+                if worker.restarts and now - worker.started_at > RESTART_RESET_AFTER:
+                    worker.restarts = 0
+                continue
+
+            if process and worker.next_start == 0:
+                worker.restarts += 1
+                delay = min(RESTART_BACKOFF_MAX, 2 ** (worker.restarts - 1))
+                worker.next_start = now + delay
+                logger.error(
+                    f"Worker {worker.name} exited with code {process.exitcode}, "
+                    f"restarting in {delay}s (restart #{worker.restarts})"
+                )
+
+            if now >= worker.next_start:
+                worker.next_start = 0
+                self._start(worker)
+
+    def run(self):
+        """Start all workers and supervise them until SIGINT/SIGTERM."""
+        def _shutdown(signum, frame):
+            self._stopping = True
+
+        signal.signal(signal.SIGINT, _shutdown)
+        signal.signal(signal.SIGTERM, _shutdown)
+        def _target() -> int:
+            return self._resize_to or len(self._workers)
+
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, lambda s, f: self.resize(_target() + 1))
+            signal.signal(signal.SIGUSR2, lambda s, f: self.resize(_target() - 1))
+
+        print("=" * 50)
+        print(f"🧩 Sharded Bot Runner: {len(self._workers)} worker(s)")
+        print(f"   Supervisor PID {os.getpid()} (SIGUSR1 = add worker, SIGUSR2 = remove worker)")
+        print("=" * 50)
+
+        for worker in self._workers.values():
+            self._start(worker)
+
+        while not self._stopping:
+            if self._resize_to is not None and self._resize_to != len(self._workers):
+                workers, self._resize_to = self._resize_to, None
+                try:
+                    self._rebalance(workers)
+                except Exception as e:
+                    logger.error(f"Rebalance failed: {e}")
+            self._supervise()
+            time.sleep(1)
+
+        print("\n🛑 Stopping workers...")
+        for worker in self._workers.values():
+            if worker.process and worker.process.is_alive():
+                worker.process.terminate()
+        for worker in self._workers.values():
+            self._stop(worker)
+        print("👋 All workers stopped. Goodbye!")
@@ -0,0 +1,131 @@
+"""
+Fixtures for the database tests.
+
+The tests run against a throwaway PostgreSQL database named by
+TEST_DATABASE_URL: the schema is created there and every table is
+emptied before each test. Without TEST_DATABASE_URL they are skipped.
+
+Usage:
+    TEST_DATABASE_URL=postgresql://postgres@localhost:5432/bot_test python -m pytest -q
+"""
+
+import os
+import sys
+import threading
+
+import pytest
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL", "")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Point every database module at the test database before it is imported
+if TEST_DATABASE_URL:
+    os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+    os.environ["DATABASE_DIRECT_URL"] = TEST_DATABASE_URL
+
+# The API's database module imports its config as a top-level module
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "api"))
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+
+
+@pytest.fixture(scope="session")
+def schema():
+    """Create the full schema (API tables, then the migrations) once per run."""
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL not set")
+
+    import database as api_database
+    from migrate_deposits import run_migration
+    from update_schema import update_schema
+
+    api_database.init_database()
+    assert update_schema(), "update_schema failed"
+    run_migration()
+
+
+@pytest.fixture
+def db(schema):
+    """database_pg on an emptied test database, with a fresh connection pool."""
+    import database_pg
+
+    with database_pg.get_cursor() as cursor:
+        cursor.execute("TRUNCATE users, bots RESTART IDENTITY CASCADE")
+    yield database_pg
+    database_pg.close_connection_pool()
+
+
+@pytest.fixture
+def connect(schema):
+    """Open extra connections outside the pool; closed after the test."""
+    import psycopg2
+
+    conns = []
+
+    def _connect():
+        conn = psycopg2.connect(TEST_DATABASE_URL)
+        conns.append(conn)
+        return conn
+
+    yield _connect
+    for conn in conns:
+        conn.close()
+
+
+@pytest.fixture
+def together():
+    """together(target, n) runs target(i) in n threads released at once and returns their results."""
+    def _together(target, count: int) -> list:
+        start = threading.Barrier(count)
+        results = [None] * count
+
+        def run(i: int):
+            start.wait()
+            results[i] = target(i)
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    return _together
+
+
+@pytest.fixture
+def store(db):
+    """
+    A store bot with one product and one buyer.
+
+    store['add_stock'](n) adds n stock lines; store['add_order'](order_id)
+    creates a pending order of the product.
+    """
+    with db.get_cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO users (email, password_hash) VALUES ('owner@example.com', 'x')
+            RETURNING id
+        """)
+        user_id = cursor.fetchone()['id']
+        cursor.execute("""
+            INSERT INTO bots (user_id, telegram_token, pakasir_slug, pakasir_api_key)
+            VALUES (%s, '1:test', 'test', 'key')
+            RETURNING id
+        """, (user_id,))
+        bot_id = cursor.fetchone()['id']
+    product = db.create_product(bot_id, None, "Produk Tes", 10000)
+    buyer = db.get_or_create_bot_user(bot_id, 1000, "pembeli", "Pembeli")
+
+    def add_stock(count: int) -> dict:
+        return db.add_stock_items(product['id'], (f"akun-{i}" for i in range(count)))
+
+    def add_order(order_id: str) -> dict:
+        return db.create_order(bot_id, buyer['id'], product['id'], order_id, product['price'])
+
+    return {
+        'bot_id': bot_id,
+        'product_id': product['id'],
+        'add_stock': add_stock,
+        'add_order': add_order,
+    }
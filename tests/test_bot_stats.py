@@ -0,0 +1,57 @@
+"""
+Tests for the per-bot counters (bot_stats slot rows).
+"""
+
+import threading
+
+
+def test_new_buyers_of_one_bot_do_not_block(db, store, connect):
+    """A buyer registers while another buyer's registration is uncommitted."""
+    bot_id = store['bot_id']
+
+    # One pooled connection, so its counter slot is known
+    db.close_connection_pool()
+    db.init_connection_pool(1, 1)
+    with db.get_cursor() as cursor:
+        cursor.execute("SELECT pg_backend_pid() % 16 as slot")
+        pool_slot = cursor.fetchone()['slot']
+
+    while True:
+        other = connect()
+        with other.cursor() as cursor:
+            cursor.execute("SELECT pg_backend_pid() % 16")
+            if cursor.fetchone()[0] != pool_slot:
+                break
+
+    with other.cursor() as cursor:
+        cursor.execute("INSERT INTO bot_users (bot_id, telegram_id) VALUES (%s, 1001)", (bot_id,))
+
+    register = threading.Thread(target=db.get_or_create_bot_user, args=(bot_id, 1002))
+    try:
+        register.start()
+        register.join(timeout=5)
+        assert not register.is_alive(), "registration waited for the other buyer's transaction"
+    finally:
+        other.commit()
+        register.join()
+
+    assert db.get_store_stats(bot_id)['total_users'] == 3
+
+
+def test_rebuild_folds_slots_and_fixes_drift(db, store, connect):
+    bot_id = store['bot_id']
+    for telegram_id in (1, 2, 3):
+        conn = connect()
+        with conn.cursor() as cursor:
+            cursor.execute("INSERT INTO bot_users (bot_id, telegram_id) VALUES (%s, %s)", (bot_id, telegram_id))
+        conn.commit()
+    with db.get_cursor() as cursor:
+        cursor.execute("UPDATE bot_stats SET total_revenue = total_revenue + 500 WHERE bot_id = %s", (bot_id,))
+
+    result = db.rebuild_bot_stats(bot_id)
+    assert result['before']['total_revenue'] > 0
+    assert result['after'] == {'total_users': 4, 'total_transactions': 0, 'total_revenue': 0, 'total_products': 1}
+    with db.get_cursor() as cursor:
+        cursor.execute("SELECT slot FROM bot_stats WHERE bot_id = %s", (bot_id,))
+        assert [row['slot'] for row in cursor.fetchall()] == [0]
+    assert db.get_bot_stats(bot_id)['total_users'] == 4
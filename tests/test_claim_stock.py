@@ -0,0 +1,44 @@
+"""
+Tests for claim_stock: concurrent claims never hand out the same line twice.
+"""
+
+CLAIMERS = 8
+
+
+def test_concurrent_claims_never_share_a_line(db, store, together):
+    product_id = store['product_id']
+    store['add_stock'](20)
+
+    # 8 buyers want 3 lines each: 24 wanted, 20 to give
+    results = together(lambda i: db.claim_stock(product_id, order_id=i + 1, quantity=3), CLAIMERS)
+
+    # Skipping locked lines may leave a claimer short, never with a taken line
+    ids = [item['id'] for items in results for item in items]
+    assert len(set(ids)) == len(ids) > 0
+    assert all(len(items) <= 3 for items in results)
+
+    with db.get_cursor() as cursor:
+        cursor.execute("""
+            SELECT COUNT(*) as sold, COUNT(DISTINCT order_id) as orders
+            FROM product_stock WHERE product_id = %s AND is_sold = true
+        """, (product_id,))
+        assert cursor.fetchone() == {'sold': len(ids), 'orders': sum(1 for items in results if items)}
+    assert db.get_product_by_id(product_id)['stock'] == 20 - len(ids)
+
+
+def test_held_line_goes_to_its_order_only(db, store):
+    product_id = store['product_id']
+    store['add_stock'](3)
+    with db.get_cursor() as cursor:
+        cursor.execute("""
+            UPDATE product_stock SET reserved_order = 'ORDHELD', reserved_until = NOW() + interval '15 minutes'
+            WHERE id = (SELECT MIN(id) FROM product_stock WHERE product_id = %s)
+            RETURNING id
+        """, (product_id,))
+        held_id = cursor.fetchone()['id']
+
+    others = db.claim_stock(product_id, order_id=1, quantity=5)
+    assert sorted(item['id'] for item in others) == [held_id + 1, held_id + 2]
+
+    mine = db.claim_stock(product_id, order_id=2, order_code='ORDHELD')
+    assert [item['id'] for item in mine] == [held_id]
@@ -0,0 +1,96 @@
+"""
+Tests for settle_order and settle_deposit: concurrent settles deliver once,
+and a settle that lost the race reports the winner's result.
+"""
+
+import threading
+import time
+
+SETTLERS = 8
+
+
+def test_concurrent_settles_deliver_once(db, store, together):
+    store['add_stock'](3)
+    store['add_order']("ORDRACE")
+
+    results = together(lambda i: db.settle_order("ORDRACE"), SETTLERS)
+
+    assert sum(result['settled'] for result in results) == 1
+    assert all(result['order']['status'] == 'paid' for result in results)
+    # Every caller reports the one item that was delivered
+    assert len({result['stock']['id'] for result in results}) == 1
+
+    with db.get_cursor() as cursor:
+        cursor.execute("""
+            SELECT COUNT(*) as sold FROM product_stock ps
+            JOIN orders o ON o.id = ps.order_id
+            WHERE o.order_id = 'ORDRACE'
+        """)
+        assert cursor.fetchone()['sold'] == 1
+    assert db.get_product_by_id(store['product_id'])['stock'] == 2
+    assert db.get_store_stats(store['bot_id'])['total_transactions'] == 1
+
+
+def test_concurrent_orders_get_different_lines(db, store, together):
+    store['add_stock'](5)
+    for i in range(SETTLERS):
+        store['add_order'](f"ORD{i}")
+
+    results = together(lambda i: db.settle_order(f"ORD{i}"), SETTLERS)
+
+    assert all(result['settled'] for result in results)
+    delivered = [result['stock']['id'] for result in results if result['stock']]
+    assert len(delivered) == len(set(delivered)) == 5
+
+
+def test_concurrent_deposit_settles_credit_once(db, store, together):
+    db.create_deposit(store['bot_id'], 1000, "DEPRACE", 25000, fee=0, total=25000, qris_string="qris")
+
+    results = together(lambda i: db.settle_deposit("DEPRACE"), SETTLERS)
+
+    assert sum(result['settled'] for result in results) == 1
+    assert db.get_user_balance(store['bot_id'], 1000) == 25000
+
+
+def test_lost_race_rereads_the_winners_result(db, store, connect):
+    """A settle that waited on a concurrent one returns the paid order and its item."""
+    store['add_stock'](2)
+    order = store['add_order']("ORDLOST")
+
+    # The winner: pays the order and takes the first line, not yet committed
+    winner = connect()
+    with winner.cursor() as cursor:
+        cursor.execute("UPDATE orders SET status = 'paid', paid_at = NOW() WHERE id = %s", (order['id'],))
+        cursor.execute("""
+            UPDATE product_stock SET is_sold = true, sold_at = NOW(), order_id = %s
+            WHERE id = (SELECT MIN(id) FROM product_stock WHERE product_id = %s)
+            RETURNING id
+        """, (order['id'], store['product_id']))
+        winner_item = cursor.fetchone()[0]
+
+    result = {}
+    loser = threading.Thread(target=lambda: result.update(db.settle_order("ORDLOST")))
+    loser.start()
+    try:
+        # Let the loser's statement start and block on the order row
+        watcher = connect()
+        watcher.autocommit = True
+        with watcher.cursor() as cursor:
+            deadline = time.monotonic() + 5
+            while time.monotonic() < deadline:
+                cursor.execute("""
+                    SELECT COUNT(*) FROM pg_stat_activity
+                    WHERE wait_event_type = 'Lock' AND query LIKE '%%WITH settled AS%%'
+                """)
+                if cursor.fetchone()[0]:
+                    break
+                time.sleep(0.05)
+            else:
+                raise AssertionError("settle_order did not wait for the winner")
+    finally:
+        winner.commit()
+        loser.join()
+
+    assert result['settled'] is False
+    assert result['order']['status'] == 'paid'
+    assert result['stock'] == {'id': winner_item, 'content': 'akun-0'}
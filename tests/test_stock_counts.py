@@ -0,0 +1,89 @@
+"""
+Tests for the sharded product stock counters (product_stock_counts).
+"""
+
+import threading
+
+
+def stock_of(db, product_id: int) -> int:
+    return db.get_product_by_id(product_id)['stock']
+
+
+def test_counters_follow_inserts_claims_and_holds(db, store):
+    product_id = store['product_id']
+    store['add_stock'](5)
+    assert stock_of(db, product_id) == 5
+
+    assert len(db.claim_stock(product_id, order_id=1, quantity=2)) == 2
+    assert stock_of(db, product_id) == 3
+
+    with db.get_cursor() as cursor:
+        cursor.execute("""
+            UPDATE product_stock SET reserved_order = 'ORDHOLD', reserved_until = NOW() + interval '15 minutes'
+            WHERE id = (SELECT MIN(id) FROM product_stock WHERE product_id = %s AND is_sold = false)
+        """, (product_id,))
+    assert stock_of(db, product_id) == 2
+
+    with db.get_cursor() as cursor:
+        cursor.execute("""
+            SELECT SUM(available) as available, SUM(sold) as sold, SUM(reserved) as reserved
+            FROM product_stock_counts WHERE product_id = %s
+        """, (product_id,))
+        assert cursor.fetchone() == {'available': 3, 'sold': 2, 'reserved': 1}
+
+
+def test_rebuild_fixes_drifted_counters(db, store):
+    product_id = store['product_id']
+    store['add_stock'](4)
+    with db.get_cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO product_stock_counts (product_id, slot, available) VALUES (%s, 15, 7)
+            ON CONFLICT (product_id, slot) DO UPDATE SET available = product_stock_counts.available + 7
+        """, (product_id,))
+    assert stock_of(db, product_id) == 11
+
+    result = db.rebuild_bot_stats(store['bot_id'])
+    assert result['products_fixed'] == 1
+    assert stock_of(db, product_id) == 4
+
+
+def test_concurrent_claims_on_one_product_do_not_block(db, store, connect):
+    """A claim goes through while another buyer's sale of the same product is uncommitted."""
+    product_id = store['product_id']
+    store['add_stock'](10)
+
+    # One pooled connection, so its counter slot is known
+    db.close_connection_pool()
+    db.init_connection_pool(1, 1)
+    with db.get_cursor() as cursor:
+        cursor.execute("SELECT pg_backend_pid() % 16 as slot")
+        pool_slot = cursor.fetchone()['slot']
+
+    # The other buyer: a connection writing to a different slot
+    while True:
+        other = connect()
+        with other.cursor() as cursor:
+            cursor.execute("SELECT pg_backend_pid() % 16")
+            if cursor.fetchone()[0] != pool_slot:
+                break
+
+    with other.cursor() as cursor:
+        cursor.execute("""
+            UPDATE product_stock SET is_sold = true, sold_at = NOW(), order_id = 1
+            WHERE id = (SELECT MIN(id) FROM product_stock WHERE product_id = %s)
+            RETURNING id
+        """, (product_id,))
+        held_id = cursor.fetchone()[0]
+
+    claimed = []
+    claim = threading.Thread(target=lambda: claimed.extend(db.claim_stock(product_id, order_id=2)))
+    try:
+        claim.start()
+        claim.join(timeout=5)
+        assert not claim.is_alive(), "claim waited for the other buyer's transaction"
+    finally:
+        other.rollback()
+        claim.join()
+
+    assert len(claimed) == 1 and claimed[0]['id'] != held_id
+    assert stock_of(db, product_id) == 9
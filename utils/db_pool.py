@@ -0,0 +1,423 @@
+"""
+Managed psycopg2 connection pool.
+
+Thread-safe pool shared by the bot runner (database_pg) and the API
+(api/database.py). Compared to psycopg2's ThreadedConnectionPool it:
+
+- queues checkouts when every connection is busy and only fails after
+  DB_POOL_TIMEOUT seconds (PoolTimeout) instead of raising immediately;
+- validates connections that sat idle for a while before handing them out
+  and pings idle connections in the background so Neon/PgBouncer idle
+  timeouts do not surface as errors in request paths;
+- records checkout wait, hold time and timeouts per call site;
+- grows on demand up to maxconn and, every DB_POOL_RESIZE_INTERVAL, shrinks
+  back towards the peak concurrency measured in the last window (never
+  below minconn).
+
+Configuration (environment):
+    DB_POOL_MIN                 Connections always kept open (default 2)
+    DB_POOL_MAX                 Upper bound of open connections (default 10)
+    DB_POOL_TIMEOUT             Seconds a checkout waits for a connection (default 10)
+    DB_POOL_KEEPALIVE_INTERVAL  Seconds between pings of idle connections (default 60)
+    DB_POOL_RESIZE_INTERVAL     Seconds between sizing decisions (default 30)
+"""
+
+import contextlib
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Tuple
+
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_UNKNOWN
+from psycopg2.pool import PoolError
+
+from utils.metrics import (
+    DB_CHECKOUT_TIMEOUTS,
+    DB_CHECKOUT_WAIT,
+    DB_CONNECTION_HOLD,
+    DB_POOL_CONNECTIONS
+)
+
+logger = logging.getLogger("db_pool")
+
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "2"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_KEEPALIVE_INTERVAL = float(os.getenv("DB_POOL_KEEPALIVE_INTERVAL", "60"))
+DB_POOL_RESIZE_INTERVAL = float(os.getenv("DB_POOL_RESIZE_INTERVAL", "30"))
+
+# A connection idle longer than this is checked with SELECT 1 before checkout (seconds)
+VALIDATE_AFTER_IDLE = 30
+
+# Connections kept above the measured peak when shrinking
+RESIZE_HEADROOM = 1
+
+_pools: List["ManagedConnectionPool"] = []
+
+
+class PoolTimeout(PoolError):
+    """No connection became available within the checkout timeout."""
+
+
+class _SiteStats:
+    __slots__ = ("checkouts", "wait_total", "wait_max", "hold_total", "hold_max", "timeouts")
+
+    def __init__(self):
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.hold_total = 0.0
+        self.hold_max = 0.0
+        self.timeouts = 0
+
+    def to_dict(self) -> dict:
+        checkouts = self.checkouts or 1
+        return {
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "wait_avg_ms": round(self.wait_total / checkouts * 1000, 2),
+            "wait_max_ms": round(self.wait_max * 1000, 2),
+            "hold_avg_ms": round(self.hold_total / checkouts * 1000, 2),
+            "hold_max_ms": round(self.hold_max * 1000, 2),
+        }
+
+
+def call_site(skip: Tuple[str, ...] = ()) -> str:
+    """
+    Name of the function that asked for a connection, as 'module.function'.
+
+    Frames of contextlib and of functions named in skip (the pool's own
+    get_connection/get_cursor wrappers) are stepped over.
+    """
+    frame = sys._getframe(1)
+    while frame is not None and (
+        frame.f_code.co_filename == contextlib.__file__
+        or frame.f_code.co_name in skip
+    ):
+        frame = frame.f_back
+    if frame is None:
+        return "unknown"
+    module = frame.f_globals.get("__name__", "?")
+    return f"{module}.{frame.f_code.co_name}"
+
+
+class ManagedConnectionPool:
+    """
+    Blocking connection pool with queued checkouts, keepalive and adaptive sizing.
+
+    Use getconn()/putconn() in pairs; callers normally go through a
+    get_connection() context manager.
+    """
+
+    def __init__(
+        self,
+        dsn: str,
+        minconn: int = None,
+        maxconn: int = None,
+        timeout: float = None,
+        name: str = "default"
+    ):
+        """
+        Create the pool and open minconn connections.
+
+        Args:
+            dsn: PostgreSQL connection string
+            minconn: Connections always kept open (default: DB_POOL_MIN)
+            maxconn: Maximum open connections (default: DB_POOL_MAX)
+            timeout: Seconds a checkout waits (default: DB_POOL_TIMEOUT)
+            name: Pool label in stats and metrics
+        """
+        self.dsn = dsn
+        self.name = name
+        self.minconn = DB_POOL_MIN if minconn is None else minconn
+        self.maxconn = max(self.minconn, 1, DB_POOL_MAX if maxconn is None else maxconn)
+        self.timeout = DB_POOL_TIMEOUT if timeout is None else timeout
+
+        self._cond = threading.Condition()
+        # (connection, last returned); LIFO so hot connections stay hot
+        self._idle: Deque[Tuple[object, float]] = deque()
+        # id(connection) -> (call site, checkout time)
+        self._in_use: Dict[int, Tuple[str, float]] = {}
+        # Open connections, including ones being opened
+        self._size = 0
+        self._waiting = 0
+        self._closed = False
+
+        # Demand measured since the last resize
+        self._peak_in_use = 0
+        self._waited = 0
+
+        self._sites: Dict[str, _SiteStats] = {}
+        self._opened = 0
+        self._discarded = 0
+
+        for _ in range(self.minconn):
+            with self._cond:
+                self._size += 1
+            self._put_idle(self._open())
+
+        self._stop = threading.Event()
+        self._maintainer = threading.Thread(
+            target=self._maintain, name=f"db-pool-{name}", daemon=True
+        )
+        self._maintainer.start()
+        _pools.append(self)
+
+    # ---------- connections ----------
+
+    def _open(self):
+        try:
+            conn = psycopg2.connect(self.dsn)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        self._opened += 1
+        return conn
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._discarded += 1
+            # A waiter may now open a new connection
+            self._cond.notify()
+
+    def _put_idle(self, conn):
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @staticmethod
+    def _ping(conn) -> bool:
+        """Check a connection with SELECT 1."""
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    # ---------- checkout ----------
+
+    def _site(self, site: str) -> _SiteStats:
+        stats = self._sites.get(site)
+        if stats is None:
+            stats = self._sites[site] = _SiteStats()
+        return stats
+
+    def getconn(self, site: str = "unknown"):
+        """
+        Check out a connection, waiting up to the pool timeout for one.
+
+        Args:
+            site: Call site label for stats
+
+        Returns:
+            psycopg2 connection
+
+        Raises:
+            PoolTimeout: No connection became available in time
+            PoolError: The pool is closed
+        """
+        start = time.perf_counter()
+        deadline = time.monotonic() + self.timeout
+
+        while True:
+            conn = None
+            last_used = 0.0
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise PoolError("connection pool is closed")
+                    if self._idle:
+                        conn, last_used = self._idle.pop()
+                        break
+                    if self._size < self.maxconn:
+                        self._size += 1
+                        break
+
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._site(site).timeouts += 1
+                        DB_CHECKOUT_TIMEOUTS.inc(self.name, site)
+                        raise PoolTimeout(
+                            f"no connection available within {self.timeout}s "
+                            f"({self._size} open, {self._waiting} waiting)"
+                        )
+                    self._waiting += 1
+                    self._waited += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+
+            if conn is None:
+                conn = self._open()
+            elif conn.closed or (
+                time.monotonic() - last_used > VALIDATE_AFTER_IDLE and not self._ping(conn)
+            ):
+                logger.info(f"[{self.name}] Dropping dead idle connection")
+                self._discard(conn)
+                continue
+            break
+
+        wait = time.perf_counter() - start
+        with self._cond:
+            self._in_use[id(conn)] = (site, time.perf_counter())
+            self._peak_in_use = max(self._peak_in_use, len(self._in_use))
+            stats = self._site(site)
+            stats.checkouts += 1
+            stats.wait_total += wait
+            stats.wait_max = max(stats.wait_max, wait)
+        DB_CHECKOUT_WAIT.observe(wait, self.name, site)
+        return conn
+
+    def putconn(self, conn):
+        """Return a checked-out connection; broken ones are closed and replaced later."""
+        with self._cond:
+            site, checked_out = self._in_use.pop(id(conn), ("unknown", None))
+            if checked_out is not None:
+                hold = time.perf_counter() - checked_out
+                stats = self._site(site)
+                stats.hold_total += hold
+                stats.hold_max = max(stats.hold_max, hold)
+        if checked_out is not None:
+            DB_CONNECTION_HOLD.observe(hold, self.name, site)
+
+        if conn.closed or self._closed:
+            self._discard(conn)
+            return
+
+        status = conn.info.transaction_status
+        if status == TRANSACTION_STATUS_UNKNOWN:
+            self._discard(conn)
+            return
+        if status != TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except Exception:
+                self._discard(conn)
+                return
+
+        self._put_idle(conn)
+
+    # ---------- background maintenance ----------
+
+    def _keepalive(self):
+        """Ping connections idle for longer than the keepalive interval."""
+        now = time.monotonic()
+        with self._cond:
+            stale = [item for item in self._idle if now - item[1] >= DB_POOL_KEEPALIVE_INTERVAL]
+            for item in stale:
+                self._idle.remove(item)
+
+        for conn, _ in stale:
+            if not conn.closed and self._ping(conn):
+                self._put_idle(conn)
+            else:
+                logger.info(f"[{self.name}] Keepalive dropped a dead connection")
+                self._discard(conn)
+
+    def _resize(self):
+        """Shrink idle connections towards measured demand and refill up to minconn."""
+        with self._cond:
+            peak = max(self._peak_in_use, len(self._in_use))
+            # Checkouts had to wait: keep everything that is open
+            target = self._size if self._waited else peak + RESIZE_HEADROOM
+            target = max(self.minconn, min(self.maxconn, target))
+            self._peak_in_use = len(self._in_use)
+            self._waited = 0
+
+            surplus = []
+            while self._size - len(surplus) > target and self._idle:
+                # Oldest idle connections go first
+                surplus.append(self._idle.popleft()[0])
+
+        for conn in surplus:
+            self._discard(conn)
+        if surplus:
+            logger.info(f"[{self.name}] Pool shrunk by {len(surplus)} to {target}")
+
+        # Reserve one slot per connection opened: a failed _open() gives back
+        # only its own slot
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.minconn:
+                    break
+                self._size += 1
+            try:
+                self._put_idle(self._open())
+            except Exception as e:
+                logger.warning(f"[{self.name}] Could not refill pool: {e}")
+                break
+
+    def _maintain(self):
+        tick = max(1.0, min(DB_POOL_KEEPALIVE_INTERVAL, DB_POOL_RESIZE_INTERVAL) / 2)
+        last_resize = time.monotonic()
+        while not self._stop.wait(tick):
+            try:
+                self._keepalive()
+                if time.monotonic() - last_resize >= DB_POOL_RESIZE_INTERVAL:
+                    last_resize = time.monotonic()
+                    self._resize()
+            except Exception as e:
+                logger.error(f"[{self.name}] Pool maintenance failed: {e}")
+
+    # ---------- lifecycle / stats ----------
+
+    def closeall(self):
+        """Close idle connections and stop maintenance; in-use ones close when returned."""
+        self._stop.set()
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._cond.notify_all()
+        for conn in idle:
+            self._discard(conn)
+        if self in _pools:
+            _pools.remove(self)
+
+    def counts(self) -> Dict[str, int]:
+        with self._cond:
+            return {
+                "open": self._size,
+                "idle": len(self._idle),
+                "in_use": len(self._in_use),
+                "waiting": self._waiting,
+            }
+
+    def stats(self) -> dict:
+        """Pool occupancy, lifetime counters and per call site wait/hold stats."""
+        with self._cond:
+            sites = {site: stats.to_dict() for site, stats in self._sites.items()}
+        return {
+            **self.counts(),
+            "min": self.minconn,
+            "max": self.maxconn,
+            "saturation": round(len(self._in_use) / self.maxconn, 2),
+            "opened": self._opened,
+            "discarded": self._discarded,
+            "sites": sites,
+        }
+
+
+def _pool_connections() -> Dict[tuple, float]:
+    values = {}
+    for pool in list(_pools):
+        for state, count in pool.counts().items():
+            values[(pool.name, state)] = count
+    return values
+
+
+DB_POOL_CONNECTIONS.set_callback(_pool_connections)
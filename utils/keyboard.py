@@ -137,14 +137,21 @@ def create_product_detail_keyboard(product_id: int, category_id: int) -> InlineK
     return InlineKeyboardMarkup(keyboard)
 
 
-def create_confirm_purchase_keyboard(product_id: int) -> InlineKeyboardMarkup:
-    """Create keyboard for purchase confirmation."""
-    keyboard = [
-        [
-            InlineKeyboardButton("✅ Ya, Bayar", callback_data=f"confirm_buy_{product_id}"),
-            InlineKeyboardButton("❌ Batal", callback_data=f"prod_{product_id}"),
-        ],
-    ]
+def create_confirm_purchase_keyboard(product_id: int, pay_with_balance: bool = False) -> InlineKeyboardMarkup:
+    """
+    Create keyboard for purchase confirmation.
+    
+    Args:
+        product_id: Product being bought
+        pay_with_balance: Offer checkout with the user's balance (enough to cover the price)
+    """
+    keyboard = []
+    if pay_with_balance:
+        keyboard.append([InlineKeyboardButton("💰 Bayar dengan Saldo", callback_data=f"pay_balance_{product_id}")])
+    keyboard.append([
+        InlineKeyboardButton("✅ Ya, Bayar" if not pay_with_balance else "📱 Bayar QRIS", callback_data=f"confirm_buy_{product_id}"),
+        InlineKeyboardButton("❌ Batal", callback_data=f"prod_{product_id}"),
+    ])
     return InlineKeyboardMarkup(keyboard)
 
 
@@ -177,6 +184,22 @@ def create_order_keyboard(order_id: str, status: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(keyboard)
 
 
+def create_leaderboard_keyboard(period: str = None) -> InlineKeyboardMarkup:
+    """Create leaderboard period switcher; the current period is marked."""
+    periods = [
+        ("Semua", "menu_leaderboard", None),
+        ("Minggu Ini", "leaderboard_week", "week"),
+        ("Bulan Ini", "leaderboard_month", "month"),
+    ]
+    return InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton(f"• {label} •" if value == period else label, callback_data=data)
+            for label, data, value in periods
+        ],
+        [InlineKeyboardButton("🔙 Kembali", callback_data="back_menu")]
+    ])
+
+
 def create_back_keyboard(callback_data: str = "back_menu") -> InlineKeyboardMarkup:
     """Create simple back button keyboard."""
     return InlineKeyboardMarkup([
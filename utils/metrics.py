@@ -0,0 +1,383 @@
+"""
+Runner metrics in the Prometheus text format.
+
+A small in-process registry (counters, gauges, histograms) fed by cheap
+instrumentation hooks, and an aiohttp endpoint serving it on /metrics.
+
+Configuration (environment):
+    METRICS_HOST  Interface to bind (default 0.0.0.0)
+    METRICS_PORT  Port to bind, 0 disables the endpoint (default 9100).
+                  Shard worker N listens on METRICS_PORT + N.
+"""
+
+import asyncio
+import functools
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry: List["_Metric"] = []
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    """Base class of registered metrics."""
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: tuple) -> tuple:
+        if len(labels) != len(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}")
+        return tuple(str(label) for label in labels)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Monotonically increasing value."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {value}" for key, value in items]
+
+
+class Gauge(_Metric):
+    """Value that goes up and down, optionally read from a callback on scrape."""
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Iterable[str] = (),
+        callback: Optional[Callable[[], Dict[tuple, float]]] = None
+    ):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[tuple, float] = {}
+        self._callback = callback
+
+    def set(self, value: float, *labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_callback(self, callback: Callable[[], Dict[tuple, float]]):
+        """Read the values from callback() (mapping label tuple -> value) on scrape."""
+        self._callback = callback
+
+    def samples(self) -> List[str]:
+        if self._callback:
+            try:
+                items = list(self._callback().items())
+            except Exception as e:
+                logger.warning(f"Metric {self.name} callback failed: {e}")
+                items = []
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.label_names, tuple(map(str, key)))} {value}"
+            for key, value in items
+        ]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Iterable[str] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [bucket counts..., +Inf count, sum]
+        self._values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += 1
+            state[-1] += value
+
+    def time(self, *labels) -> "_Timer":
+        """Context manager observing the duration of its block."""
+        return _Timer(self, labels)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+
+        lines = []
+        for key, state in items:
+            for bound, count in zip(self.buckets, state):
+                labels = _format_labels(self.label_names, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.label_names, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {state[-2]}")
+            plain = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_count{plain} {state[-2]}")
+            lines.append(f"{self.name}_sum{plain} {state[-1]}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("_histogram", "_labels", "_start")
+
+    def __init__(self, histogram: Histogram, labels: tuple):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._start, *self._labels)
+        return False
+
+
+def render_metrics() -> str:
+    """Render every registered metric in the Prometheus text format."""
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+# ==================== RUNNER METRICS ====================
+
+BOT_UPDATES = Counter("bot_updates_total", "Updates received per bot", ["bot_id"])
+BOTS_RUNNING = Gauge("bots_running", "Bots running in this process")
+
+BOT_RESTARTS = Counter("bot_restarts_total", "Supervisor restarts per bot", ["bot_id"])
+BOTS_QUARANTINED = Gauge("bots_quarantined", "Bots quarantined after repeated failures")
+
+HANDLER_LATENCY = Histogram(
+    "handler_duration_seconds", "Handler callback latency", ["handler"]
+)
+HANDLER_ERRORS = Counter("handler_errors_total", "Handler callbacks that raised", ["handler"])
+
+DB_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent getting a connection from the pool",
+    ["pool", "site"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+)
+DB_CONNECTION_HOLD = Histogram(
+    "db_pool_connection_hold_seconds", "Time a connection stays checked out",
+    ["pool", "site"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0, 30.0)
+)
+DB_CHECKOUT_TIMEOUTS = Counter(
+    "db_pool_checkout_timeouts_total", "Checkouts that gave up waiting for a connection",
+    ["pool", "site"]
+)
+DB_POOL_CONNECTIONS = Gauge(
+    "db_pool_connections", "Pool connections by state (open, idle, in_use, waiting)",
+    ["pool", "state"]
+)
+
+CATALOG_CACHE_REQUESTS = Counter(
+    "catalog_cache_requests_total", "Catalog cache lookups by result (hit, miss)", ["result"]
+)
+
+PAKASIR_LATENCY = Histogram(
+    "pakasir_request_duration_seconds",
+    "Pakasir API call latency including retries, by outcome (ok, failed, error, circuit_open)",
+    ["operation", "outcome"]
+)
+PAKASIR_RETRIED = Counter(
+    "pakasir_retries_total", "Pakasir calls retried after a network error, timeout or 5xx", ["operation"]
+)
+PAKASIR_CIRCUIT_OPEN = Gauge(
+    "pakasir_circuit_open", "1 while the Pakasir circuit breaker is failing calls fast"
+)
+
+PAYMENTS_TRACKED = Gauge(
+    "payments_tracked", "Pending payments the reconciler is polling, by kind (order, deposit)", ["kind"]
+)
+PAYMENTS_SETTLED = Counter(
+    "payments_settled_total", "Payments settled by the reconciler, by kind", ["kind"]
+)
+PAYMENT_DELIVERY_DELAY = Histogram(
+    "payment_delivery_delay_seconds", "Time from Pakasir completion to settlement by the reconciler",
+    ["kind"],
+    buckets=(1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0, 900.0)
+)
+
+TELEGRAM_LATENCY = Histogram(
+    "telegram_api_duration_seconds", "Telegram Bot API call latency", ["method"]
+)
+TELEGRAM_RATE_LIMITED = Counter(
+    "telegram_api_rate_limited_total", "Telegram Bot API calls answered with 429", ["method"]
+)
+
+EVENT_LOOP_LAG = Gauge("event_loop_lag_seconds", "Latest measured event loop lag")
+EVENT_LOOP_LAG_HISTOGRAM = Histogram(
+    "event_loop_lag_distribution_seconds", "Event loop lag",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+)
+
+
+# ==================== INSTRUMENTATION HOOKS ====================
+
+def _handler_label(handler) -> str:
+    """Readable label of a handler: callback pattern, command or callback name."""
+    pattern = getattr(handler, "pattern", None)
+    if pattern is not None:
+        return getattr(pattern, "pattern", str(pattern))
+    commands = getattr(handler, "commands", None)
+    if commands:
+        return "/" + ",".join(sorted(commands))
+    callback = getattr(handler, "callback", None)
+    return getattr(callback, "__name__", type(handler).__name__)
+
+
+def instrument_handler(handler):
+    """
+    Wrap a handler's callback with latency and error metrics.
+
+    ConversationHandlers are instrumented through their entry points,
+    states and fallbacks. Returns the same handler.
+    """
+    from telegram.ext import ApplicationHandlerStop, ConversationHandler
+
+    if isinstance(handler, ConversationHandler):
+        for inner in handler.entry_points + handler.fallbacks:
+            instrument_handler(inner)
+        for state_handlers in handler.states.values():
+            for inner in state_handlers:
+                instrument_handler(inner)
+        return handler
+
+    callback = getattr(handler, "callback", None)
+    if callback is None or getattr(callback, "_instrumented", False):
+        return handler
+
+    label = _handler_label(handler)
+
+    @functools.wraps(callback)
+    async def timed(update, context):
+        start = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except ApplicationHandlerStop:
+            raise
+        except Exception:
+            HANDLER_ERRORS.inc(label)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - start, label)
+
+    timed._instrumented = True
+    handler.callback = timed
+    return handler
+
+
+async def monitor_event_loop(interval: float = 0.5):
+    """
+    Record event loop lag until cancelled.
+
+    Args:
+        interval: Seconds slept per sample; lag is how much later the loop woke up
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - start - interval)
+        EVENT_LOOP_LAG.set(lag)
+        EVENT_LOOP_LAG_HISTOGRAM.observe(lag)
+
+
+# ==================== ENDPOINT ====================
+
+class MetricsServer:
+    """aiohttp server exposing /metrics on the current event loop."""
+
+    def __init__(self, host: str = None, port: int = None):
+        self.host = host or METRICS_HOST
+        self.port = METRICS_PORT if port is None else port
+        self._runner = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.port > 0
+
+    async def start(self):
+        """Start serving (no-op when disabled or already running)."""
+        from aiohttp import web
+
+        if not self.enabled or self._runner:
+            return
+
+        async def handle_metrics(request):
+            return web.Response(
+                text=render_metrics(),
+                content_type="text/plain",
+                headers={"X-Content-Type-Options": "nosniff"}
+            )
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"📈 Metrics available on {self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,170 @@
+"""
+Bulk stock import shared by the admin bot, the API and database_pg.
+
+Lines are read from a stream (an uploaded .txt/.csv, a request body or a
+plain list), numbered and sent in batches of STOCK_IMPORT_BATCH with COPY
+into a temporary staging table, then merged into product_stock with one
+INSERT ... SELECT per batch. Lines whose content_hash already exists for
+the product, or repeats inside the upload, are skipped.
+
+The whole import is one transaction holding a per-product advisory lock, so
+two imports into the same product cannot add the same line twice.
+
+Tuning (environment):
+    STOCK_IMPORT_BATCH   Lines copied and merged per batch (default 5000)
+"""
+
+import codecs
+import io
+import os
+from typing import Awaitable, Callable, Iterable, Iterator, Optional, Union
+
+# Lines copied and merged per batch
+STOCK_IMPORT_BATCH = int(os.getenv("STOCK_IMPORT_BATCH", "5000"))
+
+# Bytes read per chunk from uploaded files and request bodies
+READ_CHUNK_SIZE = 64 * 1024
+
+# First key of the (namespace, product_id) advisory lock held during an import
+STOCK_IMPORT_LOCK = 21
+
+_LOCK_SQL = "SELECT pg_advisory_xact_lock(%s, %s)"
+
+_STAGING_SQL = """
+    CREATE TEMP TABLE IF NOT EXISTS stock_import (
+        line_no INTEGER NOT NULL,
+        content TEXT NOT NULL
+    ) ON COMMIT DROP
+"""
+
+_COPY_SQL = "COPY stock_import (line_no, content) FROM STDIN"
+
+# First occurrence of each new line, inserted in upload order so stock is
+# still sold first-in first-out
+_MERGE_SQL = """
+    INSERT INTO product_stock (product_id, content)
+    SELECT %s, fresh.content
+    FROM (
+        SELECT DISTINCT ON (decode(md5(s.content), 'hex')) s.line_no, s.content
+        FROM stock_import s
+        WHERE NOT EXISTS (
+            SELECT 1 FROM product_stock ps
+            WHERE ps.product_id = %s
+              AND ps.content_hash = decode(md5(s.content), 'hex')
+        )
+        ORDER BY decode(md5(s.content), 'hex'), s.line_no
+    ) fresh
+    ORDER BY fresh.line_no
+"""
+
+_CLEAR_SQL = "TRUNCATE stock_import"
+
+Progress = Callable[[dict], None]
+AsyncProgress = Callable[[dict], Awaitable[None]]
+
+
+def iter_lines(chunks: Iterable[Union[bytes, str]]) -> Iterator[str]:
+    """
+    Split a stream of byte (UTF-8) or text chunks into lines.
+
+    Only one chunk and one partial line are held in memory at a time.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    pending = ""
+    for chunk in chunks:
+        text = decoder.decode(chunk) if isinstance(chunk, (bytes, bytearray)) else chunk
+        lines = (pending + text).split("\n")
+        pending = lines.pop()
+        yield from lines
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+def read_chunks(stream, size: int = READ_CHUNK_SIZE) -> Iterator[bytes]:
+    """Read a file-like object in chunks."""
+    while True:
+        chunk = stream.read(size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_batches(lines: Iterable[str], size: int = STOCK_IMPORT_BATCH) -> Iterator[list[tuple[int, str]]]:
+    """Number the non-blank lines (stripped) and group them into batches."""
+    batch = []
+    for line_no, line in enumerate(lines, 1):
+        content = line.strip().replace("\x00", "")
+        if not content:
+            continue
+        batch.append((line_no, content))
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _copy_text(batch: list[tuple[int, str]]) -> str:
+    """Render a batch in COPY text format."""
+    return "".join(
+        f"{line_no}\t"
+        + content.replace("\\", "\\\\").replace("\t", "\\t").replace("\r", "\\r").replace("\n", "\\n")
+        + "\n"
+        for line_no, content in batch
+    )
+
+
+def _result(counts: dict) -> dict:
+    return {**counts, 'duplicates': counts['received'] - counts['added']}
+
+
+def import_stock_sync(cursor, product_id: int, lines: Iterable[str],
+                      progress: Optional[Progress] = None) -> dict:
+    """
+    Import stock lines on a psycopg2 cursor (caller commits).
+
+    Args:
+        cursor: Cursor of a connection inside a transaction
+        product_id: Product the lines are added to
+        lines: Stock lines, e.g. iter_lines(read_chunks(upload))
+        progress: Called after every batch with the counts so far
+
+    Returns:
+        {'received', 'added', 'duplicates'}
+    """
+    cursor.execute(_LOCK_SQL, (STOCK_IMPORT_LOCK, product_id))
+    cursor.execute(_STAGING_SQL)
+    counts = {'received': 0, 'added': 0}
+    for batch in iter_batches(lines):
+        cursor.copy_expert(_COPY_SQL, io.StringIO(_copy_text(batch)))
+        cursor.execute(_MERGE_SQL, (product_id, product_id))
+        counts['received'] += len(batch)
+        counts['added'] += cursor.rowcount
+        cursor.execute(_CLEAR_SQL)
+        if progress:
+            progress(_result(counts))
+    return _result(counts)
+
+
+async def import_stock_async(cursor, product_id: int, lines: Iterable[str],
+                             progress: Optional[AsyncProgress] = None) -> dict:
+    """
+    Import stock lines on a psycopg 3 async cursor (caller commits).
+
+    Same as import_stock_sync; progress is awaited.
+    """
+    await cursor.execute(_LOCK_SQL, (STOCK_IMPORT_LOCK, product_id))
+    await cursor.execute(_STAGING_SQL)
+    counts = {'received': 0, 'added': 0}
+    for batch in iter_batches(lines):
+        async with cursor.copy(_COPY_SQL) as copy:
+            for row in batch:
+                await copy.write_row(row)
+        await cursor.execute(_MERGE_SQL, (product_id, product_id))
+        counts['received'] += len(batch)
+        counts['added'] += cursor.rowcount
+        await cursor.execute(_CLEAR_SQL)
+        if progress:
+            await progress(_result(counts))
+    return _result(counts)
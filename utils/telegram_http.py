@@ -0,0 +1,178 @@
+"""
+Shared HTTP transport for all Telegram Application instances.
+
+Every bot built by BotManager uses the same two request objects (one for
+Bot API calls, one for getUpdates long-polling), so the whole process keeps
+a single set of keep-alive connections to api.telegram.org instead of one
+pool per bot.
+
+Tuning (environment):
+    TG_HTTP_POOL_SIZE         Max connections for API calls (default 256)
+    TG_HTTP_KEEPALIVE         Max idle keep-alive connections (default 64)
+    TG_HTTP_KEEPALIVE_EXPIRY  Seconds an idle connection is kept (default 30)
+    TG_HTTP2                  1 to use HTTP/2 for API calls (default 0)
+    TG_HTTP_CONNECT_TIMEOUT   Connect timeout in seconds (default 5)
+    TG_HTTP_READ_TIMEOUT      Read timeout in seconds (default 5)
+    TG_HTTP_WRITE_TIMEOUT     Write timeout in seconds (default 5)
+    TG_HTTP_POOL_TIMEOUT      Wait for a free connection in seconds (default 5)
+    TG_UPDATES_POOL_SIZE      Max concurrent getUpdates long-polls (default 512)
+"""
+import logging
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+import httpx
+from telegram.request import HTTPXRequest
+
+from utils.metrics import TELEGRAM_LATENCY, TELEGRAM_RATE_LIMITED
+
+logger = logging.getLogger(__name__)
+
+TG_HTTP_POOL_SIZE = int(os.getenv("TG_HTTP_POOL_SIZE", "256"))
+TG_HTTP_KEEPALIVE = int(os.getenv("TG_HTTP_KEEPALIVE", "64"))
+TG_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("TG_HTTP_KEEPALIVE_EXPIRY", "30"))
+TG_HTTP2 = os.getenv("TG_HTTP2", "0") == "1"
+TG_HTTP_CONNECT_TIMEOUT = float(os.getenv("TG_HTTP_CONNECT_TIMEOUT", "5"))
+TG_HTTP_READ_TIMEOUT = float(os.getenv("TG_HTTP_READ_TIMEOUT", "5"))
+TG_HTTP_WRITE_TIMEOUT = float(os.getenv("TG_HTTP_WRITE_TIMEOUT", "5"))
+TG_HTTP_POOL_TIMEOUT = float(os.getenv("TG_HTTP_POOL_TIMEOUT", "5"))
+TG_UPDATES_POOL_SIZE = int(os.getenv("TG_UPDATES_POOL_SIZE", "512"))
+
+
+class SharedHTTPXRequest(HTTPXRequest):
+    """
+    HTTPXRequest shared by many bots.
+
+    Bot.initialize()/shutdown() call initialize()/shutdown() on their request
+    objects; these are reference counted so the client is only closed when
+    the last bot using it shuts down. Connection reuse is tracked through
+    httpcore trace events.
+    """
+
+    def __init__(self, name: str, **kwargs):
+        self.name = name
+        self._users = 0
+        self._stats = {
+            'requests': 0,
+            'connections_created': 0,
+            'connections_closed': 0,
+        }
+
+        httpx_kwargs = kwargs.pop('httpx_kwargs', {})
+        httpx_kwargs.setdefault('event_hooks', {'request': [self._trace_request]})
+        super().__init__(httpx_kwargs=httpx_kwargs, **kwargs)
+
+    async def _trace_request(self, request: httpx.Request):
+        """Attach a trace callback so connection setup/teardown is counted."""
+        self._stats['requests'] += 1
+        request.extensions['trace'] = self._trace
+
+    async def _trace(self, event_name: str, info: dict):
+        if event_name == 'connection.connect_tcp.complete':
+            self._stats['connections_created'] += 1
+        elif event_name == 'connection.close.complete':
+            self._stats['connections_closed'] += 1
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        # url is .../bot<token>/<apiMethod>
+        api_method = url.rsplit('/', 1)[-1]
+        start = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+        finally:
+            TELEGRAM_LATENCY.observe(time.perf_counter() - start, api_method)
+        if code == 429:
+            TELEGRAM_RATE_LIMITED.inc(api_method)
+        return code, payload
+
+    async def initialize(self) -> None:
+        if self._users == 0:
+            await super().initialize()
+        self._users += 1
+
+    async def shutdown(self) -> None:
+        if self._users == 0:
+            return
+        self._users -= 1
+        if self._users == 0:
+            await super().shutdown()
+
+    def stats(self) -> Dict[str, int]:
+        """Connection statistics of this transport."""
+        created = self._stats['connections_created']
+        closed = self._stats['connections_closed']
+        return {
+            **self._stats,
+            'connections_open': max(0, created - closed),
+            'requests_reused_connection': max(0, self._stats['requests'] - created),
+            'bots': self._users,
+        }
+
+
+_shared: Optional[Tuple[SharedHTTPXRequest, SharedHTTPXRequest]] = None
+
+
+def get_shared_requests() -> Tuple[SharedHTTPXRequest, SharedHTTPXRequest]:
+    """
+    Get the process-wide (request, get_updates_request) pair.
+
+    Returns:
+        tuple: Request for Bot API calls, request for getUpdates
+    """
+    global _shared
+
+    if _shared is None:
+        limits = httpx.Limits(
+            max_connections=TG_HTTP_POOL_SIZE,
+            max_keepalive_connections=TG_HTTP_KEEPALIVE,
+            keepalive_expiry=TG_HTTP_KEEPALIVE_EXPIRY,
+        )
+        request = SharedHTTPXRequest(
+            "api",
+            connection_pool_size=TG_HTTP_POOL_SIZE,
+            connect_timeout=TG_HTTP_CONNECT_TIMEOUT,
+            read_timeout=TG_HTTP_READ_TIMEOUT,
+            write_timeout=TG_HTTP_WRITE_TIMEOUT,
+            pool_timeout=TG_HTTP_POOL_TIMEOUT,
+            http_version="2" if TG_HTTP2 else "1.1",
+            httpx_kwargs={'limits': limits},
+        )
+
+        # Each polling bot holds one connection for the whole long-poll, so
+        # this pool is sized for the number of bots, not for throughput.
+        # Read timeouts are supplied per call by the Updater.
+        updates_limits = httpx.Limits(
+            max_connections=TG_UPDATES_POOL_SIZE,
+            max_keepalive_connections=TG_UPDATES_POOL_SIZE,
+            keepalive_expiry=TG_HTTP_KEEPALIVE_EXPIRY,
+        )
+        get_updates_request = SharedHTTPXRequest(
+            "updates",
+            connection_pool_size=TG_UPDATES_POOL_SIZE,
+            connect_timeout=TG_HTTP_CONNECT_TIMEOUT,
+            write_timeout=TG_HTTP_WRITE_TIMEOUT,
+            pool_timeout=TG_HTTP_POOL_TIMEOUT,
+            httpx_kwargs={'limits': updates_limits},
+        )
+
+        _shared = (request, get_updates_request)
+        logger.info(
+            f"Shared Telegram transport: pool={TG_HTTP_POOL_SIZE}, "
+            f"keepalive={TG_HTTP_KEEPALIVE}, http2={TG_HTTP2}, "
+            f"updates_pool={TG_UPDATES_POOL_SIZE}"
+        )
+
+    return _shared
+
+
+def get_transport_stats() -> Dict[str, Dict[str, int]]:
+    """
+    Get connection statistics of the shared transport.
+
+    Returns:
+        dict: Stats per transport ('api', 'updates')
+    """
+    if _shared is None:
+        return {}
+    return {request.name: request.stats() for request in _shared}
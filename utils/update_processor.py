@@ -0,0 +1,138 @@
+"""
+Per-user ordered, cross-user concurrent update processing.
+
+Updates of different users of a bot are processed in parallel, while the
+updates of one user are processed strictly in arrival order, so
+ConversationHandler flows and multi-step purchases keep working.
+
+Limits (environment):
+    UPDATE_CONCURRENCY          Handlers running at once per bot (default 8)
+    UPDATE_CONCURRENCY_BY_TYPE  Overrides per bot_type, e.g. "store=16,sheerid=4"
+    UPDATE_BACKLOG_FACTOR       Updates accepted per running slot before the
+                                bot stops pulling new ones (default 8)
+
+A limit of 1 keeps python-telegram-bot's default sequential processing.
+"""
+
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Dict, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "8"))
+UPDATE_BACKLOG_FACTOR = int(os.getenv("UPDATE_BACKLOG_FACTOR", "8"))
+
+
+def _parse_type_limits(raw: str) -> Dict[str, int]:
+    """Parse "type=limit,type=limit" into a dict."""
+    limits = {}
+    for item in raw.split(","):
+        if "=" not in item:
+            continue
+        bot_type, limit = item.split("=", 1)
+        try:
+            limits[bot_type.strip()] = max(1, int(limit))
+        except ValueError:
+            logger.warning(f"Ignoring invalid UPDATE_CONCURRENCY_BY_TYPE entry: {item}")
+    return limits
+
+
+UPDATE_CONCURRENCY_BY_TYPE = _parse_type_limits(os.getenv("UPDATE_CONCURRENCY_BY_TYPE", ""))
+
+
+def get_concurrency_limit(bot_type: str) -> int:
+    """
+    Get the number of concurrently running handlers for a bot type.
+
+    Args:
+        bot_type: Bot type ('store', 'verification', ...)
+
+    Returns:
+        Concurrency limit (1 = sequential)
+    """
+    return max(1, UPDATE_CONCURRENCY_BY_TYPE.get(bot_type, UPDATE_CONCURRENCY))
+
+
+def _update_key(update: object) -> Optional[int]:
+    """Ordering key of an update: the user, or the chat for anonymous updates."""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user:
+        return update.effective_user.id
+    if update.effective_chat:
+        return update.effective_chat.id
+    return None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Update processor serializing per user and running users concurrently.
+
+    python-telegram-bot acquires its semaphore before handing the update
+    over, so that semaphore only bounds how many updates are in flight
+    (running or waiting for their user). The number of handlers actually
+    running is bounded by a second semaphore taken after the per-user lock,
+    so a user flooding the bot cannot occupy the slots of other users.
+    """
+
+    def __init__(self, max_running: int, backlog_factor: int = UPDATE_BACKLOG_FACTOR):
+        super().__init__(max_running * max(1, backlog_factor))
+        self.max_running = max_running
+        self._running = asyncio.Semaphore(max_running)
+        # key -> [lock, number of updates holding or waiting for it]
+        self._user_locks: Dict[int, list] = {}
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = _update_key(update)
+        if key is None:
+            async with self._running:
+                await coroutine
+            return
+
+        entry = self._user_locks.get(key)
+        if entry is None:
+            entry = self._user_locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self._running:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._user_locks.pop(key, None)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, int]:
+        """Snapshot of the processor state."""
+        return {
+            'limit': self.max_running,
+            'in_flight': self.current_concurrent_updates,
+            'users': len(self._user_locks),
+        }
+
+
+def build_update_processor(bot_type: str) -> Optional[PerUserUpdateProcessor]:
+    """
+    Build the update processor for a bot.
+
+    Args:
+        bot_type: Bot type
+
+    Returns:
+        PerUserUpdateProcessor, or None for sequential processing
+    """
+    limit = get_concurrency_limit(bot_type)
+    if limit <= 1:
+        return None
+    return PerUserUpdateProcessor(limit)
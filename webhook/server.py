@@ -4,9 +4,15 @@ Note: Currently not used - bot uses polling mode.
 """
 
 from flask import Flask, request, jsonify
-from datetime import datetime
+import asyncio
+import logging
 import threading
 
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for Pakasir to confirm a webhook's payment
+WEBHOOK_VERIFY_TIMEOUT = 15
+
 
 # Flask app for webhook
 app = Flask(__name__)
@@ -47,36 +53,101 @@ def pakasir_webhook():
         order_id = data.get("order_id")
         status = data.get("status")
         
-        print(f"📥 Webhook received: order_id={order_id}, status={status}")
+        logger.info(f"📥 Webhook received: order_id={order_id}, status={status}")
+        
+        if not order_id:
+            return jsonify({"error": "order_id required"}), 400
+        
+        if status != "completed":
+            return jsonify({"status": "ignored"}), 200
         
         # Import from database_pg for bot runner context
-        from database_pg import get_order_by_order_id, update_order_status
+        from database_pg import (
+            get_deposit_by_order_id, get_order_by_order_id, settle_deposit, settle_order
+        )
         
-        # Get order from database
-        order = get_order_by_order_id(order_id)
+        # Deposits and orders share the Pakasir order_id space (DEP... / ORD...)
+        is_deposit = order_id.startswith("DEP")
+        record = get_deposit_by_order_id(order_id) if is_deposit else get_order_by_order_id(order_id)
+        if not record:
+            logger.warning(f"⚠️ Order not found: {order_id}")
+            return jsonify({"error": "Order not found"}), 404
         
-        if not order:
-            print(f"⚠️ Order not found: {order_id}")
+        # The endpoint is unauthenticated: only settle what Pakasir itself
+        # reports as paid in full, otherwise leave it to the payment reconciler
+        if not _confirmed_by_pakasir(record):
+            logger.warning(f"⚠️ Webhook for {order_id} not confirmed by Pakasir, not settled")
+            return jsonify({"status": "unverified"}), 202
+        
+        result = settle_deposit(order_id) if is_deposit else settle_order(order_id)
+        if not result:
+            logger.warning(f"⚠️ Order not found: {order_id}")
             return jsonify({"error": "Order not found"}), 404
         
-        # Check if already processed
-        if order.get('status') == "paid":
-            print(f"ℹ️ Order already paid: {order_id}")
+        if not result['settled']:
+            record = result['deposit'] if is_deposit else result['order']
+            logger.info(f"ℹ️ Order already {record['status']}: {order_id}")
             return jsonify({"status": "already_processed"}), 200
         
-        # Process completed payment
-        if status == "completed":
-            # Update order status
-            update_order_status(order_id, "paid", datetime.now())
-            print(f"✅ Order {order_id} marked as paid")
+        logger.info(f"✅ Order {order_id} marked as paid")
+        _notify_buyer(order_id, result)
         
         return jsonify({"status": "success"}), 200
         
     except Exception as e:
-        print(f"❌ Webhook error: {e}")
+        logger.error(f"❌ Webhook error: {e}")
         return jsonify({"error": str(e)}), 500
 
 
+def _confirmed_by_pakasir(record: dict) -> bool:
+    """Ask Pakasir whether the order or deposit is completed for its full amount."""
+    from database_pg import get_bot_by_id
+    from services.pakasir import get_pakasir_client
+    
+    bot = get_bot_by_id(record['bot_id'])
+    if not bot or not bot.get('pakasir_slug') or not bot.get('pakasir_api_key'):
+        return False
+    
+    async def fetch_status():
+        client = get_pakasir_client(bot['pakasir_slug'], bot['pakasir_api_key'])
+        return await client.get_transaction_status(record['order_id'], record['amount'])
+    
+    # Use the bot's loop (and its shared Pakasir session) when there is one
+    if _loop is not None:
+        status = asyncio.run_coroutine_threadsafe(fetch_status(), _loop).result(WEBHOOK_VERIFY_TIMEOUT)
+    else:
+        status = asyncio.run(fetch_status())
+    
+    return bool(
+        status
+        and status.status == "completed"
+        and status.order_id == record['order_id']
+        and status.amount == record['amount']
+    )
+
+
+def _notify_buyer(order_id: str, result: dict):
+    """Send the buyer the settlement message through the bot, if one is set."""
+    if _bot is None or _loop is None:
+        return
+    
+    from handlers.store.deposit import format_deposit_credit
+    from handlers.store.order import format_order_delivery
+    
+    if order_id.startswith("DEP"):
+        chat_id = result['deposit']['telegram_id']
+        text = format_deposit_credit(result)
+    else:
+        chat_id = result['order']['telegram_id']
+        text = format_order_delivery(result)
+    
+    if chat_id:
+        asyncio.run_coroutine_threadsafe(
+            _bot.send_message(chat_id=chat_id, text=text, parse_mode="Markdown"),
+            _loop
+        )
+
+
 @app.route("/health", methods=["GET"])
 def health_check():
     """Health check endpoint."""
@@ -90,5 +161,5 @@ def run_webhook_server(port: int = 5001):
     
     thread = threading.Thread(target=run, daemon=True)
     thread.start()
-    print(f"🌐 Webhook server started on port {port}")
+    logger.info(f"🌐 Webhook server started on port {port}")
     return thread
@@ -0,0 +1,170 @@
+"""
+Telegram webhook ingress for the bot runner.
+One aiohttp server (running on the runner's event loop) receives updates
+for every bot on /tg/<bot_id>/<secret> and routes them to the matching
+Application.update_queue.
+"""
+
+import hashlib
+import hmac
+import logging
+import os
+from typing import Dict, Optional
+
+from aiohttp import web
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "5000"))
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "").rstrip("/")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+
+# Header Telegram sends back with the secret_token passed to setWebhook
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def webhook_secret(bot_id: int, token: str) -> str:
+    """
+    Derive the per-bot path secret.
+
+    Stable across restarts so registered webhooks stay valid, and never
+    exposes the bot token itself in the URL.
+    """
+    key = (WEBHOOK_SECRET or token).encode()
+    return hmac.new(key, f"{bot_id}:{token}".encode(), hashlib.sha256).hexdigest()[:32]
+
+
+class WebhookIngress:
+    """Single HTTP entry point for Telegram updates of all bots."""
+
+    def __init__(self, base_url: str = None, host: str = None, port: int = None):
+        """
+        Initialize webhook ingress.
+
+        Args:
+            base_url: Public HTTPS URL Telegram should call (default: WEBHOOK_BASE_URL)
+            host: Interface to bind (default: WEBHOOK_HOST)
+            port: Port to bind (default: WEBHOOK_PORT)
+        """
+        self.base_url = (base_url or WEBHOOK_BASE_URL).rstrip("/")
+        self.host = host or WEBHOOK_HOST
+        self.port = port or WEBHOOK_PORT
+
+        # bot_id -> (secret, BotInstance)
+        self._routes: Dict[int, tuple] = {}
+
+        self.app = web.Application()
+        self.app.router.add_post("/tg/{bot_id}/{secret}", self._handle_update)
+        self.app.router.add_get("/health", self._handle_health)
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def configured(self) -> bool:
+        """Whether a public base URL is available for webhook registration."""
+        return bool(self.base_url)
+
+    def url_for(self, bot_id: int, secret: str) -> str:
+        """Public webhook URL for a bot."""
+        return f"{self.base_url}/tg/{bot_id}/{secret}"
+
+    async def start(self):
+        """Start serving on the current event loop."""
+        if self._runner:
+            return
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        logger.info(f"🌐 Webhook ingress listening on {self.host}:{self.port}")
+
+    async def stop(self):
+        """Stop serving."""
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+        self._routes.clear()
+
+    async def register(self, instance) -> str:
+        """
+        Route updates for a bot and point its Telegram webhook here.
+
+        Args:
+            instance: BotInstance (its Application must be initialized)
+
+        Returns:
+            The registered webhook URL
+        """
+        secret = webhook_secret(instance.bot_id, instance.app.bot.token)
+        self._routes[instance.bot_id] = (secret, instance)
+
+        url = self.url_for(instance.bot_id, secret)
+        await instance.app.bot.set_webhook(
+            url=url,
+            secret_token=secret,
+            allowed_updates=Update.ALL_TYPES,
+            drop_pending_updates=True
+        )
+        return url
+
+    def unregister(self, bot_id: int):
+        """Stop routing updates for a bot (the Telegram webhook is kept)."""
+        self._routes.pop(bot_id, None)
+
+    async def refresh(self, instance) -> bool:
+        """
+        Re-register a bot's webhook if Telegram lost or changed it.
+
+        Returns:
+            True if the webhook had to be set again
+        """
+        route = self._routes.get(instance.bot_id)
+        if not route:
+            return False
+
+        secret, _ = route
+        url = self.url_for(instance.bot_id, secret)
+        info = await instance.app.bot.get_webhook_info()
+        if info.url == url:
+            return False
+
+        await instance.app.bot.set_webhook(
+            url=url,
+            secret_token=secret,
+            allowed_updates=Update.ALL_TYPES
+        )
+        logger.warning(f"[{instance.bot_username}] Webhook was '{info.url}', re-registered")
+        return True
+
+    async def _handle_update(self, request: web.Request) -> web.Response:
+        """Receive one update and hand it to the bot's update queue."""
+        try:
+            bot_id = int(request.match_info["bot_id"])
+        except ValueError:
+            return web.Response(status=404)
+
+        route = self._routes.get(bot_id)
+        if not route:
+            return web.Response(status=404)
+
+        secret, instance = route
+        if not (
+            hmac.compare_digest(request.match_info["secret"], secret)
+            and hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret)
+        ):
+            return web.Response(status=403)
+
+        try:
+            data = await request.json()
+            update = Update.de_json(data, instance.app.bot)
+        except Exception as e:
+            logger.error(f"[{instance.bot_username}] Invalid webhook payload: {e}")
+            return web.Response(status=400)
+
+        await instance.app.update_queue.put(update)
+        return web.Response()
+
+    async def _handle_health(self, request: web.Request) -> web.Response:
+        """Health check endpoint."""
+        return web.json_response({"status": "healthy", "bots": len(self._routes)})